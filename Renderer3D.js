@@ -1613,9 +1613,9 @@ const Renderer3D = {
         projectEntity(powerupGroupMap, stateToRender.powerups, getPowerupTopY);
 
         // Project damage text origins (server coords need mapping first)
-        if (stateToRender.damage_texts) {
-            for(const id in stateToRender.damage_texts){
-                const dt = stateToRender.damage_texts[id];
+        if (localEffects?.damageTexts) {
+            for(const id in localEffects.damageTexts){
+                const dt = localEffects.damageTexts[id];
                 // Map server coords to world, apply offset, then project
                 mapServerToWorld(dt.x, dt.y, _vector3_B);
                 _vector3_B.y = PLAYER_TOTAL_VISUAL_HEIGHT * 0.8; // Approx Y offset for damage text origin
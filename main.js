@@ -8,16 +8,20 @@ console.log("--- main.js: Initializing Client ---");
 // --- Constants ---
 const WEBSOCKET_URL = 'wss://such-is-life.glitch.me/ws'; // Production Glitch URL
 // const WEBSOCKET_URL = 'ws://localhost:8765/ws'; // Local Dev URL
-const SHOOT_COOLDOWN = 100; // Base milliseconds between shots
+const SHOOT_COOLDOWN = 100; // Base milliseconds between local shot effects (server owns the real fire cadence)
 const RAPID_FIRE_COOLDOWN_MULTIPLIER = 0.4; // Multiplier for rapid fire ammo
 const INPUT_SEND_INTERVAL = 33; // Milliseconds between sending input updates (approx 30hz)
+const AIM_UPDATE_MIN_DELTA = 2; // Server units the aim must move before a held trigger sends aim_update
 const RECONNECT_DELAY = 3000; // Milliseconds before attempting reconnect
+const RESUME_RETRY_DELAY = 1000; // Milliseconds between resume_session attempts after a dropped connection
+const RESUME_MAX_ATTEMPTS = 10; // Server holds the slot for ~20s
 const DEFAULT_WORLD_WIDTH = 1600; // Default world size if not provided by server
 const DEFAULT_WORLD_HEIGHT = 900;
 const DEFAULT_PLAYER_RADIUS = 12; // Should match server PLAYER_DEFAULTS['radius']
 const INTERPOLATION_BUFFER_MS = 100; // Delay rendering to allow interpolation
 const SPEECH_BUBBLE_DURATION_MS = 4000; // How long player speech bubbles last
 const ENEMY_SPEECH_BUBBLE_DURATION_MS = 3000; // How long enemy speech bubbles last
+const DAMAGE_TEXT_LIFETIME_MS = 750; // How long a floating damage number lasts (crits last 1.5x)
 const PUSHBACK_ANIM_DURATION = 250; // Duration of visual pushback effect
 const MUZZLE_FLASH_DURATION = 75; // Duration of muzzle flash visual effect
 const RESIZE_DEBOUNCE_MS = 150; // Debounce window resize events
@@ -67,6 +71,8 @@ let appState = {
     localPlayerAimState: { lastAimDx: 0, lastAimDy: -1 }, // Last calculated aim direction
     // --- UI & Environment ---
     uiPositions: {}, // Screen coordinates for overlay elements { entityId: { screenX, screenY } }
+    viewServerTime: null, // Server timestamp of the interpolated state being rendered (sent with shots for lag compensation)
+    bullets: {}, // Bullets announced by 'bullet_spawn' events, extrapolated locally { id: { x, y, vx, vy, t, until, ... } }
     currentTemp: 18.0,
     isRaining: false,
     isDustStorm: false,
@@ -79,8 +85,12 @@ let localEffects = {
     muzzleFlash: { active: false, endTime: 0, aimDx: 0, aimDy: 0 },
     pushbackAnim: { active: false, endTime: 0, duration: PUSHBACK_ANIM_DURATION },
     // Snake state is now primarily driven by server state, but keep structure if needed later
-    snake: { active: false, segments: [] } // Client might reconstruct visual segments here if needed
+    snake: { active: false, segments: [] }, // Client might reconstruct visual segments here if needed
+    // Spawned from server 'hit'/'speech' events and animated/expired purely client-side
+    damageTexts: {}, // { id: { text, x, y, is_crit, spawnTime, lifetime } } (x/y in server coords)
+    enemySpeech: null, // { speakerId, text, endTime }
 };
+let damageTextCounter = 0;
 
 // --- Overlay Element Pooling ---
 // Reuses DOM elements for overlays to improve performance
@@ -92,6 +102,8 @@ const overlayElementPools = {
 // --- Network & Timers ---
 let socket = null;
 let reconnectTimer = null;
+let resumeToken = null; // Issued with game_created/game_joined/sp_game_started; lets us rejoin after a drop
+let resumeAttempts = 0;
 let lastLoopTime = 0; // For calculating deltaTime in game loop
 let resizeHandler = null; // Debounced resize handler
 let lastFootstepTime = 0; // Timer for footstep sounds
@@ -435,10 +447,9 @@ const UIManager = (() => {
             }
         };
 
-        // --- Update Damage Texts ---
-        if (state.damage_texts) {
-            for (const id in state.damage_texts) {
-                const dtData = state.damage_texts[id];
+        // --- Update Damage Texts (client-side, spawned from 'hit' events) ---
+        for (const id in localEffects.damageTexts) {
+                const dtData = localEffects.damageTexts[id];
                 const posData = uiPos[id]; // Get pre-calculated screen position
                 if (!posData) continue; // Skip if position not available
 
@@ -448,17 +459,14 @@ const UIManager = (() => {
                 element.classList.toggle('crit', dtData.is_crit || false); // Add crit class if needed
 
                 // Calculate animation progress for fading/rising effect
-                const lifeTime = (dtData.lifetime || 0.75) * 1000;
-                const spawnTime = dtData.spawn_time * 1000; // Server timestamp
-                const elapsed = now - spawnTime;
-                const progress = Math.min(1, elapsed / lifeTime);
+                const elapsed = now - dtData.spawnTime;
+                const progress = Math.min(1, elapsed / dtData.lifetime);
                 const verticalOffset = -(progress * 50); // Text rises over time
 
                 // Set element position and opacity
                 element.style.left = `${posData.screenX}px`;
                 element.style.top = `${posData.screenY + verticalOffset}px`;
                 element.style.opacity = Math.max(0, 1.0 - (progress * 0.9)).toFixed(2); // Fade out
-            }
         }
         // Release inactive damage text elements
         for (const id in pools.damageText.elements) {
@@ -475,13 +483,10 @@ const UIManager = (() => {
                 }
             });
         }
-        // Enemy speech bubble (sent as top-level fields)
-        if (state.enemy_speaker_id && state.enemy_speech_text) {
-            currentBubbles[state.enemy_speaker_id] = {
-                text: state.enemy_speech_text,
-                endTime: now + ENEMY_SPEECH_BUBBLE_DURATION_MS, // Server doesn't send duration, use client constant
-                source: 'enemy'
-            };
+        // Enemy speech bubble (from the last 'speech' event, held for a client-side duration)
+        const speech = localEffects.enemySpeech;
+        if (speech && state.enemies?.[speech.speakerId]) {
+            currentBubbles[speech.speakerId] = { text: speech.text, endTime: speech.endTime, source: 'enemy' };
         }
 
         // Process active speech bubbles
@@ -490,8 +495,8 @@ const UIManager = (() => {
             const posData = uiPos[id]; // Get screen position for the speaker
             if (!posData) continue; // Skip if speaker not visible/projected
 
-            // Skip expired player bubbles (server manages enemy bubble duration via presence)
-            if (bubbleData.source === 'player' && bubbleData.endTime && now > bubbleData.endTime) continue;
+            // Skip expired bubbles
+            if (bubbleData.endTime && now > bubbleData.endTime) continue;
 
             activeElements.speechBubble.add(id); // Mark as active
             const element = getElement('speechBubble', id, 'overlay-element speech-bubble');
@@ -518,6 +523,8 @@ const UIManager = (() => {
 
 // === Network Manager Module ===
 const NetworkManager = (() => {
+    let serverUrl = WEBSOCKET_URL; // Switched by a cluster 'redirect' to the node that owns our game
+
     // Attempt to establish WebSocket connection
     function connect(onOpenCallback) {
         // Avoid reconnecting if already connected or connecting
@@ -527,9 +534,9 @@ const NetworkManager = (() => {
         }
         clearTimeout(reconnectTimer); // Clear any pending reconnect attempts
         UIManager.updateStatus('Connecting...');
-        log("WS connect:", WEBSOCKET_URL);
+        log("WS connect:", serverUrl);
         try {
-            socket = new WebSocket(WEBSOCKET_URL); // Create new WebSocket instance
+            socket = new WebSocket(serverUrl); // Create new WebSocket instance
         } catch (err) {
             error("WS creation failed:", err);
             UIManager.updateStatus('Connection failed.', true);
@@ -562,6 +569,13 @@ const NetworkManager = (() => {
             socket = null; // Clear socket reference
             GameManager.cleanupLoop(); // Stop game loop if running
 
+            // Dropped mid-game: keep our state and try to resume the same session
+            if ((wasConnected || resumeAttempts > 0) && resumeToken && appState.mode !== 'menu' && event.code !== 1000) {
+                UIManager.updateStatus(event.code === 4001 ? 'Server restarting. Rejoining...' : 'Connection lost. Rejoining...', true);
+                scheduleResume();
+                return;
+            }
+
             // If game was active, reset state but don't show menu immediately (allow reconnect attempt)
             if (appState.mode !== 'menu') GameManager.resetClientState(false);
 
@@ -593,6 +607,45 @@ const NetworkManager = (() => {
         }, RECONNECT_DELAY);
     }
 
+    // Reconnect and ask the server to re-attach us to our game (server holds the slot for a grace period)
+    function scheduleResume() {
+        clearTimeout(reconnectTimer);
+        if (resumeAttempts >= RESUME_MAX_ATTEMPTS) {
+            log("Resume attempts exhausted.");
+            resumeFailed();
+            return;
+        }
+        resumeAttempts++;
+        reconnectTimer = setTimeout(() => {
+            log(`Attempting session resume (${resumeAttempts}/${RESUME_MAX_ATTEMPTS})...`);
+            connect(() => sendMessage({ type: 'resume_session', token: resumeToken }));
+        }, resumeAttempts === 1 ? 0 : RESUME_RETRY_DELAY);
+    }
+
+    function setResumeToken(token) {
+        resumeToken = token || null;
+        resumeAttempts = 0;
+    }
+
+    function resumeFailed() {
+        setResumeToken(null);
+        GameManager.resetClientState(true);
+        UIManager.updateStatus('Could not rejoin the game.', true);
+    }
+
+    // Cluster mode: the game lives on another node. Drop this socket quietly and retry the request there.
+    function redirect(url, retryPayload) {
+        log(`Redirected to ${url}`);
+        serverUrl = url;
+        if (socket) {
+            socket.onclose = null; // Not a drop: no resume/reconnect handling
+            socket.close(1000, "Redirected");
+            socket = null;
+        }
+        appState.isConnected = false;
+        connect(() => sendMessage(retryPayload));
+    }
+
     // Send JSON payload to the server
     function sendMessage(payload) {
         if (socket && socket.readyState === WebSocket.OPEN) {
@@ -610,6 +663,7 @@ const NetworkManager = (() => {
     // Close the WebSocket connection gracefully
     function closeConnection(code = 1000, reason = "User action") {
         clearTimeout(reconnectTimer); // Cancel any pending reconnects
+        setResumeToken(null); // Deliberate close: nothing to resume
         if (socket && socket.readyState === WebSocket.OPEN) {
             log(`Closing WS connection: ${reason} (${code})`);
             socket.close(code, reason);
@@ -618,7 +672,7 @@ const NetworkManager = (() => {
         appState.isConnected = false;
     }
 
-    return { connect, sendMessage, closeConnection };
+    return { connect, sendMessage, closeConnection, setResumeToken, resumeFailed, redirect };
 })();
 
 
@@ -630,6 +684,8 @@ const InputManager = (() => {
     let mouseScreenPos = { x: 0, y: 0 }; // Mouse position relative to canvas
     let isMouseDown = false; // Left mouse button state
     let isRightMouseDown = false; // Right mouse button state
+    let triggerHeld = false; // Whether the server currently thinks our fire button is down
+    let lastSentAim = null; // Aim target last sent with trigger_down/aim_update
 
     // THREE.js objects for mouse->world position calculation
     const raycaster = new THREE.Raycaster();
@@ -674,6 +730,8 @@ const InputManager = (() => {
         inputInterval = null;
         // Reset input states
         keys = {}; isMouseDown = false; isRightMouseDown = false;
+        if (triggerHeld) NetworkManager.sendMessage({ type: 'trigger_up' });
+        triggerHeld = false; lastSentAim = null;
         mouseScreenPos = { x: 0, y: 0 };
     }
 
@@ -791,6 +849,35 @@ const InputManager = (() => {
         // Only send if in game, connected, and player exists
         if (appState.mode !== 'menu' && appState.serverState?.status === 'active' && appState.isConnected && appState.localPlayerId) {
             NetworkManager.sendMessage({ type: 'player_move', direction: getMovementInputVector() });
+            // While the trigger is held the server keeps firing; just keep its aim current
+            if (triggerHeld) {
+                const aim = getAimTarget();
+                if (!lastSentAim || Math.abs(aim.x - lastSentAim.x) > AIM_UPDATE_MIN_DELTA || Math.abs(aim.y - lastSentAim.y) > AIM_UPDATE_MIN_DELTA) {
+                    NetworkManager.sendMessage({ type: 'aim_update', target: aim, view_time: appState.viewServerTime });
+                    lastSentAim = aim;
+                }
+            }
+        }
+    }
+
+    // Mouse position in server coordinates (falls back to the player's own position)
+    function getAimTarget() {
+        return Renderer3D.mapWorldToServer
+            ? Renderer3D.mapWorldToServer(appState.mouseWorldPosition)
+            : { x: appState.predictedPlayerPos.x, y: appState.predictedPlayerPos.y };
+    }
+
+    // Tell the server when the fire button goes down/up; it owns the fire cadence in between
+    function updateTrigger() {
+        const wantsFire = (keys[' '] || isMouseDown) && appState.serverState?.status === 'active' && appState.isConnected;
+        if (wantsFire === triggerHeld) return;
+        triggerHeld = wantsFire;
+        if (wantsFire) {
+            lastSentAim = getAimTarget();
+            NetworkManager.sendMessage({ type: 'trigger_down', target: lastSentAim, view_time: appState.viewServerTime });
+        } else {
+            NetworkManager.sendMessage({ type: 'trigger_up' });
+            lastSentAim = null;
         }
     }
 
@@ -823,9 +910,7 @@ const InputManager = (() => {
         const playerPredictZ = appState.predictedPlayerPos.y; // Use Z from appState (server Y)
 
         // Convert mouse world position (THREE.js coords) to server coordinates (top-left origin)
-        const mouseServerCoords = Renderer3D.mapWorldToServer
-            ? Renderer3D.mapWorldToServer(appState.mouseWorldPosition)
-            : { x: playerPredictX, y: playerPredictZ }; // Fallback if mapping unavailable
+        const mouseServerCoords = getAimTarget();
 
         let aimDx = 0, aimDy = -1; // Default aim up (server Y-down)
         if (mouseServerCoords && typeof playerPredictX === 'number' && typeof playerPredictZ === 'number') {
@@ -861,15 +946,14 @@ const InputManager = (() => {
             Renderer3D.spawnVisualAmmoCasing(spawnPos, ejectVec);
         }
 
-        // --- Send Shoot Message to Server ---
-        // Send the calculated target coordinates (server coordinate system)
-        NetworkManager.sendMessage({ type: 'player_shoot', target: mouseServerCoords });
+        // No per-shot message: bullets come from the server's held-trigger cadence (see updateTrigger)
     }
 
     // Called every frame by the game loop
     function update(deltaTime) {
         // Handle continuous shooting if space or left mouse is held down
-        if (keys[' ']) handleShooting();
+        updateTrigger();
+        if (keys[' ']) handleShooting(); // Local muzzle flash/sound/casings only
         if (isMouseDown) handleShooting();
 
         // Play footstep sounds if moving and alive
@@ -907,6 +991,7 @@ const GameManager = (() => {
         DOM.hostGameBtn2?.addEventListener('click', () => hostHandler(2));
         DOM.hostGameBtn3?.addEventListener('click', () => hostHandler(3));
         DOM.hostGameBtn4?.addEventListener('click', () => hostHandler(4));
+        DOM.quickMatchBtn?.addEventListener('click', () => { SoundManager.init(); quickMatch(); });
         DOM.showJoinUIBtn?.addEventListener('click', () => { SoundManager.playSound('ui_click', UI_CLICK_VOLUME); UIManager.showSection('joinCodeSection'); });
 
         // --- Join Game ---
@@ -968,6 +1053,16 @@ const GameManager = (() => {
         NetworkManager.connect(() => NetworkManager.sendMessage({ type: 'join_game', game_id: gameId }));
     }
 
+    // Server drops us into the fullest open public lobby, or hosts a new public one
+    function quickMatch(maxPlayers = null) {
+        log(`Requesting quick match (${maxPlayers || 'any'}p)...`);
+        appState.mode = 'multiplayer-client';
+        UIManager.updateStatus("Finding a game...");
+        const msg = { type: 'quick_join' };
+        if (maxPlayers) msg.max_players = maxPlayers;
+        NetworkManager.connect(() => NetworkManager.sendMessage(msg));
+    }
+
     function hostMultiplayer(maxPlayers) {
         log(`Hosting MP game (${maxPlayers}p)...`);
         if (![2, 3, 4].includes(maxPlayers)) {
@@ -1030,10 +1125,10 @@ const GameManager = (() => {
             lastStateReceiveTime: performance.now(),
             mouseWorldPosition: new THREE.Vector3(0,0,0),
             localPlayerAimState: { lastAimDx: 0, lastAimDy: -1 },
-            uiPositions: {}, currentTemp: 18.0, isRaining: false, isDustStorm: false, isNight: false,
+            uiPositions: {}, viewServerTime: null, bullets: {}, currentTemp: 18.0, isRaining: false, isDustStorm: false, isNight: false,
         };
         // Reset local effects
-        localEffects = { muzzleFlash: { active: false, endTime: 0, aimDx: 0, aimDy: 0 }, pushbackAnim: { active: false, endTime: 0, duration: PUSHBACK_ANIM_DURATION }, snake: { active: false, segments: [] } };
+        localEffects = { muzzleFlash: { active: false, endTime: 0, aimDx: 0, aimDy: 0 }, pushbackAnim: { active: false, endTime: 0, duration: PUSHBACK_ANIM_DURATION }, snake: { active: false, segments: [] }, damageTexts: {}, enemySpeech: null };
 
 
         // Reset UI elements (check if they exist in DOM cache first)
@@ -1092,6 +1187,7 @@ const GameManager = (() => {
         // If no previous state or timestamps invalid, return current state directly
         // Also apply renderedPlayerPos to local player in this case
         if (!lastState || !serverState.timestamp || !lastState.timestamp || serverState.timestamp <= lastState.timestamp) {
+            appState.viewServerTime = serverState.timestamp || null;
             // Make a deep copy to avoid modifying the original server state
             let currentStateCopy = JSON.parse(JSON.stringify(serverState));
             // Apply the smoothed/reconciled position to the local player
@@ -1101,6 +1197,7 @@ const GameManager = (() => {
             }
             // Include snake state (basic info from server)
             currentStateCopy.snake_state = serverState.snake_state;
+            currentStateCopy.bullets = extrapolateBullets(appState.viewServerTime);
             return currentStateCopy;
         }
 
@@ -1113,6 +1210,8 @@ const GameManager = (() => {
         const renderTargetTime = renderTime - INTERPOLATION_BUFFER_MS; // Target rendering time in the past
         const timeSinceLastState = renderTargetTime - lastServerTime;
         let t = Math.max(0, Math.min(1, timeSinceLastState / timeBetweenStates)); // Clamp t between 0 and 1
+        // Server time of what we're showing; sent with shots so the server can rewind enemies to match
+        appState.viewServerTime = lerp(lastState.timestamp, serverState.timestamp, t);
 
         // Create a deep copy of the current server state to modify
         let interpolatedState = JSON.parse(JSON.stringify(serverState));
@@ -1147,17 +1246,8 @@ const GameManager = (() => {
             }
         }
 
-        // Interpolate Bullets
-        if (interpolatedState.bullets) {
-            for (const bId in interpolatedState.bullets) {
-                const currentB = serverState.bullets[bId];
-                const lastB = lastState.bullets?.[bId];
-                if (lastB && typeof currentB.x === 'number' && typeof lastB.x === 'number') {
-                    interpolatedState.bullets[bId].x = lerp(lastB.x, currentB.x, t);
-                    interpolatedState.bullets[bId].y = lerp(lastB.y, currentB.y, t);
-                }
-            }
-        }
+        // Bullets aren't in snapshots; place each one along its line at the rendered server time
+        interpolatedState.bullets = extrapolateBullets(appState.viewServerTime);
 
         // Include snake state (basic info from server)
         interpolatedState.snake_state = serverState.snake_state;
@@ -1165,6 +1255,21 @@ const GameManager = (() => {
         return interpolatedState;
     }
 
+    // Straight-line bullet positions at server time viewTime; drops bullets past their 'until'
+    function extrapolateBullets(viewTime) {
+        const result = {};
+        if (!viewTime) return result;
+        for (const id in appState.bullets) {
+            const b = appState.bullets[id];
+            if (viewTime >= b.until) { delete appState.bullets[id]; continue; }
+            if (viewTime < b.t) continue; // Not fired yet at the time being shown
+            const dt = viewTime - b.t;
+            result[id] = { x: b.x + b.vx * dt, y: b.y + b.vy * dt, vx: b.vx, vy: b.vy,
+                           radius: b.radius, bullet_type: b.bullet_type, owner_type: b.owner_type };
+        }
+        return result;
+    }
+
     // Predict the local player's position based on input
     function updatePredictedPosition(deltaTime) {
         if (!appState.localPlayerId || !appState.serverState?.players?.[appState.localPlayerId]) return;
@@ -1238,6 +1343,11 @@ const GameManager = (() => {
         // Update local effect timers (e.g., muzzle flash end)
         if (localEffects.pushbackAnim.active && now >= localEffects.pushbackAnim.endTime) localEffects.pushbackAnim.active = false;
         if (localEffects.muzzleFlash.active && now >= localEffects.muzzleFlash.endTime) localEffects.muzzleFlash.active = false;
+        for (const id in localEffects.damageTexts) {
+            const dt = localEffects.damageTexts[id];
+            if (now - dt.spawnTime >= dt.lifetime) delete localEffects.damageTexts[id];
+        }
+        if (localEffects.enemySpeech && now >= localEffects.enemySpeech.endTime) localEffects.enemySpeech = null;
 
         // --- Prediction & Reconciliation (Only if game is active) ---
         if (appState.serverState?.status === 'active') {
@@ -1287,6 +1397,8 @@ const GameManager = (() => {
         appState.predictedPlayerPos = { x: startX, y: startY };
         appState.renderedPlayerPos = { x: startX, y: startY };
         appState.localPlayerAimState = { lastAimDx: 0, lastAimDy: -1 }; // Reset aim
+        appState.bullets = {};
+        handleGameEvents(state?.events); // Resumed sessions get the bullets already in flight
 
         // Initialize Renderer if not already done
         if (!appState.isRendererReady && DOM.canvasContainer) {
@@ -1380,51 +1492,58 @@ const GameManager = (() => {
             Renderer3D.triggerShake(shakeMag, shakeDur);
             // Play snake bite sound? SoundManager.playSound('snake_bite');
         }
+    }
 
-        // --- Enemy Hit Feedback (Visual Sparks & Sound) ---
-        if (newState.enemies && Renderer3D.triggerVisualHitSparks) {
-            const now = performance.now();
-            for (const eId in newState.enemies) {
-                const enemy = newState.enemies[eId];
-                const prevE = appState.lastServerState?.enemies?.[eId];
-                // Check if enemy took damage *this tick* based on last_damage_time
-                if (enemy?.last_damage_time && (!prevE || enemy.last_damage_time > (prevE.last_damage_time || 0))) {
-                    // Check if the damage event is recent enough to warrant feedback
-                    if (now - (enemy.last_damage_time * 1000) < 150) { // Allow slight delay
-                        // Map server position to world position for sparks
+    // Handle one-off gameplay events delivered with a game_state (each is sent exactly once)
+    function handleGameEvents(events) {
+        if (!Array.isArray(events) || events.length === 0) return;
+        const now = performance.now();
+        for (const ev of events) {
+            switch (ev.type) {
+                case 'hit': {
+                    // Floating damage number, jittered sideways so stacked hits stay readable
+                    const id = `dt-${++damageTextCounter}`;
+                    localEffects.damageTexts[id] = {
+                        text: String(ev.amount), x: ev.x + (Math.random() - 0.5) * 12, y: ev.y, is_crit: !!ev.crit,
+                        spawnTime: now, lifetime: DAMAGE_TEXT_LIFETIME_MS * (ev.crit ? 1.5 : 1.0),
+                    };
+                    const enemy = appState.serverState?.enemies?.[ev.target_id];
+                    if (enemy && Renderer3D.triggerVisualHitSparks) {
                         const enemyPos = Renderer3D.mapServerToWorld(enemy.x, enemy.y);
-                        // Adjust Y position for sparks (e.g., center of enemy)
                         enemyPos.y = (enemy.height / 2 || DEFAULT_PLAYER_RADIUS * 1.5);
-                        Renderer3D.triggerVisualHitSparks(enemyPos, 5); // Trigger sparks
-                        SoundManager.playSound('enemy_hit', 0.6); // Play hit sound
-
-                        // Play death sound if health just dropped to zero
-                        if (enemy.health <= 0 && prevE && prevE.health > 0) {
-                            SoundManager.playSound('enemy_death', 0.7);
-                        }
+                        Renderer3D.triggerVisualHitSparks(enemyPos, 5);
+                        SoundManager.playSound('enemy_hit', 0.6);
                     }
+                    break;
                 }
+                case 'death':
+                    SoundManager.playSound('enemy_death', 0.7);
+                    break;
+                case 'pickup':
+                    SoundManager.playSound('powerup', 0.9);
+                    break;
+                case 'bullet_spawn':
+                    appState.bullets[ev.id] = ev;
+                    break;
+                case 'bullet_despawn':
+                    // Stop drawing at the server time of the hit, not on arrival (rendering runs behind)
+                    for (const id of ev.ids) {
+                        if (appState.bullets[id]) appState.bullets[id].until = Math.min(appState.bullets[id].until, ev.t);
+                    }
+                    break;
+                case 'speech':
+                    localEffects.enemySpeech = { speakerId: ev.speaker_id, text: ev.text, endTime: now + ENEMY_SPEECH_BUBBLE_DURATION_MS };
+                    handleEnemyChat(ev.speaker_id, ev.text);
+                    break;
             }
         }
-
-        // --- Powerup Pickup Sound ---
-        // Check if a powerup disappeared between states
-        if (newState.powerups && appState.lastServerState?.powerups) {
-            const currentIds = new Set(Object.keys(newState.powerups));
-            const lastIds = new Set(Object.keys(appState.lastServerState.powerups));
-            lastIds.forEach(id => {
-                if (!currentIds.has(id)) { // Powerup with 'id' existed last state but not current
-                    SoundManager.playSound('powerup', 0.9); // Play powerup sound
-                }
-            });
-        }
     }
 
     // Public methods exposed by the GameManager module
     return {
         initListeners, startGameLoop, cleanupLoop, resetClientState,
         setInitialGameState, updateServerState, updateHostWaitUI,
-        handlePlayerChat, handleEnemyChat, handleDamageFeedback,
+        handlePlayerChat, handleEnemyChat, handleDamageFeedback, handleGameEvents,
         sendChatMessage, triggerLocalPushback
     };
 })();
@@ -1444,7 +1563,7 @@ function handleServerMessage(event) {
         // Process message based on its 'type'
         switch (data.type) {
             // --- Game Join / Start Confirmation ---
-            case 'game_created': case 'game_joined': case 'sp_game_started':
+            case 'game_created': case 'game_joined': case 'sp_game_started': case 'session_resumed':
                 log(`Received '${data.type}'`);
                 // Validate required data
                 if (!data.initial_state || !data.player_id || !data.game_id) {
@@ -1453,19 +1572,25 @@ function handleServerMessage(event) {
                     // Force disconnect or reset? Depends on desired robustness.
                     return;
                 }
-                // Reset client state before setting new game state
+                NetworkManager.setResumeToken(data.resume_token);
+                // Reset client state before setting new game state (keeping the mode chosen from the menu)
+                const requestedMode = appState.mode;
                 GameManager.resetClientState(false);
+                appState.mode = requestedMode;
                 // Set initial game state using received data
                 GameManager.setInitialGameState(data.initial_state, data.player_id, data.game_id, data.max_players || 1);
 
                 if (data.type === 'game_created') {
+                    // Quick match may have made us host of a new lobby even though we asked to join
+                    appState.mode = 'multiplayer-host';
                     // Update UI for hosting
                     if (DOM.gameCodeDisplay) DOM.gameCodeDisplay.textContent = appState.currentGameId || 'ERROR';
                     UIManager.updateStatus(`Hosted Game: ${appState.currentGameId}`);
                     GameManager.updateHostWaitUI(appState.serverState); // Update player count
                     UIManager.showSection('hostWaitSection');
                 } else { // game_joined or sp_game_started
-                    const joinMsg = data.type === 'game_joined' ? `Joined ${appState.currentGameId}` : "Single Player Started!";
+                    const joinMsg = data.type === 'game_joined' ? `Joined ${appState.currentGameId}`
+                        : data.type === 'session_resumed' ? `Rejoined ${appState.currentGameId}` : "Single Player Started!";
                     UIManager.updateStatus(joinMsg);
                     UIManager.showSection('gameArea'); // Show the main game UI
                     // Update HUD elements immediately with initial state
@@ -1523,7 +1648,7 @@ function handleServerMessage(event) {
                 }
 
                 // Process feedback (damage, effects, sounds) based on state changes
-                GameManager.handleEnemyChat(newState.enemy_speaker_id, newState.enemy_speech_text);
+                GameManager.handleGameEvents(newState.events);
                 GameManager.handleDamageFeedback(newState);
                 break;
 
@@ -1550,7 +1675,16 @@ function handleServerMessage(event) {
                 }
                 break;
 
+            case 'redirect':
+                if (data.url && data.retry) NetworkManager.redirect(data.url, data.retry);
+                break;
+
             // --- Server Error Message ---
+            case 'resume_failed':
+                log(`Resume failed: ${data.message}`);
+                NetworkManager.resumeFailed();
+                break;
+
             case 'error':
                 error("Server Error:", data.message || "Unknown error");
                 UIManager.updateStatus(`Error: ${data.message || 'Unknown'}`, true);
@@ -1618,6 +1752,7 @@ document.addEventListener('DOMContentLoaded', () => {
         hostGameBtn3: document.getElementById('hostGameBtn3'),
         hostGameBtn4: document.getElementById('hostGameBtn4'),
         showJoinUIBtn: document.getElementById('showJoinUIBtn'),
+        quickMatchBtn: document.getElementById('quickMatchBtn'),
         cancelHostBtn: document.getElementById('cancelHostBtn'),
         gameCodeDisplay: document.getElementById('game-code-display'),
         waitingMessage: document.getElementById('waiting-message'),
@@ -1,15 +1,40 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+import argparse
+import threading
 import asyncio
 import logging
+import logging.handlers
+import queue
+import atexit
 import json
 import time
 import random
 import math
 import uuid
+import secrets
 import operator
+import bisect
+import heapq
+import collections
+import hashlib
+import gzip
+import base64
+import signal
+import socket
+import sqlite3
+import glob
+import mimetypes
+from datetime import datetime, timezone
+import aiohttp
 from aiohttp import web, WSMsgType
 
+try:
+    import brotli # Optional: adds 'br' variants for static assets
+except ImportError:
+    brotli = None
+
 # --- Constants ---
 MAX_PLAYERS = 4
 TICK_RATE = 1 / 30
@@ -25,6 +50,11 @@ PLAYER_STATUS_DEAD = 'dead'
 REVIVAL_DURATION = 60.0
 SPECIAL_AMMO_DURATION = 25.0
 GAME_OVER_CHECK_INTERVAL = 1.0
+GAME_RELEASE_LOOP_TIMEOUT = 5.0 # Max wait for a finished game's loop to send its final state before release
+GAME_SWEEP_INTERVAL = 300.0 # Safety-net sweep for finished games that were never released
+GAME_POOL_SIZE = int(os.environ.get('GAME_POOL_SIZE', 4)) # Pre-built SP games kept ready for instant starts
+GAME_POOL_MAX_IDLE = 16 # Recycled games beyond this are dropped for the GC
+QUICK_JOIN_DEFAULT_MAX_PLAYERS = 2 # Lobby size quick_join creates when nothing is open and no size was asked for
 
 PLAYER_DEFAULTS = { 'width': 20, 'height': 20, 'base_speed': 150, 'max_health': 100, 'gun': 1, 'armor': 0, 'kills': 0, 'score': 0, 'player_status': PLAYER_STATUS_ALIVE,  # Default to alive using the constant 'down_timer_expires_at': 0.0         # Default timer to 0
 }
@@ -42,12 +72,18 @@ ENEMY_DEFAULTS = {'width': 25, 'height': 25, 'speed': 80, 'max_health': 50, 'dam
 BULLET_DEFAULTS = {'radius': 4, 'speed': 400, 'damage': 10, 'lifetime': 2.0, 'bullet_type': 'standard'} # Added bullet_type
 # ADD ENEMY BULLET DEFAULTS (can override general bullet defaults if needed)
 ENEMY_BULLET_DEFAULTS = {'radius': 3, 'speed': 200, 'damage': 15, 'lifetime': 2, 'bullet_type': 'standard_enemy'} # Enemy bullets look/act slightly different
-# --- Damage Text Constants ---
-DAMAGE_TEXT_DEFAULTS = {'lifetime': 0.75, 'speed_y': -40} # Text floats up
+# --- Gameplay Events ---
+# One-off events ('hit', 'death', 'pickup', 'speech') ride on the next game_state as 'events'
+# and are sent exactly once; floating damage numbers and speech bubbles are animated client-side.
 
 HIGHSCORE_FILE = "highscores.json"
-MAX_HIGHSCORES = 50
+MAX_HIGHSCORES = 50 # Per leaderboard partition (party size + period)
+LEADERBOARD_PERIODS = ('all', 'day', 'week') # 'day'/'week' buckets roll over at UTC midnight / ISO week start
+HIGHSCORE_PAGE_SIZE = 10
+HIGHSCORES_HTTP_MAX_AGE = 15 # Seconds browsers/CDNs may reuse GET /highscores before revalidating
 
+FIRE_COOLDOWNS = {'standard': 0.1, 'ammo_rapid_fire': 0.04, 'ammo_shotgun': 0.1, 'ammo_heavy_slug': 0.1} # Seconds between shots per ammo type
+FIRE_JITTER_TOLERANCE = 0.02 # Seconds early a legacy per-shot player_shoot may arrive (network jitter) and still fire
 PLAYER_CRIT_CHANCE = 0.15 # 15% chance for players
 PLAYER_CRIT_MULTIPLIER = 2.0 # Double damage on crit
 POWERUP_DEFAULTS = {'size': 12, 'duration': 10.0}
@@ -62,19 +98,151 @@ PUSHBACK_RANGE_SQ = PUSHBACK_RANGE * PUSHBACK_RANGE # Use squared distance for e
 PUSHBACK_FORCE = 150       # How far entities are pushed back (pixels)
 PUSHBACK_COOLDOWN_DURATION = .1 # Seconds between push attempts
 
+# --- Lag Compensation ---
+LAG_COMP_MAX_REWIND = 0.3 # Seconds; player shots never rewind enemies further back than this
+
+# --- Enemy Pathing ---
+FLOW_FIELD_CELL_SIZE = 25 # Pixels per flow-field cell (800x600 -> 32x24 grid)
+FLOW_FIELD_REBUILD_INTERVAL = 0.1 # Seconds between distance-map rebuilds (also rebuilt when the alive set changes)
+FLOW_FIELD_DIRECT_RANGE = 1.5 # Cells; closer than this enemies steer straight at their target
+FLOW_FIELD_CAMPFIRE_COST = 4.0 # Step cost multiplier inside the lit campfire; enemies route around it
+ENEMY_SEPARATION_RADIUS = 30 # Enemies closer than this push apart (also the neighbour-grid cell size)
+ENEMY_SEPARATION_SPEED = 70 # Max px/s an enemy is pushed away from crowding neighbours
+
+# --- Enemy AI Scheduling ---
+AI_THINK_INTERVAL_TICKS = 3 # Enemies near a player re-think (target, shoot, speech eligibility) every N ticks
+AI_FAR_THINK_INTERVAL_TICKS = 10 # ...and those farther than AI_FAR_DISTANCE_CELLS think this rarely
+AI_FAR_DISTANCE_CELLS = 12 # Flow-field distance (cells) beyond which an enemy counts as far
+AI_THINK_BUDGET = 0.004 # Seconds of think work per tick; leftover thinks roll over to the next tick
+
+# --- Spawn Director ---
+DIRECTOR_LEVEL_DURATION = DAY_NIGHT_CYCLE_DURATION * 2 # Active seconds per difficulty level (one full day/night cycle)
+DIRECTOR_MIN_SPAWN_INTERVAL = 0.5 # Fastest the difficulty curve alone will spawn enemies
+MAX_LIVE_ENEMIES = 120 # Per game, before any load throttling
+MAX_LIVE_BULLETS = 300 # Per game; enemies hold fire at this many bullets in flight
+DIRECTOR_GAME_TICK_BUDGET = TICK_RATE * 0.25 # Smoothed simulation cost one game may use per tick before it throttles itself
+DIRECTOR_PROCESS_HOT_LOAD = 0.6 # Fraction of wall time spent simulating (all games) before every game throttles
+DIRECTOR_COST_SMOOTHING = 0.1 # EWMA weight of the newest tick cost
+DIRECTOR_STOP_PRESSURE = 2.0 # At this much over budget, no new enemies spawn at all
+
+# --- Replay Recording ---
+REPLAY_DELTA_SCALE = 10000 # Tick deltas are quantized to 0.1ms ints so replays reproduce them exactly
+REPLAY_MODE = os.environ.get('REPLAY_MODE', 'finished').lower() # 'off', 'finished' (written at game end) or 'all' (streamed while running)
+REPLAY_DIR = os.environ.get('REPLAY_DIR', 'replays')
+REPLAY_FLUSH_TICKS = 150 # In 'all' mode, hand a chunk to the writer every ~5s of ticks
+REPLAY_SIM_VERSION = 2 # Bump with every change to simulation/balance code: replays only reproduce on the version that recorded them
+
+# --- Checkpoints ---
+CHECKPOINT_VERSION = 1
+CHECKPOINT_TIME_KEYS = frozenset({'spawn_time', 'freeze_until', 'last_shot_time', 'death_timestamp', 'expires_at',
+                                  'ammo_effect_expires_at', 'down_timer_expires_at', 't', 'until'}) # Absolute game-clock fields in entities/events
+
+# --- Networking ---
+PROTOCOL_VERSION = 1 # Clients may announce theirs with 'protocol_version' on any message
+HANDSHAKE_MODE = os.environ.get('HANDSHAKE_MODE', 'fast') # 'fast': hello rides on the association response; 'legacy': delayed standalone hello
+HANDSHAKE_LEGACY_DELAY = 0.3 # Seconds the legacy handshake waits before sending hello_from_server
+SERVER_HELLO_MESSAGE = 'Connection test successful.'
+RESUME_GRACE_PERIOD = float(os.environ.get('RESUME_GRACE_PERIOD', 20.0)) # Seconds a dropped player's slot is held for resume_session
+LATENCY_SAMPLE_WINDOW = 1024 # Recent connect -> first game_state samples kept for /metrics
+SPECTATOR_SNAPSHOT_INTERVAL = 3 # Spectators get every Nth game_state (10 Hz at a 30 Hz tick)
+SPECTATOR_QUEUE_SIZE = 4 # Frames buffered per spectator before the oldest is dropped
+MAX_SPECTATORS_PER_GAME = 1000
+
+# --- Cluster ---
+CLUSTER_REGISTRY = os.environ.get('CLUSTER_REGISTRY', '') # '' = single node; 'local' = in-process registry; 'sqlite:PATH' = file shared by nodes on one host
+NODE_SHARD = os.environ.get('NODE_SHARD', '').upper() # This node's prefix inside game IDs (MP_<shard><code>); random if unset in cluster mode
+NODE_URL = os.environ.get('NODE_URL', '') # Public ws(s)://.../ws URL other nodes redirect this node's players to
+CLUSTER_SHARD_LENGTH = 2
+GAME_CODE_LENGTH = 5 # Random part of a game ID ('MP_ABCDE'); clustered IDs put the shard in front of it
+CLUSTER_HEARTBEAT_INTERVAL = 10.0 # Seconds between node heartbeats to the registry
+CLUSTER_NODE_TTL = 30.0 # A node silent for this long is treated as gone (no redirects to it)
+CLUSTER_REGISTRY_READ_TIMEOUT = 0.05 # Seconds an inline (event loop) sqlite registry read may wait on a lock
+CLUSTER_REGISTRY_WRITE_TIMEOUT = 5.0 # Busy timeout for the sqlite registry's writer thread
+
+# --- Deploys ---
+DRAIN_MODE = os.environ.get('DRAIN_MODE', 'wait').lower() # On SIGTERM: 'wait' lets running games finish; 'handoff' checkpoints them for a successor on the same port
+DRAIN_DEADLINE = float(os.environ.get('DRAIN_DEADLINE', 300.0)) # Seconds 'wait' gives running games before shutting down anyway
+DRAIN_POLL_INTERVAL = 1.0
+HANDOFF_DIR = os.environ.get('HANDOFF_DIR', 'handoff') # Where a draining node leaves game checkpoints for its successor
+HANDOFF_CLOSE_CODE = 4001 # Close code for handed-off players; not 1000, so clients resume_session (landing on the successor)
+
+# --- Load Testing (python run.py loadtest) ---
+LOAD_BACKOFF_MIN = 0.1 # Seconds a bot group waits between sessions
+LOAD_BACKOFF_MAX = 5.0 # Cap for the doubling wait while connects/associations keep failing
+
+# --- Static Assets ---
+STATIC_ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_FILES = ['index.html', 'main.js', 'Renderer3D.js', 'style.css', 'favicon.ico']
+STATIC_GLOBS = ['assets/sounds/*.mp3']
+STATIC_COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'application/javascript', 'text/javascript', 'image/x-icon', 'image/vnd.microsoft.icon'}
+STATIC_MIN_COMPRESS_SIZE = 512 # Bytes; smaller files aren't worth a variant
+STATIC_HTML_CACHE_CONTROL = 'no-cache' # Always revalidate (cheap 304) so deploys show up immediately
+STATIC_CACHE_CONTROL = 'public, max-age=300'
+
 # --- Logging ---
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s [%(levelname)s] (%(name)s:%(lineno)d) %(message)s', datefmt='%H:%M:%S')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING' if sys.argv[1:2] in (['replay'], ['loadtest']) else 'INFO').upper() # DEBUG is expensive: the tick and send paths log a lot
+LOG_FORMAT = '%(asctime)s [%(levelname)s] (%(name)s:%(lineno)d) %(message)s'
+LOG_SAMPLE_INTERVAL = float(os.environ.get('LOG_SAMPLE_INTERVAL', 5.0)) # Seconds between records from one sampled call site
+
+def configure_logging(level_name=LOG_LEVEL):
+    """Routes all records through a QueueHandler so the event loop never waits on log I/O.
+    A QueueListener thread does the actual writing. Returns the started listener."""
+    level = logging.getLevelName(level_name)
+    if not isinstance(level, int):
+        level = logging.INFO
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%H:%M:%S'))
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop) # Flushes whatever is still queued on shutdown
+    return listener
+
+class LogSampler:
+    """Per-call-site rate limiting for hot paths. Lets one record per interval through for each key
+    and reports how many were dropped in between. Disabled levels cost a single isEnabledFor check."""
+    def __init__(self, interval=LOG_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._sites = {} # key -> [next_allowed_at, suppressed_count]
+
+    def log(self, logger, level, key, msg, *args):
+        if not logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = [0.0, 0]
+        if now < site[0]:
+            site[1] += 1
+            return
+        if site[1]:
+            msg += " (+%d similar suppressed)"
+            args += (site[1],)
+        site[0] = now + self.interval
+        site[1] = 0
+        logger.log(level, msg, *args, stacklevel=3) # Report the caller of log_sampled, not this helper
+
+log_listener = configure_logging()
+log_sampler = LogSampler()
 log_main = logging.getLogger('ServerMain')
 log_net = logging.getLogger('NetworkLayer')
 log_game = logging.getLogger('GameLogic')
 
+def log_sampled(logger, level, key, msg, *args):
+    """Lazy %-style log call, rate limited per 'key' (one key per call site)."""
+    log_sampler.log(logger, level, key, msg, *args)
+
 # --- Utilities ---
 def generate_id(): return str(uuid.uuid4())
 def distance_sq(x1, y1, x2, y2): dx = x1 - x2; dy = y1 - y2; return dx * dx + dy * dy
 
-def check_aabb_collision(obj1, obj2):
+def check_aabb_collision(obj1, obj2, obj2_pos=None):
+    """AABB overlap test. obj2_pos=(x, y) tests obj2 at that position instead (lag compensation)."""
     x1, y1 = obj1.get('x'), obj1.get('y')
-    x2, y2 = obj2.get('x'), obj2.get('y')
+    x2, y2 = obj2_pos if obj2_pos is not None else (obj2.get('x'), obj2.get('y'))
 
     if None in (x1, y1, x2, y2):
         return False
@@ -135,32 +303,693 @@ def load_high_scores():
         return []
 
 def save_high_scores(scores_list):
+    """Writes the given entries as-is. The Leaderboard decides which entries are still worth keeping."""
     try:
-        # Ensure scores are sorted before saving (descending by score)
-        scores_list.sort(key=operator.itemgetter('score'), reverse=True)
-        # Trim to max length
-        trimmed_scores = scores_list[:MAX_HIGHSCORES]
         with open(HIGHSCORE_FILE, 'w') as f:
-            json.dump(trimmed_scores, f, indent=2) # Use indent for readability
-        log_main.info(f"Saved {len(trimmed_scores)} high scores to '{HIGHSCORE_FILE}'.")
+            json.dump(scores_list, f, indent=2) # Use indent for readability
+        log_main.info(f"Saved {len(scores_list)} high scores to '{HIGHSCORE_FILE}'.")
     except Exception as e:
         log_main.error(f"Error saving high scores to '{HIGHSCORE_FILE}': {e}", exc_info=True)
 
+def leaderboard_bucket(period, timestamp):
+    """Maps a period name and a unix timestamp to its bucket label ('all', '2026-10-19', '2026-W42')."""
+    if period == 'all':
+        return 'all'
+    dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    if period == 'day':
+        return dt.strftime('%Y-%m-%d')
+    if period == 'week':
+        iso_year, iso_week, _ = dt.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    raise ValueError(f"Unknown leaderboard period '{period}'")
+
+class LeaderboardPartition:
+    """A single ranked table (one party size, one period bucket), kept sorted on insert."""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = []     # Best first
+        self._neg_scores = [] # -score for each entry, ascending, so bisect gives ranks directly
+
+    def rank_of(self, score):
+        """1-based rank a score would take. Ties go behind existing entries (first to set it keeps it)."""
+        return bisect.bisect_right(self._neg_scores, -score) + 1
+
+    def qualifies(self, score):
+        return len(self.entries) < self.capacity or score > self.entries[-1]['score']
+
+    def insert(self, entry):
+        """Inserts in rank order and trims to capacity. Returns the 1-based rank, or None if it didn't make it."""
+        if not self.qualifies(entry['score']):
+            return None
+        idx = bisect.bisect_right(self._neg_scores, -entry['score'])
+        self._neg_scores.insert(idx, -entry['score'])
+        self.entries.insert(idx, entry)
+        if len(self.entries) > self.capacity:
+            self._neg_scores.pop()
+            self.entries.pop()
+        return idx + 1
+
+class Leaderboard:
+    """
+    High scores partitioned by party size ('players') and period (all-time, day, week).
+    Each partition is capped at MAX_HIGHSCORES, so a solo run only competes against other solo runs.
+    """
+    def __init__(self, entries=(), capacity=MAX_HIGHSCORES):
+        self.capacity = capacity
+        self.partitions = {} # (players, period, bucket) -> LeaderboardPartition
+        self.version = 0     # Bumped on every change, lets callers cache rendered pages
+        now = time.time()
+        # Insert best-first so loading never shuffles entries around inside a partition
+        for entry in sorted(entries, key=operator.itemgetter('score'), reverse=True):
+            if isinstance(entry, dict) and isinstance(entry.get('score'), (int, float)):
+                self._insert(entry, entry.get('timestamp', now))
+        self.prune(now)
+
+    def _insert(self, entry, timestamp):
+        ranks = {}
+        players = entry.get('players', 1)
+        for period in LEADERBOARD_PERIODS:
+            key = (players, period, leaderboard_bucket(period, timestamp))
+            partition = self.partitions.get(key)
+            if partition is None:
+                partition = self.partitions[key] = LeaderboardPartition(self.capacity)
+            rank = partition.insert(entry)
+            if rank is not None:
+                ranks[period] = rank
+        return ranks
+
+    def _current_partition(self, players, period, now=None):
+        bucket = leaderboard_bucket(period, time.time() if now is None else now)
+        return self.partitions.get((players, period, bucket))
+
+    def qualifies(self, score, players, now=None):
+        """True if the score would enter at least one current partition for this party size."""
+        for period in LEADERBOARD_PERIODS:
+            partition = self._current_partition(players, period, now)
+            if partition is None or partition.qualifies(score):
+                return True
+        return False
+
+    def add(self, entry):
+        """Adds an entry to every current partition it qualifies for. Returns {period: rank} (empty if none)."""
+        now = entry.get('timestamp', time.time())
+        self.prune(now)
+        ranks = self._insert(entry, now)
+        if ranks:
+            self.version += 1
+        return ranks
+
+    def rank_of(self, score, players, period='all', now=None):
+        partition = self._current_partition(players, period, now)
+        return partition.rank_of(score) if partition else 1
+
+    def page(self, players, period='all', offset=0, limit=HIGHSCORE_PAGE_SIZE, now=None):
+        """Returns (entries, total) for one slice of the current partition."""
+        partition = self._current_partition(players, period, now)
+        if partition is None:
+            return [], 0
+        return partition.entries[offset:offset + limit], len(partition.entries)
+
+    def prune(self, now=None):
+        """Drops day/week partitions that have rolled over."""
+        now = time.time() if now is None else now
+        current = {period: leaderboard_bucket(period, now) for period in LEADERBOARD_PERIODS}
+        stale = [key for key in self.partitions if key[2] != current[key[1]]]
+        for key in stale:
+            del self.partitions[key]
+        if stale:
+            self.version += 1
+
+    def all_entries(self):
+        """Every entry still held by some partition (deduplicated), best first. This is what gets persisted."""
+        seen = {}
+        for partition in self.partitions.values():
+            for entry in partition.entries:
+                seen[id(entry)] = entry
+        return sorted(seen.values(), key=operator.itemgetter('score'), reverse=True)
+
+def parse_leaderboard_query(params):
+    """
+    Validates leaderboard query parameters (from a WS message or an HTTP query string).
+    Returns (players, period, offset, limit). Raises ValueError on bad input.
+    """
+    players = int(params.get('players') or 1)
+    if not 1 <= players <= MAX_PLAYERS:
+        raise ValueError(f"players must be between 1 and {MAX_PLAYERS}")
+    period = params.get('period') or 'all'
+    if period not in LEADERBOARD_PERIODS:
+        raise ValueError(f"period must be one of {', '.join(LEADERBOARD_PERIODS)}")
+    offset = max(0, int(params.get('offset') or 0))
+    limit = max(1, min(MAX_HIGHSCORES, int(params.get('limit') or HIGHSCORE_PAGE_SIZE)))
+    return players, period, offset, limit
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against a strong ETag (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+# --- Lag Compensation ---
+class PositionHistory:
+    """
+    Ring buffer of per-tick entity positions, keyed by the snapshot timestamp clients see.
+    Player bullets are tested against the frame matching the shooter's view time.
+    """
+    def __init__(self, max_rewind=LAG_COMP_MAX_REWIND):
+        frames = int(max_rewind / TICK_RATE) + 2 # One spare so a full rewind still lands inside the buffer
+        self._times = collections.deque(maxlen=frames)
+        self._frames = collections.deque(maxlen=frames) # {entity_id: (x, y)}
+
+    def record(self, timestamp, entities):
+        self._times.append(timestamp)
+        self._frames.append({e_id: (e['x'], e['y']) for e_id, e in entities.items()})
+
+    def frame_at(self, timestamp):
+        """Latest frame at or before timestamp (oldest frame if it's further back). None if empty."""
+        if not self._times:
+            return None
+        i = bisect.bisect_right(self._times, timestamp) - 1
+        return self._frames[max(i, 0)]
+
+    def clear(self):
+        self._times.clear()
+        self._frames.clear()
+
+    def state(self, now):
+        return [[t - now, {e_id: list(pos) for e_id, pos in frame.items()}] for t, frame in zip(self._times, self._frames)]
+
+    def load_state(self, frames, now):
+        self.clear()
+        for t, frame in frames:
+            self._times.append(t + now)
+            self._frames.append({e_id: tuple(pos) for e_id, pos in frame.items()})
+
+# --- Enemy Pathing ---
+class FlowField:
+    """
+    Coarse-grid distance map from every alive player, built once per rebuild interval and
+    shared by all enemies. Each cell also remembers which player is nearest, so target lookup
+    and steering are O(1) per enemy instead of a scan over all players.
+    Cells in `blocked` are impassable; `costs` holds per-cell step multipliers.
+    """
+    _NEIGHBOURS = ((1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+                   (1, 1, math.sqrt(2)), (1, -1, math.sqrt(2)), (-1, 1, math.sqrt(2)), (-1, -1, math.sqrt(2)))
+
+    def __init__(self, width, height, cell_size=FLOW_FIELD_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cols = max(1, math.ceil(width / cell_size))
+        self.rows = max(1, math.ceil(height / cell_size))
+        self.blocked = set() # Cell indexes; reserved for static obstacles
+        self.clear()
+
+    def clear(self):
+        self.costs = [1.0] * (self.cols * self.rows)
+        self.dist = [math.inf] * (self.cols * self.rows)
+        self.nearest = [None] * (self.cols * self.rows) # Player id the cell's distance was measured to
+        self._directions = {} # Lazily computed steering vectors, reset on rebuild
+        self._sources = None
+        self._next_rebuild = 0.0
+
+    def cell_at(self, x, y):
+        col = min(self.cols - 1, max(0, int(x // self.cell_size)))
+        row = min(self.rows - 1, max(0, int(y // self.cell_size)))
+        return row * self.cols + col
+
+    def set_circle_cost(self, cx, cy, radius, cost):
+        """Applies `cost` to every cell whose centre lies inside the circle (1.0 resets it)."""
+        half = self.cell_size / 2
+        for cell in range(len(self.costs)):
+            row, col = divmod(cell, self.cols)
+            if distance_sq(col * self.cell_size + half, row * self.cell_size + half, cx, cy) <= radius * radius:
+                self.costs[cell] = cost
+
+    def invalidate(self):
+        self._next_rebuild = 0.0
+
+    def state(self, now):
+        """The last build, for checkpoints. Costs aren't included: they follow from the campfire state."""
+        sources = list(self._sources) if self._sources is not None else None
+        index = {player_id: i for i, player_id in enumerate(sources or ())}
+        return {'sources': sources, 'next_rebuild': self._next_rebuild - now,
+                'dist': self.dist, 'nearest': [index.get(p, -1) for p in self.nearest]} # Nearest as source indexes: ids are long
+
+    def load_state(self, state, now):
+        sources = state['sources']
+        self._sources = tuple(sources) if sources is not None else None
+        self._next_rebuild = state['next_rebuild'] + now # An invalidated 0.0 comes back as exactly 0.0
+        self.dist = list(state['dist'])
+        self.nearest = [sources[i] if i >= 0 else None for i in state['nearest']]
+        self._directions = {}
+
+    def update(self, players, now):
+        """Rebuilds the distance map if the interval elapsed or the set of source players changed."""
+        sources = tuple(p['id'] for p in players)
+        if now < self._next_rebuild and sources == self._sources:
+            return False
+        self._sources = sources
+        self._next_rebuild = now + FLOW_FIELD_REBUILD_INTERVAL
+        self._build(players)
+        return True
+
+    def _build(self, players):
+        cols, rows, costs, blocked = self.cols, self.rows, self.costs, self.blocked
+        dist = [math.inf] * (cols * rows)
+        nearest = [None] * (cols * rows)
+        heap = []
+        for p in players:
+            cell = self.cell_at(p['x'], p['y'])
+            if dist[cell] > 0:
+                dist[cell] = 0.0
+                nearest[cell] = p['id']
+                heap.append((0.0, cell))
+        heapq.heapify(heap)
+        while heap: # Multi-source Dijkstra over 8-connected cells
+            d, cell = heapq.heappop(heap)
+            if d > dist[cell]:
+                continue
+            row, col = divmod(cell, cols)
+            for dc, dr, step in self._NEIGHBOURS:
+                ncol, nrow = col + dc, row + dr
+                if not (0 <= ncol < cols and 0 <= nrow < rows):
+                    continue
+                ncell = nrow * cols + ncol
+                if ncell in blocked:
+                    continue
+                nd = d + step * costs[ncell]
+                if nd < dist[ncell]:
+                    dist[ncell] = nd
+                    nearest[ncell] = nearest[cell]
+                    heapq.heappush(heap, (nd, ncell))
+        self.dist, self.nearest, self._directions = dist, nearest, {}
+
+    def direction(self, cell):
+        """Unit vector towards the cheapest neighbour, or None at a local minimum/unreached cell."""
+        if cell in self._directions:
+            return self._directions[cell]
+        row, col = divmod(cell, self.cols)
+        best, best_vec = self.dist[cell], None
+        for dc, dr, step in self._NEIGHBOURS:
+            ncol, nrow = col + dc, row + dr
+            if 0 <= ncol < self.cols and 0 <= nrow < self.rows and self.dist[nrow * self.cols + ncol] < best:
+                best, best_vec = self.dist[nrow * self.cols + ncol], (dc / step, dr / step)
+        self._directions[cell] = best_vec
+        return best_vec
+
+class SpatialHash:
+    """
+    Uniform grid of entities rebuilt each tick. With cell size >= the query radius, a
+    neighbour query only touches the 3x3 block around a point, so cost follows local density.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def rebuild(self, entities):
+        cells = self.cells
+        cells.clear()
+        size = self.cell_size
+        for e in entities:
+            x, y = e['x'], e['y']
+            key = (int(x // size), int(y // size))
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [(x, y, e)]
+            else:
+                bucket.append((x, y, e))
+
+    def neighbours(self, x, y):
+        """(x, y, entity) for everything in the 3x3 cells around (x, y); callers filter by exact distance."""
+        cx, cy = int(x // self.cell_size), int(y // self.cell_size)
+        cells = self.cells
+        found = []
+        for key in ((cx - 1, cy - 1), (cx, cy - 1), (cx + 1, cy - 1), (cx - 1, cy), (cx, cy),
+                    (cx + 1, cy), (cx - 1, cy + 1), (cx, cy + 1), (cx + 1, cy + 1)):
+            bucket = cells.get(key)
+            if bucket:
+                found.extend(bucket)
+        return found
+
+class AIScheduler:
+    """
+    Time-sliced enemy "think" queue: a ring of round-robin buckets, one per tick. Each tick
+    drains its bucket until the per-tick budget runs out; whatever is left rolls over to the
+    front of the next bucket. Each enemy's brain holds the decisions movement reuses between thinks.
+    """
+    def __init__(self, budget=AI_THINK_BUDGET, max_interval=AI_FAR_THINK_INTERVAL_TICKS):
+        self.budget = budget
+        self._buckets = [collections.deque() for _ in range(max_interval + 1)]
+        self.clear()
+
+    def clear(self):
+        self.tick = 0
+        self.brains = {} # enemy_id -> {'target_id', 'far', 'wants_shot', 'stop_distance_sq'}
+        for bucket in self._buckets:
+            bucket.clear()
+
+    def brain(self, enemy_id):
+        """The enemy's brain, queueing its first scheduled think for next tick if it has none."""
+        brain = self.brains.get(enemy_id)
+        if brain is None:
+            brain = self.brains[enemy_id] = {'target_id': None, 'far': False, 'wants_shot': False, 'stop_distance_sq': 0.0}
+            self.schedule(enemy_id, 1)
+        return brain
+
+    def schedule(self, enemy_id, delay_ticks):
+        self._buckets[(self.tick + delay_ticks) % len(self._buckets)].append(enemy_id)
+
+    def run(self, think, *args, limit=None):
+        """Advances one tick and calls think(enemy_id, brain, *args) for this tick's bucket within budget
+        (or for at most `limit` enemies when given, as replays do). think returns the number of ticks
+        until the enemy's next think, or None to forget it. Returns (thinks run, whether cut short)."""
+        self.tick += 1
+        bucket = self._buckets[self.tick % len(self._buckets)]
+        deadline = time.perf_counter() + self.budget
+        brains = self.brains
+        thought = 0
+        while bucket:
+            if (thought >= limit if limit is not None else
+                    thought & 15 == 15 and time.perf_counter() >= deadline): # Check the clock every 16 thinks
+                self._buckets[(self.tick + 1) % len(self._buckets)].extendleft(reversed(bucket))
+                bucket.clear()
+                return thought, True
+            enemy_id = bucket.popleft()
+            brain = brains.get(enemy_id)
+            if brain is None:
+                continue
+            delay = think(enemy_id, brain, *args)
+            thought += 1
+            if delay is None:
+                brains.pop(enemy_id, None)
+            else:
+                self.schedule(enemy_id, delay)
+        return thought, False
+
+    def forget(self, enemy_id):
+        self.brains.pop(enemy_id, None) # Its bucket entry is skipped when it comes up
+
+    def state(self):
+        """Brains plus pending thinks as buckets counted from the current tick."""
+        n = len(self._buckets)
+        return {'brains': self.brains, 'queue': [list(self._buckets[(self.tick + i) % n]) for i in range(n)]}
+
+    def load_state(self, state):
+        self.clear()
+        self.brains = {enemy_id: dict(brain) for enemy_id, brain in state['brains'].items()}
+        for bucket, enemy_ids in zip(self._buckets, state['queue']):
+            bucket.extend(enemy_ids)
+
+# --- Spawn Director ---
+class TickLoad:
+    """Process-wide simulation load: every running game's smoothed tick cost, summed over the tick period."""
+    def __init__(self):
+        self._costs = {} # game_id -> smoothed seconds per tick
+
+    def report(self, game_id, cost):
+        self._costs[game_id] = cost
+
+    def forget(self, game_id):
+        self._costs.pop(game_id, None)
+
+    def load(self):
+        return sum(self._costs.values()) / TICK_RATE
+
+    def stats(self):
+        return {'games': len(self._costs), 'load': round(self.load(), 3)}
+
+tick_load = TickLoad()
+
+class SpawnDirector:
+    """
+    Sets enemy spawn rate, composition and live caps from a difficulty curve (level rises with
+    active time) scaled back by load: this game's measured tick cost and the whole process's.
+    Pressure <= 1 means within budget; above it spawns slow down and the enemy cap shrinks.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.elapsed = 0.0 # Active seconds
+        self.tick_cost = 0.0 # Smoothed seconds of simulation per tick for this game
+        self.current_pressure = 1.0 # pressure() as sampled for the current tick (floored at 1); what spawn decisions use
+
+    def advance(self, delta_time):
+        """Advances the difficulty curve; returns the current level."""
+        self.elapsed += delta_time
+        return 1 + int(self.elapsed // DIRECTOR_LEVEL_DURATION)
+
+    def record_tick(self, game_id, cost):
+        self.tick_cost += (cost - self.tick_cost) * DIRECTOR_COST_SMOOTHING
+        tick_load.report(game_id, self.tick_cost)
+
+    def pressure(self):
+        return max(self.tick_cost / DIRECTOR_GAME_TICK_BUDGET, tick_load.load() / DIRECTOR_PROCESS_HOT_LOAD)
+
+    def spawn_interval(self, level):
+        interval = max(DIRECTOR_MIN_SPAWN_INTERVAL, ENEMY_SPAWN_INTERVAL - (level * 0.15))
+        return interval * max(1.0, self.current_pressure)
+
+    def enemy_cap(self):
+        pressure = self.current_pressure
+        if pressure >= DIRECTOR_STOP_PRESSURE: return 0
+        return int(MAX_LIVE_ENEMIES / max(1.0, pressure))
+
+    def shooter_weight(self, level):
+        return min(0.6, 0.4 + 0.05 * (level - 1)) # Later levels field more shooters
+
+# --- Replay Recording ---
+class InputLog:
+    """
+    Everything needed to re-simulate a game bit-for-bit: the RNG seed, the starting game clock,
+    each tick's delta, every external input keyed by the tick count it landed after, and the few
+    decisions that depend on wall-clock load (director pressure, AI think cut-offs).
+    """
+    VERSION = 1
+
+    def __init__(self):
+        self.clear(None, None, 0, 0.0, MAX_PLAYERS)
+
+    def clear(self, game_id, host_id, seed, clock_start, max_players):
+        self.game_id = game_id
+        self.host_id = host_id
+        self.seed = seed
+        self.clock_start = clock_start
+        self.max_players = max_players
+        self.sim_version = REPLAY_SIM_VERSION # Simulation code the inputs were recorded against
+        self.deltas = [] # Per-tick delta in 1/REPLAY_DELTA_SCALE seconds
+        self.costs = [] # Per-tick simulation cost in microseconds (annotation only; replays don't need it)
+        self.inputs = [] # (tick, kind, *args)
+        self.overrides = [] # (tick, kind, value)
+        self._taken = None # (deltas, inputs, overrides) lengths already handed out by take_chunk()
+
+    def header(self):
+        return {'version': self.VERSION, 'sim_version': self.sim_version, 'game_id': self.game_id, 'host_id': self.host_id,
+                'seed': self.seed, 'clock_start': self.clock_start, 'max_players': self.max_players}
+
+    def to_dict(self, with_progress=False):
+        data = {**self.header(), 'deltas': self.deltas, 'costs': self.costs, 'inputs': self.inputs, 'overrides': self.overrides}
+        if with_progress:
+            data['taken'] = self._taken # Checkpoints: a restored game keeps appending to the same replay file
+        return data
+
+    def filename(self):
+        return f"{self.game_id}-{int(self.clock_start)}.replay.gz"
+
+    def take_chunk(self):
+        """Everything recorded since the previous chunk (the first chunk also carries the header)."""
+        if self._taken is None:
+            chunk, (d, i, o) = self.header(), (0, 0, 0)
+        else:
+            chunk, (d, i, o) = {}, self._taken
+        chunk.update(deltas=self.deltas[d:], costs=self.costs[d:], inputs=self.inputs[i:], overrides=self.overrides[o:])
+        self._taken = (len(self.deltas), len(self.inputs), len(self.overrides))
+        return chunk
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported input log version: {data.get('version')}")
+        log = cls()
+        log.clear(data['game_id'], data['host_id'], data['seed'], data['clock_start'], data['max_players'])
+        log.sim_version = data.get('sim_version', 1) # Recorded before the field existed
+        log.extend(data)
+        if data.get('taken') is not None:
+            log._taken = tuple(data['taken'])
+        return log
+
+    def extend(self, chunk):
+        self.deltas.extend(chunk.get('deltas', ()))
+        self.costs.extend(chunk.get('costs', ()))
+        self.inputs.extend(tuple(entry) for entry in chunk.get('inputs', ()))
+        self.overrides.extend(tuple(entry) for entry in chunk.get('overrides', ()))
+
+def read_replay(path, allow_stale=False):
+    """Loads a replay file. Returns (InputLog, end record or None if the game was still running).
+    Raises ValueError for files recorded against another REPLAY_SIM_VERSION unless allow_stale."""
+    input_log, end = None, None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            chunk = json.loads(line)
+            if input_log is None:
+                input_log = InputLog.from_dict(chunk)
+            else:
+                input_log.extend(chunk)
+            end = chunk.get('end', end)
+    if input_log is None:
+        raise ValueError(f"Empty replay file: {path}")
+    if input_log.sim_version != REPLAY_SIM_VERSION and not allow_stale:
+        raise ValueError(f"{path} was recorded with simulation version {input_log.sim_version}, this code is "
+                         f"version {REPLAY_SIM_VERSION}: it will not re-simulate to the recorded game")
+    return input_log, end
+
+class ReplayWriter:
+    """
+    Appends replay chunks on a background thread so the game loop only enqueues. Each chunk is
+    one JSON line in its own gzip member; concatenated members read back as a single stream,
+    so files are append-only and readable while a game is still being streamed.
+    """
+    def __init__(self, directory=REPLAY_DIR):
+        self.directory = directory
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def submit(self, filename, chunk):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='replay-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop) # Drains queued chunks on shutdown
+        self._queue.put((filename, chunk))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            filename, chunk = item
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                data = gzip.compress(json.dumps(chunk, separators=(',', ':')).encode('utf-8') + b'\n')
+                with open(os.path.join(self.directory, filename), 'ab') as f:
+                    f.write(data)
+            except Exception as e:
+                log_main.error(f"Failed to write replay chunk for {filename}: {e}")
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+replay_writer = ReplayWriter()
+
+# --- Checkpoints ---
+def rebase_times(value, offset):
+    """Copy of an entity/event structure with its absolute game-clock times shifted by offset.
+    Times are always floats (the clock is), so int defaults like last_shot_time=0 pass through;
+    float zeros shift too and come back as exactly 0.0. Every 'cooldowns' value is a time."""
+    if isinstance(value, list):
+        return [rebase_times(v, offset) for v in value]
+    if not isinstance(value, dict):
+        return value
+    out = {}
+    for key, v in value.items():
+        if key == 'cooldowns' and isinstance(v, dict):
+            out[key] = {k: t + offset if isinstance(t, float) else t for k, t in v.items()}
+        elif key in CHECKPOINT_TIME_KEYS and isinstance(v, float):
+            out[key] = v + offset
+        elif isinstance(v, (dict, list)):
+            out[key] = rebase_times(v, offset)
+        else:
+            out[key] = v
+    return out
+
 # --- Game Simulation Class ---
 class Game:
-    # CORRECTED SIGNATURE and BODY
-    def __init__(self, game_id, host_id, broadcast_state_callback, on_game_finished_callback, max_players=MAX_PLAYERS):
+    # --- Generic Trooper/Police Chatter ---
+    potential_speech_generic = (
+        "Stop, Kelly!",
+        "You won't escape!",
+        "Surrender, outlaw!",
+        "Gotcha now!",
+        "He's too fast!",
+        "Easy work today.", # Overconfident
+        "Nowhere left to hide.", # Overconfident
+        "This'll be quick.", # Overconfident
+        "The reward's as good as mine!", # Overconfident/Greedy
+        "For the Queen!", # Thematic
+        "Uphold the law!", # Thematic
+        "Damn bushrangers!", # Thematic
+        "Think of the reward!" # Thematic/Greedy
+    )
+
+    # --- Shooter Specific Lines ---
+    potential_speech_shooter = (
+        "Steady... Aim...",
+        "Got him in my sights!",
+        "Eat lead!",
+        "Hold still!"
+    )
+
+    # --- Armor Specific (Used if player has armor) ---
+    potential_speech_armor = (
+        "Curse that armor!",
+    )
+
+    def __init__(self, game_id, host_id, broadcast_state_callback, on_game_finished_callback, max_players=MAX_PLAYERS, seed=None):
+        self.players = {}
+        self.enemies = {}
+        self.bullets = {}
+        self.powerups = {}
+        self.events = [] # Gameplay events since the last broadcast snapshot
+        self.enemy_history = PositionHistory()
+        self.flow_field = FlowField(CANVAS_WIDTH, CANVAS_HEIGHT)
+        self.ai = AIScheduler()
+        self.enemy_grid = SpatialHash(ENEMY_SEPARATION_RADIUS)
+        self.director = SpawnDirector()
+        self.rng = random.Random()
+        self.input_log = InputLog()
+        self.replay_overrides = None # {(tick, kind): value} while re-simulating a recorded game
+        self.triggers = {} # player_id -> [target_coords, rewind] while the fire button is held
+        self.in_pool = False
+        self.reset(game_id, host_id, broadcast_state_callback, on_game_finished_callback, max_players, seed)
+        log_game.info(f"[{self.game_id}] Game instance initialized with max_players = {self.max_players}.")
+
+    def reset(self, game_id, host_id, broadcast_state_callback, on_game_finished_callback, max_players=MAX_PLAYERS, seed=None):
+        """Puts the instance back into a fresh 'waiting' state so pooled games can be reused."""
         self.game_id = game_id
         self.host_id = host_id
         self._broadcast_state = broadcast_state_callback
         self._on_game_finished = on_game_finished_callback # Include the callback storage
-        self.max_players = max_players # CORRECT: Assign from the parameter
+        self.max_players = max_players
+
+        # All game randomness and time come from here, so a recorded game can be replayed exactly
+        self.seed = secrets.randbits(64) if seed is None else seed
+        self.rng.seed(self.seed)
+        self.clock = time.time() # Game time: starts at wall time, then advances only by tick deltas
+        self.tick = 0
+        self.input_log.clear(game_id, host_id, self.seed, self.clock, max_players)
+        self.replay_overrides = None
 
         self.status = 'waiting'
-        self.players = {}
-        self.enemies = {}
-        self.bullets = {}
-        self.powerups = {}
+        # Entity dicts are cleared rather than replaced so a recycled game keeps its allocations
+        self.players.clear()
+        self.enemies.clear()
+        self.bullets.clear()
+        self.powerups.clear()
+        self.events = []
+        self.enemy_history.clear()
+        self.flow_field.clear()
+        self.ai.clear()
+        self.enemy_grid.clear()
+        self.director.clear()
+        self.campfire_cost_applied = False
+        self.triggers.clear()
         self.score = 0
         self.level = 1
         self.is_night = False
@@ -171,7 +1000,6 @@ class Game:
         self.canvas_width = CANVAS_WIDTH
         self.canvas_height = CANVAS_HEIGHT
         self.game_over_check_timer = GAME_OVER_CHECK_INTERVAL
-        self.damage_texts = {}
         self.campfire_x = CANVAS_WIDTH / 2
         self.campfire_y = CANVAS_HEIGHT / 2
         self.campfire_radius = 75
@@ -181,57 +1009,11 @@ class Game:
         self.enemy_speech_timer = 0.0
         self.enemy_speech_cooldown = 5.0
         self.enemy_speech_chance = 0.4
-        self.potential_speech_generic = [
-            "Stop, Kelly!", "You won't escape!", "Surrender, outlaw!", "Gotcha now!", "He's too fast!",
-            "Easy work today.", "Nowhere left to hide.", "This'll be quick.", "The reward's as good as mine!",
-            "For the Queen!", "Uphold the law!", "Damn bushrangers!", "Think of the reward!"
-        ]
-        self.potential_speech_shooter = ["Steady... Aim...", "Got him in my sights!", "Eat lead!", "Hold still!"]
-        self.potential_speech_armor = ["Curse that armor!"]
-        self.active_enemy_speech_id = None
-        self.current_enemy_speech = None
 
+        self.last_snapshot = None # Most recent broadcast state; catch-up for resumed sessions
         self.loop_task = None
-        # CORRECTED: Indent log inside __init__ and use correct variable
-        log_game.info(f"[{self.game_id}] Game instance initialized with max_players = {self.max_players}.")
+        self.handed_off = False # Set when a draining server checkpoints this game for its successor
 
-        # --- Generic Trooper/Police Chatter ---
-        self.potential_speech_generic = [
-            "Stop, Kelly!",
-            "You won't escape!",
-            "Surrender, outlaw!",
-            "Gotcha now!",
-            "He's too fast!",
-            "Easy work today.", # Overconfident
-            "Nowhere left to hide.", # Overconfident
-            "This'll be quick.", # Overconfident
-            "The reward's as good as mine!", # Overconfident/Greedy
-            "For the Queen!", # Thematic
-            "Uphold the law!", # Thematic
-            "Damn bushrangers!", # Thematic
-            "Think of the reward!" # Thematic/Greedy
-        ]
-
-        # --- Shooter Specific Lines ---
-        self.potential_speech_shooter = [
-            "Steady... Aim...",
-            "Got him in my sights!",
-            "Eat lead!",
-            "Hold still!"
-        ]
-
-        # --- Armor Specific (Used if player has armor) ---
-        self.potential_speech_armor = [
-            "Curse that armor!"
-        ]
-
-        self.active_enemy_speech_id = None
-        self.current_enemy_speech = None
-                    
-        self.loop_task = None
-        log_game.info(f"[{self.game_id}] Instance created")
-
-      
     def _update_campfire_regen(self, delta_time):
         """Applies health regeneration to players near the campfire at night."""
         if not self.is_night:
@@ -254,7 +1036,9 @@ class Game:
 
     def remove_player(self, player_id):
         if player_id in self.players:
+            self._record('leave', player_id)
             del self.players[player_id]
+            self.triggers.pop(player_id, None)
             log_game.info(f"[{self.game_id}] Player {player_id} removed ({len(self.players)}/{self.max_players} remaining).")
             if self.status != 'finished':
                 if not self.players:
@@ -272,24 +1056,99 @@ class Game:
         if player and isinstance(direction, dict):
             dx = max(-1.0, min(1.0, direction.get('dx', 0)))
             dy = max(-1.0, min(1.0, direction.get('dy', 0)))
+            self._record('move', player_id, dx, dy)
             player['input_vector'] = {'dx': dx, 'dy': dy}
 
-    def player_shoot(self, player_id, target_coords): # <<< Parameter changed
-        player = self.players.get(player_id)
-        # Basic checks remain the same
-        if not player or self.status != 'active' or player.get('health', 0) <= 0:
-            log_game.debug(f"Player shoot ignored for {player_id}. Conditions not met (Player: {bool(player)}, Status: {self.status}, Health: {player.get('health', 0) if player else 'N/A'})")
+    def player_shoot(self, player_id, target_coords, view_time=None):
+        """Single shot (legacy per-shot message). Rate limited by the server-side fire cadence.
+        view_time: server timestamp of the snapshot the client was rendering when it fired (lag compensation)."""
+        player = self._shooter(player_id)
+        if not player or not self._valid_target(player_id, target_coords):
             return
-
-        # --- Calculate Direction Vector SERVER-SIDE ---
-        if not isinstance(target_coords, dict):
-            log_game.warning(f"Player shoot failed for {player_id}: target_coords is not a dict ({target_coords})")
+        self._record('shoot', player_id, target_coords['x'], target_coords['y'], view_time)
+        now = self.clock
+        cooldowns = player.setdefault('cooldowns', {})
+        if now < cooldowns.get('shot_ready_at', 0.0) - FIRE_JITTER_TOLERANCE:
+            return # Faster than this ammo type allows
+        cooldowns['shot_ready_at'] = now + self._fire_cooldown(player)
+        self._fire(player_id, player, target_coords, self._rewind_for(view_time, now), now)
+
+    # --- Held Trigger (server-owned fire cadence) ---
+    def trigger_down(self, player_id, target_coords, view_time=None):
+        """Starts automatic fire towards target_coords; shots are spawned by _update_triggers at the ammo's cadence."""
+        player = self._shooter(player_id)
+        if not player or not self._valid_target(player_id, target_coords):
             return
-        target_x = target_coords.get('x')
-        target_y = target_coords.get('y')
-        if target_x is None or target_y is None:
-            log_game.warning(f"Player shoot failed for {player_id}: target_coords missing x or y ({target_coords})")
+        self._record('trigger', player_id, target_coords['x'], target_coords['y'], view_time)
+        now = self.clock
+        self.triggers[player_id] = [target_coords, self._rewind_for(view_time, now)]
+        cooldowns = player.setdefault('cooldowns', {})
+        if now >= cooldowns.get('shot_ready_at', 0.0):
+            cooldowns['shot_ready_at'] = now # First shot goes out on this press, not a tick later
+        self._fire_held_trigger(player_id, player, now)
+
+    def aim_update(self, player_id, target_coords, view_time=None):
+        """Moves the aim of a held trigger. Ignored when the trigger isn't held."""
+        trigger = self.triggers.get(player_id)
+        if trigger is not None and self._valid_target(player_id, target_coords):
+            self._record('aim', player_id, target_coords['x'], target_coords['y'], view_time)
+            trigger[0] = target_coords
+            trigger[1] = self._rewind_for(view_time, self.clock)
+
+    def release_trigger(self, player_id):
+        if self.triggers.pop(player_id, None) is not None:
+            self._record('release', player_id)
+
+    def _update_triggers(self, delta_time):
+        if not self.triggers:
             return
+        now = self.clock
+        for player_id in list(self.triggers):
+            player = self._shooter(player_id)
+            if player is None:
+                continue # Down/dead: keep holding, resumes firing if revived
+            self._fire_held_trigger(player_id, player, now)
+
+    def _fire_held_trigger(self, player_id, player, now):
+        target_coords, rewind = self.triggers[player_id]
+        cooldowns = player.setdefault('cooldowns', {})
+        cooldown = self._fire_cooldown(player)
+        ready_at = max(cooldowns.get('shot_ready_at', 0.0), now - cooldown) # No burst after a long gap
+        # Cadences faster than the tick rate fire several shots per tick, each aged by its due time
+        while ready_at <= now:
+            self._fire(player_id, player, target_coords, rewind, now, age=now - ready_at)
+            ready_at += cooldown
+        cooldowns['shot_ready_at'] = ready_at
+
+    def _shooter(self, player_id):
+        player = self.players.get(player_id)
+        if not player or self.status != 'active' or player.get('health', 0) <= 0 or player.get('player_status', PLAYER_STATUS_ALIVE) != PLAYER_STATUS_ALIVE:
+            log_sampled(log_game, logging.DEBUG, 'shoot.ignored', "Player shoot ignored for %s. Conditions not met (Player: %s, Status: %s, Health: %s)", player_id, bool(player), self.status, player.get('health', 0) if player else 'N/A')
+            return None
+        return player
+
+    def _valid_target(self, player_id, target_coords):
+        if not isinstance(target_coords, dict):
+            log_sampled(log_game, logging.WARNING, 'shoot.bad_target', "Player shoot failed for %s: target_coords is not a dict (%s)", player_id, target_coords)
+            return False
+        if not isinstance(target_coords.get('x'), (int, float)) or not isinstance(target_coords.get('y'), (int, float)):
+            log_sampled(log_game, logging.WARNING, 'shoot.bad_target', "Player shoot failed for %s: target_coords missing x or y (%s)", player_id, target_coords)
+            return False
+        return True
+
+    def _fire_cooldown(self, player):
+        return FIRE_COOLDOWNS.get(player.get('active_ammo_type', 'standard'), FIRE_COOLDOWNS['standard'])
+
+    def _rewind_for(self, view_time, now):
+        """Lag compensation: how far behind the server the shooter was looking (capped)."""
+        if isinstance(view_time, (int, float)) and math.isfinite(view_time):
+            return min(LAG_COMP_MAX_REWIND, max(0.0, now - view_time))
+        return 0.0
+
+    def _fire(self, player_id, player, target_coords, rewind, now, age=0.0):
+        """Spawns the bullet(s) for one shot of the player's active ammo type."""
+        target_x = target_coords['x']
+        target_y = target_coords['y']
 
         # Use the server's authoritative position for the player
         player_x = player['x']
@@ -302,7 +1161,6 @@ class Game:
 
         # Normalize the direction vector
         if mag_sq < 0.01: # If target is basically *on* the player, default aim (e.g., up)
-            # log_game.debug(f"Player {player_id} shoot target too close, defaulting direction.")
             # TODO: Maybe use player's last known movement direction or view direction if available?
             norm_dx, norm_dy = 0, -1 # Defaulting to UP for now
         else:
@@ -317,7 +1175,6 @@ class Game:
         base_damage = BULLET_DEFAULTS['damage'] + (player.get('gun', 1) - 1) * 5
         base_speed = BULLET_DEFAULTS['speed']
         base_radius = BULLET_DEFAULTS['radius']
-        now = time.time()
 
 
         # --- Determine Active Ammo Type ---
@@ -335,7 +1192,7 @@ class Game:
             pellet_damage = base_damage * 0.4 # Pellet damage factor
             for _ in range(6): # Pellet count
                 # Calculate spread relative to the server-calculated direction
-                angle_offset = random.uniform(-0.175, 0.175) # Half of spread angle (0.35 / 2 radians ~= 20 degrees)
+                angle_offset = self.rng.uniform(-0.175, 0.175) # Half of spread angle (0.35 / 2 radians ~= 20 degrees)
                 base_angle = math.atan2(norm_dy, norm_dx) # Use server's calculated angle
                 pellet_angle = base_angle + angle_offset
                 pellet_dx = math.cos(pellet_angle)
@@ -371,7 +1228,7 @@ class Game:
                 'bullet_type': 'ammo_heavy_slug' # Use type string
             })
 
-        else: # Standard or Rapid Fire (Client handles rapid timing, server just spawns one bullet per message)
+        else: # Standard or Rapid Fire (cadence comes from FIRE_COOLDOWNS)
             # Use server's calculated direction (norm_dx, norm_dy)
             start_x = player_x + norm_dx * spawn_offset
             start_y = player_y + norm_dy * spawn_offset
@@ -387,9 +1244,13 @@ class Game:
 
         # --- Add generated bullets to game state ---
         for bullet_data in bullets_to_create:
-            b_id = generate_id()
-            bullet_data['id'] = b_id
-            self.bullets[b_id] = bullet_data
+            bullet_data['rewind'] = rewind
+            if age > 0: # Shot was due earlier this tick: place it where it would be by now
+                bullet_data['x'] += bullet_data['vx'] * age
+                bullet_data['y'] += bullet_data['vy'] * age
+                bullet_data['spawn_time'] = now - age
+            bullet_data['id'] = self._new_id()
+            self._spawn_bullet(bullet_data, now)
             # log_game.debug(f"Created bullet {b_id} ({bullet_data.get('bullet_type')}) for player {player_id}") # Optional log
 
 
@@ -409,9 +1270,23 @@ class Game:
         elif self.status == 'waiting':
              log_game.warning(f"[{self.game_id}] start_countdown called but not full ({len(self.players)}/{self.max_players}).")
 
+    def start_single_player(self, player_id):
+        """Single player skips the countdown: straight to 'active' with a fresh player."""
+        self._record('start', player_id)
+        self.status = 'active'
+        self.level = 1
+        player = self.players[player_id]
+        player.update({
+            'health': player.get('max_health', PLAYER_DEFAULTS['max_health']),
+            'kills': 0, 'score': 0, 'gun': 1, 'armor': 0,
+            'speed': player.get('base_speed', PLAYER_DEFAULTS['base_speed']),
+            'effects': {}, 'input_vector': {'dx': 0, 'dy': 0}, 'cooldowns': {}
+        })
+
     def start_game(self):
         if self.status == 'countdown':
             self.status = 'active'; self.level = 1; self.score = 0; self.is_night = False
+            self.director.clear()
             self.day_night_timer = DAY_NIGHT_CYCLE_DURATION / 2
             self.enemy_spawn_timer = self._get_current_enemy_spawn_interval()
             self.powerup_spawn_timer = POWERUP_SPAWN_INTERVAL
@@ -440,10 +1315,25 @@ class Game:
                 log_game.error(f"[{self.game_id}] Error scheduling on_game_finished callback: {cb_err}")
         # --- END MODIFICATION ---
 
-        if self.loop_task and not self.loop_task.done():
+        # When called from inside the loop (game over check), let the loop exit on its own so it can
+        # still send the final state - cancelling ourselves would kill that last broadcast.
+        if self.loop_task and not self.loop_task.done() and self.loop_task is not asyncio.current_task():
             log_game.debug(f"[{self.game_id}] Cancelling game loop task from finish_game.")
             self.loop_task.cancel()
 
+    def release_entities(self):
+        """Drops all entity state once the server has torn this game down."""
+        self.players.clear(); self.enemies.clear(); self.bullets.clear()
+        self.powerups.clear(); self.events = []
+        self.enemy_history.clear()
+        self.flow_field.clear()
+        self.ai.clear()
+        self.enemy_grid.clear()
+        self.triggers.clear()
+        self.last_snapshot = None
+        self._broadcast_state = None
+        self._on_game_finished = None
+
     async def run_game_loop(self):
         log_game.info(f"[{self.game_id}] Starting loop task.")
         last_tick_time = time.monotonic()
@@ -458,24 +1348,25 @@ class Game:
                     break
 
                 now_monotonic = time.monotonic()
-                delta_time = min(0.1, now_monotonic - last_tick_time)
-                last_tick_time = now_monotonic
+                delta_units = round(min(0.1, now_monotonic - last_tick_time) * REPLAY_DELTA_SCALE)
 
-                if delta_time <= 0:
+                if delta_units <= 0:
                     await asyncio.sleep(TICK_RATE / 2)
                     continue
+                last_tick_time = now_monotonic
 
                 snapshot = None
                 try:
-                    current_status = self.status
-                    if current_status == 'active' or current_status == 'countdown':
-                        self._update(delta_time)
+                    self.step(delta_units)
 
                     if self.status == 'finished':
                         log_game.info(f"[{self.game_id}] Loop detected status='finished' after _update, breaking.")
                         break
 
                     snapshot = self.get_state()
+                    snapshot['events'] = self.take_events()
+                    if REPLAY_MODE == 'all' and self.tick % REPLAY_FLUSH_TICKS == 0 and self.director.elapsed > 0:
+                        replay_writer.submit(self.input_log.filename(), self.input_log.take_chunk())
 
                 except Exception as loop_err:
                     log_game.error(f"[{self.game_id}] EXCEPTION during game tick simulation: {loop_err}", exc_info=True)
@@ -484,6 +1375,7 @@ class Game:
                     break
 
                 if self.status != 'finished' and snapshot:
+                    self.last_snapshot = snapshot
                     try:
                         # Ensure players still exist before broadcasting state
                         if self.players:
@@ -507,6 +1399,7 @@ class Game:
 
             self.status = 'finished'
             final_state = self.get_state()
+            final_state['events'] = self.take_events()
 
             if self._broadcast_state:
                 try:
@@ -524,10 +1417,73 @@ class Game:
             log_game.error(f"[{self.game_id}] FATAL error in game loop: {e}", exc_info=True)
             if self.status != 'finished': self.finish_game(f"Fatal Loop Error: {e}")
         finally:
-            if self.status != 'finished':
-                 log_game.warning(f"[{self.game_id}] Loop 'finally' block reached unexpectedly. Forcing status to finished.")
-                 self.status = 'finished'
-            log_game.info(f"[{self.game_id}] Game loop task ended. Final Status: {self.status}. Final state sent: {final_state_sent}")
+            tick_load.forget(self.game_id)
+            if self.handed_off:
+                # Carries on in the successor from its checkpoint: not finished, and its replay is still open
+                log_game.info(f"[{self.game_id}] Game loop stopped for hand-off at tick {self.tick}.")
+            else:
+                if self.status != 'finished':
+                     log_game.warning(f"[{self.game_id}] Loop 'finally' block reached unexpectedly. Forcing status to finished.")
+                     self.status = 'finished'
+                if REPLAY_MODE in ('finished', 'all') and self.director.elapsed > 0: # Lobbies that never started aren't worth keeping
+                    chunk = self.input_log.take_chunk()
+                    chunk['end'] = {'ticks': self.tick, 'score': self.score, 'level': self.level}
+                    replay_writer.submit(self.input_log.filename(), chunk)
+                log_game.info(f"[{self.game_id}] Game loop task ended. Final Status: {self.status}. Final state sent: {final_state_sent}")
+
+    # --- Tick / Replay ---
+    def step(self, delta_units):
+        """Advances the game one tick of delta_units / REPLAY_DELTA_SCALE seconds. The live loop
+        and replay_game both come through here, so they simulate identically."""
+        delta_time = delta_units / REPLAY_DELTA_SCALE
+        self.tick += 1
+        self.clock += delta_time
+        live = self.replay_overrides is None
+        if live:
+            self.input_log.deltas.append(delta_units)
+        if self.status != 'active' and self.status != 'countdown':
+            if live: self.input_log.costs.append(0)
+            return
+        was_active = self.status == 'active'
+        self._sample_pressure()
+        update_started = time.perf_counter()
+        self._update(delta_time)
+        if live:
+            cost = time.perf_counter() - update_started
+            self.director.record_tick(self.game_id, cost)
+            self.input_log.costs.append(round(cost * 1e6))
+        if was_active and self.status != 'finished':
+            self.enemy_history.record(self.clock, self.enemies) # Keyed like the snapshot timestamp clients see
+
+    def _sample_pressure(self):
+        """Fixes this tick's load pressure for the director; recorded when it changes since it comes from wall-clock costs."""
+        if self.replay_overrides is None:
+            pressure = round(max(1.0, self.director.pressure()), 1) # Coarse: below 1 nothing changes anyway
+            if pressure != self.director.current_pressure:
+                self.input_log.overrides.append((self.tick, 'pressure', pressure))
+        else:
+            pressure = self.replay_overrides.get((self.tick, 'pressure'), self.director.current_pressure)
+        self.director.current_pressure = pressure
+
+    def _record(self, kind, *args):
+        if self.replay_overrides is None:
+            self.input_log.inputs.append((self.tick, kind) + args)
+
+    def _new_id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def apply_input(self, kind, player_id, *args):
+        """Re-applies one recorded input (see _record call sites for the argument layouts)."""
+        if kind == 'move': self.set_player_input(player_id, {'dx': args[0], 'dy': args[1]})
+        elif kind == 'shoot': self.player_shoot(player_id, {'x': args[0], 'y': args[1]}, args[2])
+        elif kind == 'trigger': self.trigger_down(player_id, {'x': args[0], 'y': args[1]}, args[2])
+        elif kind == 'aim': self.aim_update(player_id, {'x': args[0], 'y': args[1]}, args[2])
+        elif kind == 'release': self.release_trigger(player_id)
+        elif kind == 'pushback': self.handle_pushback(player_id)
+        elif kind == 'join': self.add_player(player_id)
+        elif kind == 'leave': self.remove_player(player_id)
+        elif kind == 'start': self.start_single_player(player_id)
+        else: raise ValueError(f"Unknown recorded input kind: {kind}")
 
     def _update(self, delta_time):
         # --- Initial status checks ---
@@ -549,9 +1505,9 @@ class Game:
             self._update_player_statuses(delta_time) 
             self._update_campfire_regen(delta_time) 
             self._update_players(delta_time)
+            self._update_triggers(delta_time)
             self._update_enemies(delta_time)
             self._update_bullets(delta_time)
-            self._update_damage_texts(delta_time)
             self._spawn_entities(delta_time)
             self._update_enemy_speech(delta_time)
             self._check_collisions() # Checks hits -> DOWN status
@@ -591,8 +1547,21 @@ class Game:
     def _update_enemies(self, delta_time):
         alive_players = [p for p in self.players.values() if p.get('player_status') == PLAYER_STATUS_ALIVE] # Check status now
         if not alive_players: return
-        now = time.time()
+        now = self.clock
+        field = self._update_flow_field(alive_players, now)
+        alive_by_id = {p['id']: p for p in alive_players}
+
+        # --- Think (time-sliced): target, shoot decision, LOD ---
+        think_args = (field, alive_by_id, alive_players, now)
+        if self.replay_overrides is None:
+            thought, cut_short = self.ai.run(self._enemy_think, *think_args)
+            if cut_short: # Budget-dependent, so the replay needs to know where this tick stopped
+                self.input_log.overrides.append((self.tick, 'think_limit', thought))
+        else:
+            self.ai.run(self._enemy_think, *think_args, limit=self.replay_overrides.get((self.tick, 'think_limit'), math.inf))
+        brains = self.ai.brains
 
+        # --- Move (every tick) ---
         for enemy_id, enemy in list(self.enemies.items()):
             # --- ADD FREEZE CHECK ---
             if now < enemy.get('freeze_until', 0):
@@ -603,73 +1572,146 @@ class Game:
             if enemy.get('health', 0) <= 0 or 'death_timestamp' in enemy:
                  continue
 
-            # --- Target Finding ---
-            target = min(alive_players, key=lambda p: distance_sq(enemy['x'], enemy['y'], p['x'], p['y']), default=None)
-            if not target: continue
+            brain = brains.get(enemy_id) or self.ai.brain(enemy_id)
+            target = alive_by_id.get(brain['target_id'])
+            if target is None: # New enemy, or its target went down since the last think
+                self._enemy_think(enemy_id, brain, *think_args)
+                target = alive_by_id.get(brain['target_id'])
+                if target is None: continue
             dx, dy = target['x'] - enemy['x'], target['y'] - enemy['y']
             dist_sq = dx * dx + dy * dy
-            # --- End Target Finding ---
+            cell = field.cell_at(enemy['x'], enemy['y'])
 
             # --- MOVEMENT LOGIC ---
-            enemy_w_half = enemy.get('width', ENEMY_DEFAULTS['width']) / 2
-            target_w_half = target.get('width', PLAYER_DEFAULTS['width']) / 2
-            stop_distance_sq = (target_w_half + enemy_w_half + 5)**2
-            enemy_type = enemy.get('type', ENEMY_TYPE_CHASER)
-            if enemy_type == ENEMY_TYPE_SHOOTER:
-                 stop_distance_sq = max(stop_distance_sq, enemy.get('shoot_range_sq', ENEMY_DEFAULTS['shoot_range_sq']) * 0.6)
-
-            if dist_sq > stop_distance_sq:
+            if dist_sq > brain['stop_distance_sq']:
                 dist = math.sqrt(dist_sq)
                 speed_mod = 1.3 if self.is_night else 1.0
                 speed = enemy.get('speed', ENEMY_DEFAULTS['speed'])
                 move_dist = speed * speed_mod * delta_time
-                vx, vy = (dx / dist) * move_dist, (dy / dist) * move_dist
+                steer = field.direction(cell) if field.dist[cell] > FLOW_FIELD_DIRECT_RANGE else None
+                if steer: # Follow the field around costly/blocked cells
+                    vx, vy = steer[0] * move_dist, steer[1] * move_dist
+                else:
+                    vx, vy = (dx / dist) * move_dist, (dy / dist) * move_dist
                 new_x = enemy['x'] + vx; new_y = enemy['y'] + vy
+                enemy_w_half = enemy.get('width', ENEMY_DEFAULTS['width']) / 2
                 e_h_half = enemy.get('height', ENEMY_DEFAULTS['height']) / 2 # Use local var name
                 enemy['x'] = max(enemy_w_half, min(self.canvas_width - enemy_w_half, new_x))
                 enemy['y'] = max(e_h_half, min(self.canvas_height - e_h_half, new_y))
             # --- End Movement Logic ---
 
-            # --- SHOOTING LOGIC (Only for Shooters) ---
-            if enemy_type == ENEMY_TYPE_SHOOTER:
-                shoot_range_sq = enemy.get('shoot_range_sq', ENEMY_DEFAULTS['shoot_range_sq'])
-                shoot_cooldown = enemy.get('shoot_cooldown', ENEMY_DEFAULTS['shoot_cooldown'])
-                last_shot = enemy.get('last_shot_time', 0)
-
-                if dist_sq <= shoot_range_sq and (now - last_shot) > shoot_cooldown:
-                    # Re-calculate dist if not done during movement phase
-                    dist = math.sqrt(dist_sq)
-                    if dist < 0.01: continue # Safety check
-
-                    bullet_speed = enemy.get('bullet_speed', ENEMY_BULLET_DEFAULTS['speed'])
-                    bullet_vx = (dx / dist) * bullet_speed
-                    bullet_vy = (dy / dist) * bullet_speed
-                    bullet_radius = ENEMY_BULLET_DEFAULTS['radius']
-                    offset = enemy_w_half + bullet_radius + 2
-                    start_x = enemy['x'] + (dx/dist) * offset
-                    start_y = enemy['y'] + (dy/dist) * offset
-
-                    b_id = generate_id()
-                    self.bullets[b_id] = {
-                        'id': b_id, 'x': start_x, 'y': start_y, 'vx': bullet_vx, 'vy': bullet_vy,
-                        'owner_id': enemy_id, 'owner_type': 'enemy',
-                        'damage': enemy.get('bullet_damage', ENEMY_BULLET_DEFAULTS['damage']),
-                        'spawn_time': now,
-                        'lifetime': enemy.get('bullet_lifetime', ENEMY_BULLET_DEFAULTS['lifetime']),
-                        'radius': bullet_radius,
-                        'bullet_type': ENEMY_BULLET_DEFAULTS['bullet_type']
-                    }
-                    enemy['last_shot_time'] = now
-            # --- End Shooting Logic ---
+            # --- SHOOTING (decided at think time, aimed at the target's current position) ---
+            if brain['wants_shot']:
+                brain['wants_shot'] = False
+                self._enemy_shoot(enemy_id, enemy, dx, dy, now)
+
+        self._separate_enemies(delta_time, now)
+
+    def _separate_enemies(self, delta_time, now):
+        """Pushes crowding enemies apart so chasers fan out around a player instead of stacking."""
+        live = [e for e in self.enemies.values() if e.get('health', 0) > 0 and 'death_timestamp' not in e]
+        if len(live) < 2: return
+        grid = self.enemy_grid
+        grid.rebuild(live)
+        radius = ENEMY_SEPARATION_RADIUS
+        radius_sq = radius * radius
+        pushes = []
+        for e in live:
+            if now < e.get('freeze_until', 0): continue # Frozen enemies still push others but don't move
+            ex, ey = e['x'], e['y']
+            push_x = push_y = 0.0
+            for ox, oy, other in grid.neighbours(ex, ey):
+                if other is e: continue
+                dx, dy = ex - ox, ey - oy
+                d_sq = dx * dx + dy * dy
+                if d_sq >= radius_sq: continue
+                if d_sq < 1e-6: # Exactly stacked: pick a direction
+                    angle = self.rng.uniform(0, 2 * math.pi)
+                    push_x += math.cos(angle); push_y += math.sin(angle)
+                    continue
+                d = math.sqrt(d_sq)
+                weight = (radius - d) / (radius * d) # Stronger the deeper the overlap; also normalizes (dx, dy)
+                push_x += dx * weight; push_y += dy * weight
+            if push_x or push_y:
+                pushes.append((e, push_x, push_y))
+
+        # Apply after all pushes are computed so the result doesn't depend on iteration order
+        max_step = ENEMY_SEPARATION_SPEED * delta_time
+        for e, push_x, push_y in pushes:
+            mag = math.hypot(push_x, push_y)
+            step = max_step * min(1.0, mag) / mag
+            w_half = e.get('width', ENEMY_DEFAULTS['width']) / 2
+            h_half = e.get('height', ENEMY_DEFAULTS['height']) / 2
+            e['x'] = max(w_half, min(self.canvas_width - w_half, e['x'] + push_x * step))
+            e['y'] = max(h_half, min(self.canvas_height - h_half, e['y'] + push_y * step))
+
+    def _enemy_think(self, enemy_id, brain, field, alive_by_id, alive_players, now):
+        """Slow-changing decisions for one enemy. Returns ticks until its next think (None = forget it)."""
+        enemy = self.enemies.get(enemy_id)
+        if not enemy or 'death_timestamp' in enemy:
+            return None
+        # --- Target Finding (nearest player comes from the shared flow field) ---
+        cell = field.cell_at(enemy['x'], enemy['y'])
+        target = alive_by_id.get(field.nearest[cell])
+        if target is None: # Unreachable cell
+            target = min(alive_players, key=lambda p: distance_sq(enemy['x'], enemy['y'], p['x'], p['y']))
+        brain['target_id'] = target['id']
+        brain['far'] = field.dist[cell] > AI_FAR_DISTANCE_CELLS
+
+        # --- Stop distance (movement halts inside it until the next think) ---
+        enemy_w_half = enemy.get('width', ENEMY_DEFAULTS['width']) / 2
+        target_w_half = target.get('width', PLAYER_DEFAULTS['width']) / 2
+        stop_distance_sq = (target_w_half + enemy_w_half + 5)**2
+        is_shooter = enemy.get('type', ENEMY_TYPE_CHASER) == ENEMY_TYPE_SHOOTER
+        if is_shooter:
+             stop_distance_sq = max(stop_distance_sq, enemy.get('shoot_range_sq', ENEMY_DEFAULTS['shoot_range_sq']) * 0.6)
+        brain['stop_distance_sq'] = stop_distance_sq
+
+        # --- Shoot decision (Only for Shooters) ---
+        if is_shooter and now >= enemy.get('freeze_until', 0):
+            shoot_range_sq = enemy.get('shoot_range_sq', ENEMY_DEFAULTS['shoot_range_sq'])
+            shoot_cooldown = enemy.get('shoot_cooldown', ENEMY_DEFAULTS['shoot_cooldown'])
+            if (distance_sq(enemy['x'], enemy['y'], target['x'], target['y']) <= shoot_range_sq
+                    and (now - enemy.get('last_shot_time', 0)) > shoot_cooldown):
+                brain['wants_shot'] = True
+        return AI_FAR_THINK_INTERVAL_TICKS if brain['far'] else AI_THINK_INTERVAL_TICKS
+
+    def _enemy_shoot(self, enemy_id, enemy, dx, dy, now):
+        dist = math.sqrt(dx * dx + dy * dy)
+        if dist < 0.01: return # Safety check
+        if len(self.bullets) >= MAX_LIVE_BULLETS: return # Hold fire; the shot is re-decided at the next think
+
+        bullet_speed = enemy.get('bullet_speed', ENEMY_BULLET_DEFAULTS['speed'])
+        bullet_vx = (dx / dist) * bullet_speed
+        bullet_vy = (dy / dist) * bullet_speed
+        bullet_radius = ENEMY_BULLET_DEFAULTS['radius']
+        offset = enemy.get('width', ENEMY_DEFAULTS['width']) / 2 + bullet_radius + 2
+        start_x = enemy['x'] + (dx/dist) * offset
+        start_y = enemy['y'] + (dy/dist) * offset
+
+        self._spawn_bullet({
+            'id': self._new_id(), 'x': start_x, 'y': start_y, 'vx': bullet_vx, 'vy': bullet_vy,
+            'owner_id': enemy_id, 'owner_type': 'enemy',
+            'damage': enemy.get('bullet_damage', ENEMY_BULLET_DEFAULTS['damage']),
+            'spawn_time': now,
+            'lifetime': enemy.get('bullet_lifetime', ENEMY_BULLET_DEFAULTS['lifetime']),
+            'radius': bullet_radius,
+            'bullet_type': ENEMY_BULLET_DEFAULTS['bullet_type']
+        }, now)
+        enemy['last_shot_time'] = now
 
     # --- End of _update_enemies function ---
+
+    def _update_flow_field(self, alive_players, now):
+        if self.campfire_cost_applied != self.is_night: # Campfire only burns at night
+            cost = FLOW_FIELD_CAMPFIRE_COST if self.is_night else 1.0
+            self.flow_field.set_circle_cost(self.campfire_x, self.campfire_y, self.campfire_radius, cost)
+            self.campfire_cost_applied = self.is_night
+            self.flow_field.invalidate()
+        self.flow_field.update(alive_players, now)
+        return self.flow_field
     
     def _update_enemy_speech(self, delta_time):
-        # --- CLEAR PREVIOUS SPEECH AT THE START OF THE UPDATE ---
-        self.active_enemy_speech_id = None
-        self.current_enemy_speech = None
-        # -------------------------------------------------------
-
         self.enemy_speech_timer += delta_time
 
         # Only check if game is active
@@ -678,14 +1720,17 @@ class Game:
              return
 
         if self.enemy_speech_timer >= self.enemy_speech_cooldown:
-            log_game.debug(f"Enemy speech cooldown met ({self.enemy_speech_timer:.2f}s). Checking chance...") # Log before reset
+            log_sampled(log_game, logging.DEBUG, 'speech.roll', "Enemy speech cooldown met (%.2fs). Checking chance...", self.enemy_speech_timer) # Log before reset
             self.enemy_speech_timer = 0.0 # Reset timer regardless of chance success
 
-            if random.random() < self.enemy_speech_chance:
-                log_game.debug("Enemy speech chance succeeded. Selecting speaker...")
+            if self.rng.random() < self.enemy_speech_chance:
+                log_sampled(log_game, logging.DEBUG, 'speech.chance', "Enemy speech chance succeeded. Selecting speaker...")
                 alive_enemies = [e for e in self.enemies.values() if e.get('health', 0) > 0]
+                # Only enemies near a player (per their last think) are worth hearing
+                near_enemies = [e for e in alive_enemies if not self.ai.brains.get(e['id'], {}).get('far', False)]
+                alive_enemies = near_enemies or alive_enemies
                 if alive_enemies:
-                    speaker = random.choice(alive_enemies)
+                    speaker = self.rng.choice(alive_enemies)
                     speaker_type = speaker.get('type', ENEMY_TYPE_CHASER)
 
                     # Build potential speech pool
@@ -700,23 +1745,21 @@ class Game:
                     # -------------------------------------------
 
                     if speech_pool:
-                        chosen_phrase = random.choice(speech_pool)
-                        # --- SET SPEECH FOR THIS TICK ---
-                        self.active_enemy_speech_id = speaker['id']
-                        self.current_enemy_speech = chosen_phrase
-                        # ---------------------------------
-                        log_game.debug(f"Enemy {speaker['id']} (Type: {speaker_type}) speaking: '{chosen_phrase}'")
+                        chosen_phrase = self.rng.choice(speech_pool)
+                        self._emit('speech', speaker_id=speaker['id'], text=chosen_phrase)
+                        log_game.debug("Enemy %s (Type: %s) speaking: '%s'", speaker['id'], speaker_type, chosen_phrase)
                     else:
-                        log_game.debug(f"No speech lines available for enemy {speaker['id']} type {speaker_type}.")
+                        log_game.debug("No speech lines available for enemy %s type %s.", speaker['id'], speaker_type)
                 else:
-                    log_game.debug("Speech chance succeeded, but no alive enemies to speak.")
+                    log_sampled(log_game, logging.DEBUG, 'speech.no_speaker', "Speech chance succeeded, but no alive enemies to speak.")
             else:
-                 log_game.debug("Enemy speech chance failed.")
+                 log_sampled(log_game, logging.DEBUG, 'speech.failed', "Enemy speech chance failed.")
            # No else needed, timer is reset above if cooldown met
 
     def _update_bullets(self, delta_time):
-        now = time.time()
+        now = self.clock
         bullets_to_remove = [] # Use a list for simpler append
+        bullets_out_of_bounds = []
 
         for bullet_id, bullet in list(self.bullets.items()): # Iterate over a copy of items for safe modification
             # Check lifetime first
@@ -734,37 +1777,45 @@ class Game:
             radius = bullet.get('radius', BULLET_DEFAULTS['radius'])
             if (bullet['x'] < -radius or bullet['x'] > self.canvas_width + radius or
                 bullet['y'] < -radius or bullet['y'] > self.canvas_height + radius):
-                 bullets_to_remove.append(bullet_id)
+                 bullets_out_of_bounds.append(bullet_id)
 
-        # Remove bullets marked for removal
+        # Expired bullets need no despawn event: clients drop them at 'until' on their own
         for bullet_id in bullets_to_remove:
             self.bullets.pop(bullet_id, None)
+        self._despawn_bullets(bullets_out_of_bounds, now)
 
 
     def _get_current_enemy_spawn_interval(self):
-        # Ensure level doesn't make interval too short or negative
-        return max(0.5, ENEMY_SPAWN_INTERVAL - (self.level * 0.15))
+        return self.director.spawn_interval(self.level)
 
     def _spawn_entities(self, delta_time):
+        self.level = self.director.advance(delta_time)
         # --- Enemy Spawning (Only during the Day) ---
         if not self.is_night:
             self.enemy_spawn_timer -= delta_time
             if self.enemy_spawn_timer <= 0:
+                live_enemies = sum(1 for e in self.enemies.values() if 'death_timestamp' not in e)
+                enemy_cap = self.director.enemy_cap()
+                if live_enemies >= enemy_cap: # Hot server or full map: wait out another interval
+                    log_sampled(log_game, logging.INFO, 'spawn.throttled', "[%s] Spawn held: %d live enemies, cap %d (pressure %.2f, process load %.2f)",
+                                self.game_id, live_enemies, enemy_cap, self.director.current_pressure, tick_load.load())
+                    self.enemy_spawn_timer = self._get_current_enemy_spawn_interval()
+                    return
                 # Spawn at edges, not center
-                side = random.choice(['top', 'bottom', 'left', 'right'])
+                side = self.rng.choice(['top', 'bottom', 'left', 'right'])
                 margin = 30  # Spawn outside playable area
                 if side == 'top':
-                    x = random.uniform(0, self.canvas_width)
+                    x = self.rng.uniform(0, self.canvas_width)
                     y = -margin
                 elif side == 'bottom':
-                    x = random.uniform(0, self.canvas_width)
+                    x = self.rng.uniform(0, self.canvas_width)
                     y = self.canvas_height + margin
                 elif side == 'left':
                     x = -margin
-                    y = random.uniform(0, self.canvas_height)
+                    y = self.rng.uniform(0, self.canvas_height)
                 else:  # right
                     x = self.canvas_width + margin
-                    y = random.uniform(0, self.canvas_height)
+                    y = self.rng.uniform(0, self.canvas_height)
 
                 # Check if the spawn position collides with any player
                 player = next(iter(self.players.values()), None)
@@ -772,21 +1823,14 @@ class Game:
                     return  # Skip spawn if colliding with player
 
                 # Proceed to spawn the enemy
-                enemy_id = generate_id()
-                self.enemies[enemy_id] = {
-                    **ENEMY_DEFAULTS,
-                    'id': enemy_id,
-                    'x': x,
-                    'y': y,
-                    'health': ENEMY_DEFAULTS['max_health'],
-                    'type': ENEMY_TYPE_CHASER,  # Default to chaser
-                }
-                self.enemy_spawn_timer = ENEMY_SPAWN_INTERVAL
+                enemy_id = self._new_id()
+                self.enemy_spawn_timer = self._get_current_enemy_spawn_interval()
 
-                # --- CHOOSE ENEMY TYPE ---
-                enemy_type = random.choices(
+                # --- CHOOSE ENEMY TYPE (mix set by the director's difficulty curve) ---
+                shooter_weight = self.director.shooter_weight(self.level)
+                enemy_type = self.rng.choices(
                      [ENEMY_TYPE_CHASER, ENEMY_TYPE_SHOOTER],
-                     weights=[0.6, 0.4], # 60% chance chaser, 40% shooter (adjust as needed)
+                     weights=[1.0 - shooter_weight, shooter_weight],
                      k=1
                 )[0]
 
@@ -816,7 +1860,7 @@ class Game:
                     'last_shot_time': 0 # Initialize for shooters
                     # Other shooter params like bullet_damage, bullet_speed, shoot_range_sq use defaults unless overridden
                 }
-                log_game.debug(f"[{self.game_id}] Spawned enemy {enemy_id} (Type: {enemy_type}) at level {self.level}")
+                log_sampled(log_game, logging.DEBUG, 'spawn.enemy', "[%s] Spawned enemy %s (Type: %s) at level %s", self.game_id, enemy_id, enemy_type, self.level)
         else:
             # Reset timer if it went negative during the night
             if self.enemy_spawn_timer < 0:
@@ -826,18 +1870,18 @@ class Game:
         # --- Powerup Spawning (Continues day and night) ---
         self.powerup_spawn_timer -= delta_time
         if self.powerup_spawn_timer <= 0:
-            self.powerup_spawn_timer = POWERUP_SPAWN_INTERVAL + random.uniform(-2.0, 2.0)
+            self.powerup_spawn_timer = POWERUP_SPAWN_INTERVAL + self.rng.uniform(-2.0, 2.0)
             # Limit max powerups on screen
             if len(self.powerups) < 5:
-                 pu_id = generate_id(); p_type = random.choice(POWERUP_TYPES)
+                 pu_id = self._new_id(); p_type = self.rng.choice(POWERUP_TYPES)
                  # Ensure powerups spawn within visible bounds
-                 pu_x = random.uniform(POWERUP_DEFAULTS['size'], self.canvas_width - POWERUP_DEFAULTS['size'])
-                 pu_y = random.uniform(POWERUP_DEFAULTS['size'], self.canvas_height - POWERUP_DEFAULTS['size'])
+                 pu_x = self.rng.uniform(POWERUP_DEFAULTS['size'], self.canvas_width - POWERUP_DEFAULTS['size'])
+                 pu_y = self.rng.uniform(POWERUP_DEFAULTS['size'], self.canvas_height - POWERUP_DEFAULTS['size'])
                  self.powerups[pu_id] = {
                      **POWERUP_DEFAULTS, 'id': pu_id,
                      'x': pu_x, 'y': pu_y, 'type': p_type
                  }
-                 log_game.debug(f"[{self.game_id}] Spawned powerup {p_type} at ({pu_x:.0f}, {pu_y:.0f})")
+                 log_game.debug("[%s] Spawned powerup %s at (%.0f, %.0f)", self.game_id, p_type, pu_x, pu_y)
 
     def _calculate_damage(self, base_damage, target_player):
         if not target_player: return base_damage
@@ -870,11 +1914,12 @@ class Game:
         if player_id in self.players or len(self.players) >= self.max_players:
              log_game.warning(f"Add player {player_id} failed. Already present or game full ({len(self.players)}/{self.max_players}).")
              return False
+        self._record('join', player_id)
 
         new_player = {
             **PLAYER_DEFAULTS,
             'id': player_id,
-            'x': self.canvas_width / 2 + random.uniform(-25, 25),
+            'x': self.canvas_width / 2 + self.rng.uniform(-25, 25),
             'y': self.canvas_height - 50,
             'input_vector': {'dx': 0, 'dy': 0},
             'effects': {},
@@ -892,7 +1937,7 @@ class Game:
         return True
 
     def _update_player_effects(self, delta_time):
-        now = time.time()
+        now = self.clock
         for player in self.players.values():
             # Reset base speed (or other stats affected by expiring effects)
             player['speed'] = player.get('base_speed', PLAYER_DEFAULTS['base_speed'])
@@ -904,7 +1949,7 @@ class Game:
                                if isinstance(v, dict) and 'expires_at' in v and now >= v['expires_at']]
 
             for k in expired_effects:
-                log_game.debug(f"[{self.game_id}] Player {player['id']} effect '{k}' expired.")
+                log_game.debug("[%s] Player %s effect '%s' expired.", self.game_id, player['id'], k)
                 del player['effects'][k] # Remove the expired effect
 
             # Apply active effects
@@ -920,17 +1965,17 @@ class Game:
             expires_at = player.get('ammo_effect_expires_at', 0)
             # Check if timer is set (>0) and expired
             if expires_at > 0 and now >= expires_at:
-                log_game.info(f"Player {player['id']} special ammo '{current_ammo}' expired.")
+                log_game.info("Player %s special ammo '%s' expired.", player['id'], current_ammo)
                 player['active_ammo_type'] = 'standard' # Reset to standard
                 player['ammo_effect_expires_at'] = 0.0 # Clear timer
 
 
     def _apply_powerup(self, player, powerup_type):
         if not player: return False
-        now = time.time()
+        now = self.clock
         value = POWERUP_VALUES.get(powerup_type, 0)
         duration = POWERUP_DEFAULTS.get('duration', 10.0)
-        log_game.debug(f"Applying powerup '{powerup_type}' to player {player['id']}")
+        log_game.debug("Applying powerup '%s' to player %s", powerup_type, player['id'])
 
         if powerup_type == 'speed_boost':
             player.setdefault('effects', {})
@@ -955,7 +2000,7 @@ class Game:
     def _check_collisions(self):
         bullets_to_remove = set()
         powerups_to_remove = set()
-        now = time.time()
+        now = self.clock
 
         # --- 1. Bullet Collisions ---
         for b_id, b in list(self.bullets.items()):
@@ -963,18 +2008,21 @@ class Game:
 
             # --- A. PLAYER Bullets vs Enemies ---
             if b.get('owner_type') == 'player':
+                # Test against enemies where the shooter saw them (capped rewind), falling back to the live position
+                rewind = b.get('rewind', 0.0)
+                rewound = self.enemy_history.frame_at(now - rewind) if rewind > 0 else None
                 for e_id, e in list(self.enemies.items()):
                     # Skip check if enemy is dead/fading or bullet already hit something this tick
                     if e.get('health', 0) <= 0 or ('death_timestamp' in e) or b_id in bullets_to_remove:
                         continue
 
                     # Check collision (bullet vs enemy)
-                    if check_aabb_collision(b, e):
+                    if check_aabb_collision(b, e, rewound.get(e_id) if rewound else None):
                         # Calculate BASE damage
                         base_damage = b.get('damage', BULLET_DEFAULTS['damage'])
 
                         # --- Check for Critical Hit ---
-                        is_crit = random.random() < PLAYER_CRIT_CHANCE
+                        is_crit = self.rng.random() < PLAYER_CRIT_CHANCE
                         damage_dealt = base_damage * (PLAYER_CRIT_MULTIPLIER if is_crit else 1.0)
                         # --- End Crit Check ---
 
@@ -982,19 +2030,7 @@ class Game:
                         e['health'] -= damage_dealt
                         e['health'] = max(0.0, e['health']) # Clamp health at 0
 
-                        # --- Create Damage Text ---
-                        dmg_text_id = generate_id()
-                        self.damage_texts[dmg_text_id] = {
-                            'id': dmg_text_id,
-                            'text': f"{damage_dealt:.0f}",
-                            'x': e['x'] + random.uniform(-e['width']/4, e['width']/4),
-                            'y': e['y'] - e['height']/2,
-                            'spawn_time': now,
-                            'lifetime': DAMAGE_TEXT_DEFAULTS['lifetime'] * (1.5 if is_crit else 1.0),
-                            'speed_y': DAMAGE_TEXT_DEFAULTS['speed_y'],
-                            'is_crit': is_crit
-                        }
-                        # --- End Damage Text Creation ---
+                        self._emit_hit(e, damage_dealt, is_crit)
 
                         # --- MARK BULLET FOR REMOVAL (CRITICAL FIX) ---
                         bullets_to_remove.add(b_id)
@@ -1011,7 +2047,8 @@ class Game:
 
                         # Handle enemy death timestamp and score awarding
                         if e['health'] <= 0 and 'death_timestamp' not in e:
-                            e['death_timestamp'] = time.time()
+                            e['death_timestamp'] = self.clock
+                            self._emit('death', target_id=e_id, by=b.get('owner_id'))
                             if owner_player:
                                 enemy_score_value = e.get('score_value', ENEMY_DEFAULTS['score_value'])
                                 owner_player['kills'] = owner_player.get('kills', 0) + 1
@@ -1039,15 +2076,7 @@ class Game:
                          bullets_to_remove.add(b_id)
                          # --- END MARK BULLET ---
 
-                         # Create Damage Text
-                         dmg_text_id = generate_id()
-                         self.damage_texts[dmg_text_id] = {
-                             'id': dmg_text_id, 'text': f"{damage_taken:.0f}",
-                             'x': p['x'] + random.uniform(-p['width']/4, p['width']/4),
-                             'y': p['y'] - p['height']/2, 'spawn_time': now,
-                             'lifetime': DAMAGE_TEXT_DEFAULTS['lifetime'],
-                             'speed_y': DAMAGE_TEXT_DEFAULTS['speed_y'], 'is_crit': is_crit
-                         }
+                         self._emit_hit(p, damage_taken, is_crit)
 
                          # Handle player being downed
                          if p['health'] <= 0:
@@ -1079,21 +2108,9 @@ class Game:
                         p['health'] -= damage_taken
                         p['health'] = max(0.0, p['health'])
                         p['cooldowns'][last_hit_time_key] = now
-                        log_game.debug(f"Player {p_id} MELEE hit by enemy {e_id}. Took {damage_taken:.1f} dmg. HP: {p['health']:.1f}, Armor: {p['armor']:.1f}")
-
-                        # --- Create Damage Text (Enemy Melee Hit) ---
-                        dmg_text_id = generate_id()
-                        self.damage_texts[dmg_text_id] = {
-                            'id': dmg_text_id,
-                            'text': f"{damage_taken:.0f}",
-                            'x': p['x'] + random.uniform(-p['width']/4, p['width']/4),
-                            'y': p['y'] - p['height']/2,
-                            'spawn_time': now,
-                            'lifetime': DAMAGE_TEXT_DEFAULTS['lifetime'],
-                            'speed_y': DAMAGE_TEXT_DEFAULTS['speed_y'],
-                            'is_crit': is_crit # False for enemy hits
-                        }
-                        # --- End Damage Text Creation ---
+                        log_sampled(log_game, logging.DEBUG, 'collide.melee', "Player %s MELEE hit by enemy %s. Took %.1f dmg. HP: %.1f, Armor: %.1f", p_id, e_id, damage_taken, p['health'], p['armor'])
+
+                        self._emit_hit(p, damage_taken, is_crit) # Enemy melee hit
 
                         if p['health'] <= 0:
                             self._player_hit_zero_health(p_id)
@@ -1111,14 +2128,14 @@ class Game:
                      if powerup_type in ['ammo_shotgun', 'ammo_heavy_slug', 'ammo_rapid_fire']:
                          p['active_ammo_type'] = powerup_type
                          p['ammo_effect_expires_at'] = now + SPECIAL_AMMO_DURATION
-                         log_game.info(f"Player {p_id} activated {powerup_type} for {SPECIAL_AMMO_DURATION}s.")
+                         log_game.info("Player %s activated %s for %ss.", p_id, powerup_type, SPECIAL_AMMO_DURATION)
                          powerups_to_remove.add(pu_id)
 
                      # --- Handle Bonus Score Type ---
                      elif powerup_type == 'bonus_score':
                          p['score'] = p.get('score', 0) + BONUS_SCORE_VALUE
                          self.score += BONUS_SCORE_VALUE
-                         log_game.info(f"Player {p_id} collected bonus score: +{BONUS_SCORE_VALUE}. Player Score: {p['score']}, Game Score: {self.score}")
+                         log_game.info("Player %s collected bonus score: +%s. Player Score: %s, Game Score: %s", p_id, BONUS_SCORE_VALUE, p['score'], self.score)
                          powerups_to_remove.add(pu_id)
 
                      # Calls the separate _apply_powerup function for health, armor, gun, speed
@@ -1130,17 +2147,19 @@ class Game:
                           log_game.warning(f"Unknown or unhandled powerup type collected: {powerup_type}")
                           powerups_to_remove.add(pu_id)
 
+                     if pu_id in powerups_to_remove:
+                          self._emit('pickup', player_id=p_id, powerup_type=powerup_type, x=round(pu['x']), y=round(pu['y']))
+
         # --- 3. Final Cleanup ---
 
-        for b_id in bullets_to_remove:
-            self.bullets.pop(b_id, None) 
+        self._despawn_bullets(bullets_to_remove, now)
 
         for pu_id in powerups_to_remove:
             self.powerups.pop(pu_id, None) 
 
     def _cleanup_entities(self):
         """Removes entities that have fully faded out after death."""
-        now = time.time()
+        now = self.clock
         enemies_to_fully_remove = []
 
         for eid, e in list(self.enemies.items()): # Iterate safely
@@ -1151,25 +2170,9 @@ class Game:
         # Remove the fully faded enemies
         for eid in enemies_to_fully_remove:
             self.enemies.pop(eid, None)
+            self.ai.forget(eid)
             #log_game.debug(f"Fully removed faded enemy {eid}") # Optional log
 
-    def _update_damage_texts(self, delta_time):
-        """Updates position and lifetime of floating damage numbers."""
-        now = time.time()
-        texts_to_remove = []
-        for text_id, text_data in list(self.damage_texts.items()): # Iterate over items safely
-            # Update lifetime check
-            if (now - text_data.get('spawn_time', now)) > text_data.get('lifetime', DAMAGE_TEXT_DEFAULTS['lifetime']):
-                texts_to_remove.append(text_id)
-                continue
-
-            # Update position (move upwards)
-            text_data['y'] += text_data.get('speed_y', DAMAGE_TEXT_DEFAULTS['speed_y']) * delta_time
-
-        # Remove expired texts
-        for text_id in texts_to_remove:
-            self.damage_texts.pop(text_id, None)
-            
     def _player_hit_zero_health(self, player_id):
         player = self.players.get(player_id)
         if not player or player.get('player_status') != PLAYER_STATUS_ALIVE:
@@ -1188,7 +2191,7 @@ class Game:
                 is_teammate_alive = True
                 break
 
-        now = time.time()
+        now = self.clock
         if is_teammate_alive:
             down_duration = 45.0
             player['down_timer_expires_at'] = now + down_duration
@@ -1202,7 +2205,7 @@ class Game:
 
     def _update_player_statuses(self, delta_time):
         """Checks timers for downed players and sets status to ALIVE or DEAD based on the 'will_revive_on_timer' flag."""
-        now = time.time()
+        now = self.clock
 
         for p_id, p in self.players.items():
             if p.get('player_status') == PLAYER_STATUS_DOWN:
@@ -1260,8 +2263,9 @@ class Game:
         if not player or self.status != 'active' or player.get('player_status') != PLAYER_STATUS_ALIVE:
             log_game.debug(f"Pushback ignored for {player_id}: Player invalid, game inactive, or player not alive.")
             return
+        self._record('pushback', player_id)
 
-        now = time.time()
+        now = self.clock
         cooldowns = player.setdefault('cooldowns', {}) # Ensure cooldowns dict exists
         pushback_ready_at = cooldowns.get('pushback_ready_at', 0)
 
@@ -1297,7 +2301,7 @@ class Game:
                     e_h_half = enemy.get('height', ENEMY_DEFAULTS['height']) / 2
                     enemy['x'] = max(e_w_half, min(self.canvas_width - e_w_half, new_enemy_x))
                     enemy['y'] = max(e_h_half, min(self.canvas_height - e_h_half, new_enemy_y))
-                    log_game.debug(f" -> Pushed enemy {enemy_id}")
+                    log_sampled(log_game, logging.DEBUG, 'pushback.enemy', " -> Pushed enemy %s", enemy_id)
                     pushed_something = True
 
             # --- Push Nearby Teammate ---
@@ -1329,7 +2333,7 @@ class Game:
                     o_h_half = other_player.get('height', PLAYER_DEFAULTS['height']) / 2
                     other_player['x'] = max(o_w_half, min(self.canvas_width - o_w_half, new_other_x))
                     other_player['y'] = max(o_h_half, min(self.canvas_height - o_h_half, new_other_y))
-                    log_game.debug(f" -> Pushed teammate {other_player_id}")
+                    log_game.debug(" -> Pushed teammate %s", other_player_id)
                     pushed_something = True
                     # Only push one teammate per activation? Probably fine to push all in range.
 
@@ -1348,15 +2352,51 @@ class Game:
             pass
 
 
+    # --- Gameplay Events ---
+    def _emit(self, event_type, **fields):
+        fields['type'] = event_type
+        self.events.append(fields)
+
+    def _emit_hit(self, target, amount, is_crit):
+        """Damage number source: the client animates the float/fade from here."""
+        self._emit('hit', target_id=target['id'], x=round(target['x']), y=round(target['y'] - target.get('height', 0) / 2),
+                   amount=round(amount), crit=is_crit)
+
+    # Bullets fly in straight lines, so they are announced once and extrapolated client-side
+    # instead of riding in every snapshot. x/y are the position at server time t.
+    def _spawn_bullet(self, bullet, now):
+        self.bullets[bullet['id']] = bullet
+        self.events.append(self._bullet_spawn_event(bullet, now))
+
+    def _bullet_spawn_event(self, bullet, now):
+        return {'type': 'bullet_spawn', 'id': bullet['id'], 't': now,
+                'x': round(bullet['x'], 1), 'y': round(bullet['y'], 1),
+                'vx': round(bullet['vx'], 1), 'vy': round(bullet['vy'], 1),
+                'until': bullet['spawn_time'] + bullet.get('lifetime', BULLET_DEFAULTS['lifetime']),
+                'radius': bullet.get('radius', BULLET_DEFAULTS['radius']),
+                'bullet_type': bullet.get('bullet_type'), 'owner_type': bullet.get('owner_type')}
+
+    def _despawn_bullets(self, bullet_ids, now):
+        despawned = [b_id for b_id in bullet_ids if self.bullets.pop(b_id, None) is not None]
+        if despawned:
+            self._emit('bullet_despawn', ids=despawned, t=now)
+
+    def bullet_spawn_events(self):
+        """Spawn events for every bullet in flight; catch-up for clients that missed them."""
+        now = self.clock # Positions are as of the last tick
+        return [self._bullet_spawn_event(b, now) for b in self.bullets.values()]
+
+    def take_events(self):
+        """Hands the pending events to exactly one snapshot."""
+        events, self.events = self.events, []
+        return events
+
     def get_state(self):
         state = {'game_id': self.game_id, 'status': self.status, 'players': self.players,
-                 'enemies': self.enemies, 'bullets': self.bullets, 'powerups': self.powerups,
-                 'damage_texts': self.damage_texts,
+                 'enemies': self.enemies, 'powerups': self.powerups,
                  'score': self.score, 'is_night': self.is_night,
-                 'game_over': self.status == 'finished', 'host_id': self.host_id, 'timestamp': time.time(),
+                 'game_over': self.status == 'finished', 'host_id': self.host_id, 'timestamp': self.clock,
                  'day_night_timer_remaining': max(0.0, self.day_night_timer),
-                 'enemy_speaker_id': self.active_enemy_speech_id,
-                 'enemy_speech_text': self.current_enemy_speech,
                  'max_players': self.max_players,
                  # --- ADD CAMPFIRE INFO ---
                  'campfire': {
@@ -1369,111 +2409,1013 @@ class Game:
         if self.status == 'countdown': state['countdown'] = max(0.0, self.countdown_timer)
         return state
 
+    # Scalar attributes a checkpoint carries as-is (timers here already count down in seconds)
+    _CHECKPOINT_FIELDS = ('status', 'tick', 'score', 'level', 'is_night', 'countdown_timer', 'day_night_timer',
+                          'enemy_spawn_timer', 'powerup_spawn_timer', 'game_over_check_timer',
+                          'enemy_speech_timer', 'enemy_speech_cooldown', 'enemy_speech_chance',
+                          'campfire_x', 'campfire_y', 'campfire_radius', 'campfire_regen_rate',
+                          'canvas_width', 'canvas_height')
+
+    def checkpoint(self):
+        """
+        Versioned, gzipped snapshot of the whole simulation, taken between ticks. Absolute game-clock
+        times (cooldowns, effect expiries, bullet spawn times, lag-comp history, ...) are stored
+        relative to the clock, so the blob reads the same whenever it was taken.
+        """
+        now = self.clock
+        data = {'version': CHECKPOINT_VERSION, 'game_id': self.game_id, 'host_id': self.host_id,
+                'max_players': self.max_players, 'seed': self.seed, 'clock': now,
+                **{field: getattr(self, field) for field in self._CHECKPOINT_FIELDS},
+                'rng': self.rng.getstate(),
+                'players': rebase_times(self.players, -now), 'enemies': rebase_times(self.enemies, -now),
+                'bullets': rebase_times(self.bullets, -now), 'powerups': rebase_times(self.powerups, -now),
+                'events': rebase_times(self.events, -now), 'triggers': self.triggers,
+                'enemy_history': self.enemy_history.state(now), 'flow_field': self.flow_field.state(now),
+                'ai': self.ai.state(),
+                'director': {'elapsed': self.director.elapsed, 'tick_cost': self.director.tick_cost,
+                             'current_pressure': self.director.current_pressure},
+                'replay': self.input_log.to_dict(with_progress=True) if REPLAY_MODE != 'off' else None}
+        return gzip.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), mtime=0)
+
+    def restore(self, blob):
+        """Replaces this instance's state with a checkpoint() blob; the next step() continues exactly where
+        it left off. Callbacks stay this instance's. The loop isn't started here."""
+        data = json.loads(gzip.decompress(blob))
+        if data.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {data.get('version')}")
+        self.reset(data['game_id'], data['host_id'], self._broadcast_state, self._on_game_finished, data['max_players'], data['seed'])
+        now = self.clock = data['clock'] # Game time, not wall time: it carries on from the checkpoint
+        for field in self._CHECKPOINT_FIELDS:
+            setattr(self, field, data[field])
+        self.campfire_radius_sq = self.campfire_radius * self.campfire_radius
+        version, internal, gauss_next = data['rng']
+        self.rng.setstate((version, tuple(internal), gauss_next))
+
+        self.players.update(rebase_times(data['players'], now))
+        self.enemies.update(rebase_times(data['enemies'], now))
+        self.bullets.update(rebase_times(data['bullets'], now))
+        self.powerups.update(rebase_times(data['powerups'], now))
+        self.events = rebase_times(data['events'], now)
+        self.triggers.update(data['triggers'])
+        self.enemy_history.load_state(data['enemy_history'], now)
+        if self.is_night: # Cell costs follow from the campfire, so they're rebuilt rather than stored
+            self.flow_field.set_circle_cost(self.campfire_x, self.campfire_y, self.campfire_radius, FLOW_FIELD_CAMPFIRE_COST)
+        self.campfire_cost_applied = self.is_night
+        self.flow_field.load_state(data['flow_field'], now)
+        self.ai.load_state(data['ai'])
+        self.director.elapsed = data['director']['elapsed']
+        self.director.tick_cost = data['director']['tick_cost']
+        self.director.current_pressure = data['director']['current_pressure']
+        if data.get('replay'):
+            self.input_log = InputLog.from_dict(data['replay'])
+        else:
+            self.input_log.clear(self.game_id, self.host_id, self.seed, now, self.max_players)
+        log_game.info(f"[{self.game_id}] Restored from checkpoint at tick {self.tick} ({len(self.players)} players, {len(self.enemies)} enemies, status '{self.status}').")
+
+def replay_ticks(input_log):
+    """Re-simulates a recorded game offline, yielding (game, seconds spent in step) after every tick."""
+    game = Game(input_log.game_id, input_log.host_id, None, None, input_log.max_players, seed=input_log.seed)
+    game.clock = input_log.clock_start
+    game.replay_overrides = {(tick, kind): value for tick, kind, value in input_log.overrides}
+    inputs = iter(input_log.inputs)
+    pending = next(inputs, None)
+    for delta_units in input_log.deltas:
+        while pending is not None and pending[0] <= game.tick:
+            game.apply_input(*pending[1:])
+            pending = next(inputs, None)
+        started = time.perf_counter()
+        game.step(delta_units)
+        yield game, time.perf_counter() - started
+    while pending is not None: # Inputs after the last tick (e.g. players leaving a finished game)
+        game.apply_input(*pending[1:])
+        pending = next(inputs, None)
+
+def replay_mismatches(game, end):
+    """Differences between a re-simulated game and the file's end record, e.g. ['score: recorded 410, replayed 360']."""
+    replayed = {'ticks': game.tick if game else 0, 'score': game.score if game else 0, 'level': game.level if game else 0}
+    return [f"{key}: recorded {end.get(key)}, replayed {value}" for key, value in replayed.items() if end.get(key) != value]
+
+def replay_game(input_log, end=None):
+    """Re-simulates a recorded game offline from its InputLog; returns the Game in its final state.
+    With the file's end record, warns if the result differs from what was recorded."""
+    game = None
+    for game, _ in replay_ticks(input_log):
+        pass
+    if end:
+        mismatches = replay_mismatches(game, end)
+        if mismatches:
+            log_main.warning(f"Replay of {input_log.game_id} diverged from its recording: {'; '.join(mismatches)}")
+    return game
+
+# --- Game Pool ---
+class GamePool:
+    """
+    Pre-constructed single-player Game objects. SP starts check one out and reset() it
+    instead of building a new instance; finished games are recycled back in.
+    """
+    def __init__(self, size=GAME_POOL_SIZE, max_idle=GAME_POOL_MAX_IDLE):
+        self.size = size
+        self.max_idle = max(size, max_idle)
+        self._idle = collections.deque()
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self._refill_scheduled = False
+
+    def __len__(self):
+        return len(self._idle)
+
+    def prewarm(self):
+        self._refill_scheduled = False
+        while len(self._idle) < self.size:
+            game = Game('POOLED', None, None, None, max_players=1)
+            game.in_pool = True
+            self._idle.append(game)
+
+    def acquire(self, game_id, host_id, broadcast_state_callback, on_game_finished_callback, max_players=1):
+        if self._idle:
+            game = self._idle.pop()
+            game.in_pool = False
+            game.reset(game_id, host_id, broadcast_state_callback, on_game_finished_callback, max_players)
+            self.hits += 1
+            log_game.debug("[%s] Checked out pooled game (%d idle left).", game_id, len(self._idle))
+        else:
+            game = Game(game_id, host_id, broadcast_state_callback, on_game_finished_callback, max_players)
+            self.misses += 1
+        if len(self._idle) < self.size and not self._refill_scheduled:
+            # Top up after this start has been handled, not on its critical path
+            self._refill_scheduled = True
+            asyncio.get_running_loop().call_soon(self.prewarm)
+        return game
+
+    def release(self, game):
+        """Takes back a finished game whose loop has exited. Returns True if it was recycled."""
+        if game.in_pool or game.max_players != 1 or len(self._idle) >= self.max_idle:
+            return False
+        if game.loop_task and not game.loop_task.done():
+            return False # Still referenced by a running loop; let it go instead
+        game.release_entities()
+        game.loop_task = None
+        game.in_pool = True
+        self._idle.append(game)
+        self.recycled += 1
+        return True
+
+    def stats(self):
+        return {'idle': len(self._idle), 'hits': self.hits, 'misses': self.misses, 'recycled': self.recycled}
+
+# --- Matchmaking ---
+class MatchmakingService:
+    """
+    Index of joinable multiplayer lobbies: public games in 'waiting' with free slots,
+    bucketed by (max_players, free_slots). quick_join looks up the fullest open lobby
+    in O(MAX_PLAYERS) instead of scanning every game.
+    """
+    def __init__(self):
+        self._buckets = {}   # (max_players, free_slots) -> {game_id: None} (insertion ordered: oldest lobby first)
+        self._slot_of = {}   # game_id -> its current bucket key
+        self._public = set() # game_ids that opted in to quick_join
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def add_public(self, game):
+        self._public.add(game.game_id)
+        self.update(game)
+
+    def update(self, game):
+        """Re-buckets a game after a join/leave/status change (or drops it if no longer joinable)."""
+        game_id = game.game_id
+        self._unindex(game_id)
+        if game_id not in self._public or game.status != 'waiting':
+            return
+        free = game.max_players - len(game.players)
+        if free <= 0:
+            return
+        key = (game.max_players, free)
+        self._buckets.setdefault(key, {})[game_id] = None
+        self._slot_of[game_id] = key
+
+    def is_public(self, game_id):
+        return game_id in self._public
+
+    def remove(self, game_id):
+        self._public.discard(game_id)
+        self._unindex(game_id)
+
+    def _unindex(self, game_id):
+        key = self._slot_of.pop(game_id, None)
+        if key is None:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.pop(game_id, None)
+            if not bucket: del self._buckets[key]
+
+    def find(self, games, max_players=None):
+        """Returns the open game closest to full (oldest first), or None. 'games' is the live game dict,
+        used to drop stale index entries lazily."""
+        sizes = (max_players,) if max_players else range(MAX_PLAYERS, 1, -1)
+        for free in range(1, MAX_PLAYERS):
+            for size in sizes:
+                bucket = self._buckets.get((size, free))
+                while bucket:
+                    game_id = next(iter(bucket))
+                    game = games.get(game_id)
+                    if game is not None and game.status == 'waiting' and len(game.players) < game.max_players:
+                        return game
+                    # Index drifted (game gone or started without going through update); fix and keep looking
+                    if game is None: self.remove(game_id)
+                    else: self.update(game)
+                    bucket = self._buckets.get((size, free))
+        return None
+
+# --- Resumable Sessions ---
+class ResumableSession:
+    __slots__ = ('token', 'player_id', 'game_id', 'expiry_handle')
+
+    def __init__(self, token, player_id, game_id):
+        self.token = token
+        self.player_id = player_id
+        self.game_id = game_id
+        self.expiry_handle = None # Set while the player is disconnected and their slot is held
+
+class SessionStore:
+    """
+    Resume tokens handed out on association. When a player's socket drops, their slot
+    is held for the grace period; resume_session with the token re-attaches a new socket.
+    """
+    def __init__(self, grace_period=RESUME_GRACE_PERIOD):
+        self.grace_period = grace_period
+        self._by_token = {}  # token -> ResumableSession
+        self._by_player = {} # player_id -> ResumableSession
+
+    def __len__(self):
+        return len(self._by_token)
+
+    def issue(self, player_id, game_id):
+        """Returns the player's token for this game, creating one if needed."""
+        session = self._by_player.get(player_id)
+        if session is not None and session.game_id == game_id:
+            return session.token
+        self.revoke(player_id)
+        session = ResumableSession(secrets.token_urlsafe(16), player_id, game_id)
+        self._by_token[session.token] = session
+        self._by_player[player_id] = session
+        return session.token
+
+    def hold(self, player_id, on_expire):
+        """Starts the grace window for a dropped player. Returns False if they have no session to hold."""
+        session = self._by_player.get(player_id)
+        if session is None or self.grace_period <= 0:
+            return False
+        if session.expiry_handle is not None:
+            session.expiry_handle.cancel()
+        session.expiry_handle = asyncio.get_running_loop().call_later(self.grace_period, on_expire)
+        return True
+
+    def token_for(self, player_id):
+        session = self._by_player.get(player_id)
+        return session.token if session else None
+
+    def adopt(self, token, player_id, game_id):
+        """Registers a token another process issued (game hand-off) so resume_session accepts it here."""
+        self.revoke(player_id)
+        session = ResumableSession(token, player_id, game_id)
+        self._by_token[token] = session
+        self._by_player[player_id] = session
+
+    def is_held(self, player_id):
+        session = self._by_player.get(player_id)
+        return session is not None and session.expiry_handle is not None
+
+    def claim(self, token):
+        """Looks up a token for resume and stops its grace timer. The token stays valid for later drops."""
+        session = self._by_token.get(token) if isinstance(token, str) else None
+        if session is not None and session.expiry_handle is not None:
+            session.expiry_handle.cancel()
+            session.expiry_handle = None
+        return session
+
+    def revoke(self, player_id):
+        session = self._by_player.pop(player_id, None)
+        if session is None:
+            return
+        self._by_token.pop(session.token, None)
+        if session.expiry_handle is not None:
+            session.expiry_handle.cancel()
+
+# --- Connection Registry ---
+def server_hello():
+    """Handshake fields: sent as hello_from_server (legacy) or as 'server_hello' on the association response."""
+    return {'message': SERVER_HELLO_MESSAGE, 'protocol_version': PROTOCOL_VERSION, 'handshake': HANDSHAKE_MODE, 'server_time': time.time()}
+
+class ConnectionInfo:
+    """Metadata for one websocket connection."""
+    __slots__ = ('ws', 'remote', 'connected_at', 'player_id', 'game_id', 'protocol_version', 'bytes_sent', 'messages_sent')
+
+    def __init__(self, ws, remote=None):
+        self.ws = ws
+        self.remote = remote
+        self.connected_at = time.monotonic()
+        self.player_id = None
+        self.game_id = None
+        self.protocol_version = PROTOCOL_VERSION
+        self.bytes_sent = 0
+        self.messages_sent = 0
+
+class ConnectionRegistry:
+    """
+    Keeps ws <-> player <-> game indexes in one place so the send path, disconnects and
+    game cleanup are all dict lookups instead of scans over every connected client.
+    """
+    def __init__(self):
+        self._by_ws = {}        # ws -> ConnectionInfo
+        self._by_player = {}    # player_id -> ConnectionInfo
+        self._game_members = {} # game_id -> set of player_ids
+        self._awaiting_first_state = set() # player_ids associated but not yet sent a game_state
+
+    def __len__(self):
+        return len(self._by_ws)
+
+    def register(self, ws, remote=None):
+        info = self._by_ws.get(ws)
+        if info is None:
+            info = self._by_ws[ws] = ConnectionInfo(ws, remote)
+        return info
+
+    def unregister(self, ws):
+        """Forgets a connection entirely (handler exit). Returns its ConnectionInfo, if any."""
+        info = self._by_ws.pop(ws, None)
+        if info and info.player_id and self._by_player.get(info.player_id) is info:
+            self.detach_player(info.player_id)
+        return info
+
+    def associate(self, ws, player_id, game_id):
+        info = self.register(ws)
+        if info.player_id and info.player_id != player_id:
+            self.detach_player(info.player_id)
+        info.player_id = player_id
+        self._by_player[player_id] = info
+        self.set_game(player_id, game_id)
+        self._awaiting_first_state.add(player_id)
+        return info
+
+    def set_game(self, player_id, game_id):
+        info = self._by_player.get(player_id)
+        if info is not None:
+            self._move_to_game(info, game_id)
+
+    def _move_to_game(self, info, game_id):
+        if info.game_id is not None:
+            members = self._game_members.get(info.game_id)
+            if members is not None:
+                members.discard(info.player_id)
+                if not members: del self._game_members[info.game_id]
+        info.game_id = game_id
+        if game_id is not None:
+            self._game_members.setdefault(game_id, set()).add(info.player_id)
+
+    def detach_player(self, player_id):
+        """Drops the player's ws and game associations. Returns the game_id they were mapped to."""
+        info = self._by_player.pop(player_id, None)
+        if info is None:
+            return None
+        game_id = info.game_id
+        self._move_to_game(info, None)
+        self._awaiting_first_state.discard(player_id)
+        info.player_id = None
+        return game_id
+
+    def release_game(self, game_id):
+        """Unmaps every member of a game (players stay connected). Returns the player_ids that were mapped."""
+        members = self._game_members.pop(game_id, set())
+        for player_id in members:
+            info = self._by_player.get(player_id)
+            if info is not None and info.game_id == game_id:
+                info.game_id = None
+        return members
+
+    def info_for_ws(self, ws):
+        return self._by_ws.get(ws)
+
+    def info_for_player(self, player_id):
+        return self._by_player.get(player_id)
+
+    def ws_for_player(self, player_id):
+        info = self._by_player.get(player_id)
+        return info.ws if info else None
+
+    def player_for_ws(self, ws):
+        info = self._by_ws.get(ws)
+        return info.player_id if info else None
+
+    def game_for_player(self, player_id):
+        info = self._by_player.get(player_id)
+        return info.game_id if info else None
+
+    def players_in_game(self, game_id):
+        return self._game_members.get(game_id, ())
+
+    def player_ids(self):
+        return list(self._by_player)
+
+    def record_send(self, info, num_bytes):
+        info.bytes_sent += num_bytes
+        info.messages_sent += 1
+
+    def awaiting_first_state(self):
+        return bool(self._awaiting_first_state)
+
+    def first_state_sent(self, player_id):
+        """Returns the connection the first time a game_state reaches this player, else None."""
+        if player_id not in self._awaiting_first_state:
+            return None
+        self._awaiting_first_state.discard(player_id)
+        return self._by_player.get(player_id)
+
+class Spectator:
+    """One read-only viewer: a bounded frame queue drained by its own sender task."""
+    __slots__ = ('ws', 'info', 'game_id', 'frames', 'wake', 'task', 'closing')
+
+    def __init__(self, ws, info, game_id):
+        self.ws = ws
+        self.info = info
+        self.game_id = game_id
+        self.frames = collections.deque(maxlen=SPECTATOR_QUEUE_SIZE)
+        self.wake = asyncio.Event()
+        self.task = None
+        self.closing = False
+
+class SpectatorHub:
+    """
+    Read-only connections watching running games. They sit outside the player indexes, so they
+    never count toward max_players or the countdown. The broadcast path encodes one reduced-rate
+    frame per game and only appends it to each viewer's queue; a slow viewer drops its own oldest
+    frames instead of holding up the game loop.
+    """
+    def __init__(self, connections, interval=SPECTATOR_SNAPSHOT_INTERVAL):
+        self.connections = connections
+        self.interval = interval
+        self._by_ws = {}    # ws -> Spectator
+        self._by_game = {}  # game_id -> {ws: Spectator}
+        self._ticks = {}    # game_id -> game_state messages seen since the game's first viewer
+        self._events = {}   # game_id -> events accumulated since the last frame
+        self.frames_encoded = 0
+        self.frames_dropped = 0
+
+    def __len__(self):
+        return len(self._by_ws)
+
+    def watching(self, game_id):
+        return game_id in self._by_game
+
+    def count(self, game_id):
+        return len(self._by_game.get(game_id, ()))
+
+    def add(self, ws, game_id, first_frame=None):
+        """Attaches a viewer. first_frame (the catch-up state) is queued in the same step, so every
+        later frame, and the events it carries, follows it with nothing in between."""
+        self.remove(ws)
+        spectator = Spectator(ws, self.connections.register(ws), game_id)
+        self._by_ws[ws] = spectator
+        self._by_game.setdefault(game_id, {})[ws] = spectator
+        if first_frame is not None:
+            spectator.frames.append(first_frame)
+            spectator.wake.set()
+        spectator.task = asyncio.create_task(self._sender(spectator))
+        return spectator
+
+    def remove(self, ws):
+        spectator = self._by_ws.pop(ws, None)
+        if spectator is None:
+            return None
+        viewers = self._by_game.get(spectator.game_id)
+        if viewers is not None:
+            viewers.pop(ws, None)
+            if not viewers:
+                self._forget_game(spectator.game_id)
+        if spectator.task and spectator.task is not asyncio.current_task():
+            spectator.task.cancel()
+        return spectator
+
+    def _forget_game(self, game_id):
+        self._by_game.pop(game_id, None)
+        self._ticks.pop(game_id, None)
+        self._events.pop(game_id, None)
+
+    def release_game(self, game_id):
+        """Game is gone: each viewer's sender flushes what it has queued, then closes the socket."""
+        viewers = self._by_game.get(game_id)
+        if not viewers:
+            return 0
+        for spectator in viewers.values():
+            spectator.closing = True
+            spectator.wake.set()
+        return len(viewers)
+
+    def publish(self, game_id, message_data):
+        """Called from the broadcast path. game_state messages are thinned to every Nth tick
+        (events in between are carried over); anything else (chat) goes out as-is."""
+        viewers = self._by_game.get(game_id)
+        if not viewers:
+            return
+        if message_data.get('type') == 'game_state':
+            state = message_data['state']
+            pending = self._events.setdefault(game_id, [])
+            pending.extend(state.get('events', ()))
+            tick = self._ticks[game_id] = self._ticks.get(game_id, 0) + 1
+            if tick % self.interval and state.get('status') != 'finished':
+                return
+            message_data = {'type': 'game_state', 'state': {**state, 'events': pending}, 'spectators': len(viewers)}
+            self._events[game_id] = []
+        try:
+            frame = json.dumps(message_data)
+        except Exception as e:
+            log_net.error(f"Spectator frame serialization failed for GID {game_id}: {e}", exc_info=True)
+            return
+        self.frames_encoded += 1
+        for spectator in viewers.values():
+            if len(spectator.frames) == SPECTATOR_QUEUE_SIZE:
+                self.frames_dropped += 1
+            spectator.frames.append(frame)
+            spectator.wake.set()
+
+    async def _sender(self, spectator):
+        ws = spectator.ws
+        try:
+            while True:
+                await spectator.wake.wait()
+                spectator.wake.clear()
+                while spectator.frames and not ws.closed:
+                    frame = spectator.frames.popleft()
+                    await ws.send_str(frame)
+                    self.connections.record_send(spectator.info, len(frame))
+                if spectator.closing or ws.closed:
+                    break
+            if not ws.closed:
+                await ws.close(code=1000, message=b'Game over')
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log_sampled(log_net, logging.WARNING, 'spectate.send', "Spectator send failed for GID %s: %s", spectator.game_id, e)
+        finally:
+            if self._by_ws.get(ws) is spectator:
+                self.remove(ws)
+
+    def stats(self):
+        return {'viewers': len(self._by_ws), 'games': len(self._by_game),
+                'frames_encoded': self.frames_encoded, 'frames_dropped': self.frames_dropped}
+
+class ServerMetrics:
+    """Rolling connect -> first game_state latency, exported on GET /metrics."""
+    def __init__(self, window=LATENCY_SAMPLE_WINDOW):
+        self.first_state_latencies = collections.deque(maxlen=window) # Seconds
+        self.first_state_count = 0
+
+    def record_first_state(self, latency):
+        self.first_state_latencies.append(latency)
+        self.first_state_count += 1
+
+    def latency_summary(self):
+        samples = sorted(self.first_state_latencies)
+        if not samples:
+            return {'count': self.first_state_count, 'window': 0}
+        def pct(q): return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1)
+        return {'count': self.first_state_count, 'window': len(samples),
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 1),
+                'p50_ms': pct(0.50), 'p95_ms': pct(0.95), 'p99_ms': pct(0.99), 'max_ms': round(samples[-1] * 1000, 1)}
+
+# --- Cluster Registry ---
+def shard_of(game_id):
+    """The owning node's shard, read straight off a clustered game ID (no registry lookup)."""
+    _, sep, code = game_id.partition('_')
+    if not sep or len(code) != CLUSTER_SHARD_LENGTH + GAME_CODE_LENGTH:
+        return None # Standalone-style ID: only the registry's game table knows its owner
+    return code[:CLUSTER_SHARD_LENGTH]
+
+class InProcessGameRegistry:
+    """
+    Cluster registry held in this process. Nodes sharing it must live in one interpreter,
+    so it suits a single node and tests; SqliteGameRegistry is the multi-process backend.
+    """
+    def __init__(self):
+        self._nodes = {} # shard -> (url, last_seen)
+        self._games = {} # game_id -> (shard, max_players)
+
+    def register_node(self, shard, url):
+        self._nodes[shard] = (url, time.time())
+
+    def heartbeat(self, shard):
+        node = self._nodes.get(shard)
+        if node is not None:
+            self._nodes[shard] = (node[0], time.time())
+
+    def unregister_node(self, shard):
+        self._nodes.pop(shard, None)
+        for game_id in [g for g, (owner, _) in self._games.items() if owner == shard]:
+            del self._games[game_id]
+
+    def node_url(self, shard):
+        node = self._nodes.get(shard)
+        if node is None or time.time() - node[1] > CLUSTER_NODE_TTL:
+            return None
+        return node[0]
+
+    def register_game(self, game_id, shard, max_players):
+        self._games[game_id] = (shard, max_players)
+
+    def unregister_game(self, game_id):
+        self._games.pop(game_id, None)
+
+    def locate_game(self, game_id):
+        entry = self._games.get(game_id)
+        return entry[0] if entry else None
+
+    def stats(self):
+        now = time.time()
+        return {'backend': 'local', 'games': len(self._games),
+                'nodes': {shard: {'url': url, 'age': round(now - seen, 1)} for shard, (url, seen) in self._nodes.items()}}
+
+class SqliteGameRegistry:
+    """
+    Cluster registry in a SQLite file, for several nodes on one host (local cluster testing).
+    Writes happen on game create/release and heartbeats only, never per tick, and go through a
+    background thread: another node holding the write lock must not stall this node's game loops.
+    Reads run inline; in WAL mode they don't wait on writers.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=CLUSTER_REGISTRY_READ_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS nodes (shard TEXT PRIMARY KEY, url TEXT NOT NULL, last_seen REAL NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS games (game_id TEXT PRIMARY KEY, shard TEXT NOT NULL, max_players INTEGER NOT NULL)')
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self.write_errors = 0
+
+    def _write(self, *statements):
+        """Queues (sql, params) statements to run in one transaction on the writer thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='registry-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop) # Flushes queued writes (e.g. unregister_node) on shutdown
+        self._queue.put(statements)
+
+    def _run(self):
+        db = sqlite3.connect(self.path, timeout=CLUSTER_REGISTRY_WRITE_TIMEOUT, isolation_level=None)
+        while True:
+            statements = self._queue.get()
+            if statements is None:
+                db.close()
+                return
+            try:
+                with db: # One transaction
+                    db.execute('BEGIN IMMEDIATE')
+                    for sql, params in statements:
+                        db.execute(sql, params)
+            except sqlite3.Error as e:
+                self.write_errors += 1
+                log_main.error(f"Cluster registry write failed ({statements[0][0]}): {e}")
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=CLUSTER_REGISTRY_WRITE_TIMEOUT + 1.0)
+            self._thread = None
+
+    def _read(self, sql, params=()):
+        try:
+            return self._db.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            log_sampled(log_net, logging.WARNING, 'registry.read', "Cluster registry read failed: %s", e)
+            return []
+
+    def register_node(self, shard, url):
+        self._write(('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)', (shard, url, time.time())))
+
+    def heartbeat(self, shard):
+        self._write(('UPDATE nodes SET last_seen = ? WHERE shard = ?', (time.time(), shard)))
+
+    def unregister_node(self, shard):
+        self._write(('DELETE FROM nodes WHERE shard = ?', (shard,)), ('DELETE FROM games WHERE shard = ?', (shard,)))
+
+    def node_url(self, shard):
+        rows = self._read('SELECT url FROM nodes WHERE shard = ? AND last_seen >= ?', (shard, time.time() - CLUSTER_NODE_TTL))
+        return rows[0][0] if rows else None
+
+    def register_game(self, game_id, shard, max_players):
+        self._write(('INSERT OR REPLACE INTO games VALUES (?, ?, ?)', (game_id, shard, max_players)))
+
+    def unregister_game(self, game_id):
+        self._write(('DELETE FROM games WHERE game_id = ?', (game_id,)))
+
+    def locate_game(self, game_id):
+        rows = self._read('SELECT shard FROM games WHERE game_id = ?', (game_id,))
+        return rows[0][0] if rows else None
+
+    def stats(self):
+        now = time.time()
+        games = self._read('SELECT COUNT(*) FROM games')
+        nodes = self._read('SELECT shard, url, last_seen FROM nodes')
+        return {'backend': f'sqlite:{self.path}', 'games': games[0][0] if games else None,
+                'pending_writes': self._queue.qsize(), 'write_errors': self.write_errors,
+                'nodes': {shard: {'url': url, 'age': round(now - seen, 1)} for shard, url, seen in nodes}}
+
+def create_game_registry(spec=CLUSTER_REGISTRY):
+    """Builds the registry named by CLUSTER_REGISTRY, or None for a standalone node."""
+    if not spec:
+        return None
+    if spec == 'local':
+        return InProcessGameRegistry()
+    if spec.startswith('sqlite:'):
+        return SqliteGameRegistry(spec[len('sqlite:'):])
+    raise ValueError(f"Unknown CLUSTER_REGISTRY '{spec}' (expected 'local' or 'sqlite:PATH')")
+
+def resolve_node_shard(shard=NODE_SHARD):
+    shard = shard.strip().upper()
+    if len(shard) == CLUSTER_SHARD_LENGTH and shard.isalnum():
+        return shard
+    generated = secrets.token_hex(CLUSTER_SHARD_LENGTH)[:CLUSTER_SHARD_LENGTH].upper()
+    if shard:
+        log_net.warning(f"NODE_SHARD '{shard}' must be {CLUSTER_SHARD_LENGTH} letters/digits. Using '{generated}'.")
+    return generated
+
 # --- Network Server ---
 class KellyGangGameServer:
     def __init__(self):
         self.games = {}
-        self.clients = {}
-        self.player_to_game = {}
-        self.high_scores = load_high_scores()
+        self.connections = ConnectionRegistry()
+        self.spectators = SpectatorHub(self.connections)
+        self.metrics = ServerMetrics()
+        self.game_pool = GamePool()
+        self.matchmaking = MatchmakingService()
+        self.sessions = SessionStore()
+        self.leaderboard = Leaderboard(load_high_scores())
+        self._high_scores_http_cache = {} # (players, period, bucket, offset, limit) -> (board_version, body, etag)
+        self.registry = create_game_registry() # None unless CLUSTER_REGISTRY is set
+        self.draining = None # 'wait' or 'handoff' once a drain has started
+        self.shard = resolve_node_shard() if self.registry else ''
         log_net.info("Network Server initialized")
 
+    def new_game_id(self, kind):
+        """'MP_ABCDE' standalone; in cluster mode the node's shard leads the code ('MP_K3ABCDE') so any node can route it."""
+        return f"{kind}_{self.shard}{generate_id()[:GAME_CODE_LENGTH].upper()}"
+
+    def _add_game(self, game):
+        self.games[game.game_id] = game
+        if self.registry:
+            self.registry.register_game(game.game_id, self.shard, game.max_players)
+
+    def owner_url(self, game_id):
+        """ws URL of the node that owns a game this node doesn't have, or None. The shard in the ID decides;
+        the registry's game table only covers IDs without a readable shard."""
+        if not self.registry:
+            return None
+        shard = shard_of(game_id)
+        if shard is None:
+            shard = self.registry.locate_game(game_id)
+        if shard is None or shard == self.shard:
+            return None
+        return self.registry.node_url(shard)
+
+    async def redirect_to_owner(self, ws, game_id, association):
+        """Points the client at the node that owns game_id. Returns False if no live node owns it."""
+        url = self.owner_url(game_id)
+        if not url:
+            return False
+        log_net.info(f"Redirecting '{association['type']}' for {game_id} to {url}.")
+        await self._send_direct(ws, {'type': 'redirect', 'game_id': game_id, 'url': url, 'retry': association})
+        return True # Socket stays open; the client closes it and reconnects to the owner
+
 
     async def _send_string_to_player(self, target_identifier, message_string):
         """Sends a string message to a target (player_id string or ws object)."""
-        ws = None
-        player_id = None
-        lookup_method = "N/A"
-
+        # Runs for every player on every tick: no eager string formatting on the success path.
         if isinstance(target_identifier, str): # Target is a player_id string
             player_id = target_identifier
-            lookup_method = f"Dict Lookup (PID: {player_id[:6]})"
-            ws = self.clients.get(player_id) # <<<< PRIMARY LOOKUP METHOD
-            if ws is None:
-                log_net.warning(f"Send failed for {lookup_method}: WebSocket not found in self.clients.")
+            info = self.connections.info_for_player(player_id) # <<<< PRIMARY LOOKUP METHOD
+            if info is None:
+                log_sampled(log_net, logging.WARNING, 'send.no_conn', "Send failed for PID %s: No connection registered for player.", player_id[:6])
                 return False
+            ws = info.ws
         elif isinstance(target_identifier, web.WebSocketResponse): # Target is a ws object directly
             ws = target_identifier
-            # Find player_id for logging ONLY - DO NOT use for lookup here
-            found_pid = next((pid for pid, client_ws in self.clients.items() if client_ws == ws), None)
-            player_id = found_pid # Store if found, remains None otherwise
-            lookup_method = f"Direct WS (Associated PID: {player_id[:6] if player_id else 'None'})"
-            # We already have the ws object, no need for further lookup based on PID here
+            # Reverse index gives the player_id for logging without scanning all clients
+            info = self.connections.info_for_ws(ws)
+            player_id = info.player_id if info else None
         else:
-            log_net.error(f"Send failed: Invalid target_identifier type: {type(target_identifier)}")
+            log_net.error("Send failed: Invalid target_identifier type: %s", type(target_identifier))
             return False
 
-        # --- At this point, 'ws' should be the correct WebSocketResponse object ---
-        # --- OR it's None because the PID lookup failed initially             ---
-
         if not ws:
              # This should only be reachable if the initial PID lookup failed
-             log_net.warning(f"Send failed ({lookup_method}): WebSocket object is None.")
+             log_net.warning("Send failed (PID %s): WebSocket object is None.", player_id[:6] if player_id else None)
              return False
 
         # --- Check WebSocket state and send ---
-        log_net.debug(f"Send Check ({lookup_method}): WS Closed? {ws.closed}") # Add detailed check
         if not ws.closed:
             try:
-                log_net.debug(f"Attempting send_str via {lookup_method}")
+                log_sampled(log_net, logging.DEBUG, 'send.ok', "send_str to PID %s (%d chars)", player_id[:6] if player_id else None, len(message_string))
                 await ws.send_str(message_string)
-                # log_net.debug(f"Send successful via {lookup_method}.")
+                if info is not None:
+                    self.connections.record_send(info, len(message_string)) # json.dumps output is ASCII, so chars == bytes
                 return True
             except ConnectionResetError:
-                log_net.warning(f"Send failed ({lookup_method}): ConnectionResetError.")
+                log_net.warning("Send failed (PID %s): ConnectionResetError.", player_id[:6] if player_id else None)
                 if player_id: # Only handle disconnect if we know the player_id
-                    asyncio.create_task(self.handle_disconnect(player_id))
+                    asyncio.create_task(self.handle_disconnect(player_id, ws))
                 return False
             except Exception as e:
-                log_net.error(f"Send failed ({lookup_method}): Exception during send: {e}", exc_info=False)
+                log_sampled(log_net, logging.ERROR, 'send.exc', "Send failed (PID %s): Exception during send: %s", player_id[:6] if player_id else None, e)
                 return False
         else:
-            log_net.warning(f"Send failed ({lookup_method}): WebSocket was already closed.")
+            log_sampled(log_net, logging.WARNING, 'send.closed', "Send failed (PID %s): WebSocket was already closed.", player_id[:6] if player_id else None)
             if player_id: # Ensure cleanup if we know the player_id
-                self.clients.pop(player_id, None)
-                self.player_to_game.pop(player_id, None)
+                self.connections.detach_player(player_id)
             return False
 
     async def _send_dict_to_player(self, target_identifier, message_data):
         """Serializes dict and sends using _send_string_to_player."""
-        player_id_for_log = 'UnknownTarget'
-        if isinstance(target_identifier, str):
-            player_id_for_log = target_identifier[:6]
-        elif isinstance(target_identifier, web.WebSocketResponse):
-             found_pid = next((pid for pid, client_ws in self.clients.items() if client_ws == target_identifier), None)
-             player_id_for_log = found_pid[:6] if found_pid else 'WS_Obj'
-        else:
-             player_id_for_log = 'InvalidTarget'
-
         try:
             message_string = json.dumps(message_data)
-            # Pass the original target (string or ws object)
-            return await self._send_string_to_player(target_identifier, message_string)
         except Exception as e:
-            log_net.error(f"Serialization failed for {player_id_for_log} before send: {e}")
+            if isinstance(target_identifier, str):
+                player_id_for_log = target_identifier[:6]
+            elif isinstance(target_identifier, web.WebSocketResponse):
+                found_pid = self.connections.player_for_ws(target_identifier)
+                player_id_for_log = found_pid[:6] if found_pid else 'WS_Obj'
+            else:
+                player_id_for_log = 'InvalidTarget'
+            log_net.error("Serialization failed for %s before send: %s", player_id_for_log, e)
             return False
+        # Pass the original target (string or ws object)
+        return await self._send_string_to_player(target_identifier, message_string)
+
+    async def _send_association_response(self, ws, payload):
+        """Sends game_created/game_joined/sp_game_started/session_resumed with the player's resume token;
+        in fast handshake mode this doubles as the hello."""
+        if HANDSHAKE_MODE != 'legacy':
+            payload['server_hello'] = server_hello()
+        payload['resume_token'] = self.sessions.issue(payload['player_id'], payload['game_id'])
+        await self._send_direct(ws, payload)
+
+    async def _send_direct(self, ws, message_data):
+        """Sends straight on a ws (raises on failure, unlike the helpers above) and counts it against the connection."""
+        message_string = json.dumps(message_data)
+        await ws.send_str(message_string)
+        self.connections.record_send(self.connections.register(ws), len(message_string))
 
     async def on_game_finished_internal_callback(self, finished_game_object):
-        """Callback function passed to Game instances when they finish."""
+        """Callback function passed to Game instances when they finish. Checks scores, then releases the game."""
         game_id = finished_game_object.game_id
         log_net.info(f"Internal Callback: Game {game_id} reported finished. Checking scores...")
 
-        final_state = finished_game_object.get_state()
-        if not final_state or 'players' not in final_state:
-            log_net.warning(f"Game {game_id} finished but final state or players dict is missing.")
+        try:
+            final_state = finished_game_object.get_state()
+            if not final_state or 'players' not in final_state:
+                log_net.warning(f"Game {game_id} finished but final state or players dict is missing.")
+                return
+
+            players_data = final_state.get('players', {})
+            game_max_players = finished_game_object.max_players # Get max players for this game
+
+            log_net.debug(f"Checking scores for {len(players_data)} players in finished game {game_id}.")
+
+            # Check each player's score
+            for player_id, player_data in list(players_data.items()):
+                score = player_data.get('score', 0)
+                log_net.debug(f" -> Checking P:{player_id[:6]}, Score: {score}") # Log shortened ID
+                # Call the helper function to check qualification and potentially send request
+                await self.check_and_request_highscore(player_id, score, game_max_players)
+        finally:
+            # Event-driven teardown: don't leave the finished game's entities alive until the next sweep
+            await self.release_game(finished_game_object)
+
+    async def release_game(self, game):
+        """Tears down a finished game as soon as its loop has sent the final state."""
+        game_id = game.game_id
+        loop_task = game.loop_task
+        if loop_task and not loop_task.done() and loop_task is not asyncio.current_task():
+            done, _ = await asyncio.wait({loop_task}, timeout=GAME_RELEASE_LOOP_TIMEOUT)
+            if not done:
+                log_net.warning(f"Game {game_id} loop still running {GAME_RELEASE_LOOP_TIMEOUT}s after finish. Cancelling.")
+                loop_task.cancel()
+            if game.in_pool or game.game_id != game_id:
+                return # The sweep released (and the pool possibly reused) it while we waited
+        self._drop_game(game)
+
+    def _drop_game(self, game):
+        """Unregisters a game and frees its entity state. Safe to call more than once."""
+        game_id = game.game_id
+        if self.games.get(game_id) is game:
+            del self.games[game_id]
+            if self.registry:
+                self.registry.unregister_game(game_id)
+        self.matchmaking.remove(game_id)
+        # Unmap any players still associated with this game ID (per-game member set, no scan).
+        # Their connections stay registered - they're probably on the game over screen.
+        members = self.connections.release_game(game_id)
+        self.spectators.release_game(game_id)
+        for player_id in list(game.players):
+            self.sessions.revoke(player_id) # Nothing left to resume into
+        if not self.game_pool.release(game):
+            game.release_entities()
+        log_net.debug(f"Released game {game_id} ({len(members)} player mappings dropped). Active games: {len(self.games)}")
+
+    # --- Drain / Hand-off ---
+    async def drain(self, mode=DRAIN_MODE, deadline=DRAIN_DEADLINE, stop_listening=None):
+        """
+        Stops taking new games (and reports not-ready on /health), then either waits for running
+        games to finish, up to the deadline, or hands them off to a successor process. Returns
+        when there is nothing left worth waiting for; the caller then shuts down as usual.
+        """
+        self.draining = mode
+        running = [g for g in self.games.values() if g.status in ('active', 'countdown')]
+        log_net.warning(f"Draining ({mode}): {len(running)} running games, {len(self.games)} total.")
+        if mode == 'handoff':
+            if stop_listening is not None:
+                await stop_listening() # New connections, resumes included, now reach the successor
+            await self.hand_off_games()
             return
-
-        players_data = final_state.get('players', {})
-        game_max_players = finished_game_object.max_players # Get max players for this game
-
-        log_net.debug(f"Checking scores for {len(players_data)} players in finished game {game_id}.")
-
-        # Check each player's score
-        for player_id, player_data in players_data.items():
-            score = player_data.get('score', 0)
-            log_net.debug(f" -> Checking P:{player_id[:6]}, Score: {score}") # Log shortened ID
-            # Call the helper function to check qualification and potentially send request
-            await self.check_and_request_highscore(player_id, score, game_max_players)
+        give_up_at = time.monotonic() + deadline
+        while time.monotonic() < give_up_at:
+            running = sum(1 for g in self.games.values() if g.status in ('active', 'countdown'))
+            if not running:
+                break
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        else:
+            log_net.warning(f"Drain deadline ({deadline:.0f}s) passed with games still running.")
+
+    async def hand_off_games(self, directory=HANDOFF_DIR):
+        """Checkpoints every unfinished game into `directory` for adopt_handoffs() in the successor,
+        then disconnects its players with HANDOFF_CLOSE_CODE so their clients resume over there."""
+        os.makedirs(directory, exist_ok=True)
+        handed_off = []
+        for game in list(self.games.values()):
+            if game.status == 'finished':
+                continue
+            game.handed_off = True
+            if game.loop_task and not game.loop_task.done():
+                game.loop_task.cancel()
+                await asyncio.gather(game.loop_task, return_exceptions=True)
+            record = {'game_id': game.game_id, 'max_players': game.max_players,
+                      'public': self.matchmaking.is_public(game.game_id),
+                      'sessions': {player_id: self.sessions.token_for(player_id) for player_id in game.players},
+                      'checkpoint': base64.b64encode(game.checkpoint()).decode('ascii')}
+            path = os.path.join(directory, f"{game.game_id}.handoff")
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            os.replace(path + '.tmp', path) # The successor never sees a half-written file
+            # Forget it here without finishing it: no game over, no high scores, no session revokes
+            del self.games[game.game_id]
+            self.matchmaking.remove(game.game_id)
+            self.spectators.release_game(game.game_id)
+            handed_off.extend(self.connections.release_game(game.game_id))
+            log_net.info(f"Handed off game {game.game_id} at tick {game.tick} ({len(game.players)} players).")
+        await asyncio.gather(*(self.close_client_connection(player_id, HANDOFF_CLOSE_CODE, "Server restarting")
+                               for player_id in handed_off), return_exceptions=True)
+        log_net.warning(f"Hand-off complete: {len(handed_off)} players told to resume on the successor.")
+
+    def adopt_handoffs(self, directory=HANDOFF_DIR):
+        """Successor side: restores games a draining predecessor left in `directory`, restarts their loops
+        and holds their players' sessions for resume. Returns how many games were adopted."""
+        if self.draining:
+            return 0 # Our own hand-off files, mid-drain: they are for the successor
+        adopted = 0
+        for path in glob.glob(os.path.join(directory, '*.handoff')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    record = json.load(f)
+                os.remove(path)
+            except (OSError, ValueError) as e:
+                log_net.error(f"Could not read hand-off file {path}: {e}")
+                continue
+            game_id = record['game_id']
+            if game_id in self.games:
+                log_net.warning(f"Hand-off of {game_id} ignored: a game with that ID is already running here.")
+                continue
+            game = self.game_pool.acquire(game_id, None, self.broadcast_state_callback,
+                                          self.on_game_finished_internal_callback, record['max_players'])
+            try:
+                game.restore(base64.b64decode(record['checkpoint']))
+            except (ValueError, KeyError) as e:
+                log_net.error(f"Hand-off of {game_id} failed to restore: {e}")
+                continue
+            self._add_game(game)
+            for player_id, token in record['sessions'].items():
+                if not token or player_id not in game.players:
+                    continue
+                self.sessions.adopt(token, player_id, game_id)
+                self.sessions.hold(player_id, lambda p=player_id, g=game_id: asyncio.create_task(self._expire_held_player(p, g)))
+                game.set_player_input(player_id, {'dx': 0, 'dy': 0}) # Same as any dropped player until they resume
+                game.release_trigger(player_id)
+            if record.get('public'):
+                self.matchmaking.add_public(game)
+            game.loop_task = asyncio.create_task(game.run_game_loop())
+            adopted += 1
+            log_net.info(f"Adopted handed-off game {game_id} at tick {game.tick} ({len(game.players)} players held for resume).")
+        return adopted
 
     async def check_and_request_highscore(self, player_id, score, game_max_players):
         """Checks if a score qualifies for high scores and requests name if it does."""
@@ -1481,28 +3423,15 @@ class KellyGangGameServer:
             # log_net.debug(f"Score {score} for player {player_id[:6]} is invalid or zero, skipping highscore check.")
             return # Ignore zero or invalid scores
 
-        # Ensure high scores are sorted before checking
-        self.high_scores.sort(key=operator.itemgetter('score'), reverse=True)
-
-        qualifies = False
-        if len(self.high_scores) < MAX_HIGHSCORES:
-            qualifies = True # List isn't full yet
-            log_net.info(f"Score {score} for player {player_id[:6]} qualifies (list < {MAX_HIGHSCORES}).")
-        else:
-            lowest_highscore = self.high_scores[-1]['score']
-            if score > lowest_highscore:
-                qualifies = True
-                log_net.info(f"Score {score} for player {player_id[:6]} qualifies (beats lowest: {lowest_highscore}).")
-            # else:
-                # log_net.debug(f"Score {score} for player {player_id[:6]} does not qualify (lowest: {lowest_highscore}).")
-
-        if qualifies:
+        if self.leaderboard.qualifies(score, game_max_players):
+            log_net.info(f"Score {score} for player {player_id[:6]} qualifies for the {game_max_players}-player leaderboard.")
             # Send request to the specific player
             log_net.info(f"Sending highscore name request to player {player_id[:6]} for score {score} (MaxP: {game_max_players}).")
             payload = {
                 'type': 'request_highscore_name',
                 'score': score,
-                'max_players': game_max_players # Send game size with the request
+                'max_players': game_max_players, # Send game size with the request
+                'rank': self.leaderboard.rank_of(score, game_max_players) # All-time rank within this party size
             }
             # Use _send_dict_to_player which handles checking if client exists/is open
             success = await self._send_dict_to_player(player_id, payload)
@@ -1511,10 +3440,11 @@ class KellyGangGameServer:
 
 
     async def broadcast_state_callback(self, game_id, message_data):
-        game = self.games.get(game_id)
-        if not game: return
-        # Get current players directly from the game instance for broadcasting
-        current_player_ids = list(game.players.keys())
+        if game_id not in self.games: return
+        if self.spectators.watching(game_id):
+            self.spectators.publish(game_id, message_data) # Queues only; spectator sockets drain on their own tasks
+        # Connected members only: players held for resume have no socket to send to
+        current_player_ids = list(self.connections.players_in_game(game_id))
         if not current_player_ids: return
 
         message_str = None
@@ -1528,19 +3458,31 @@ class KellyGangGameServer:
         tasks = [self._send_string_to_player(p_id, message_str) for p_id in current_player_ids]
         if tasks:
             results = await asyncio.gather(*tasks, return_exceptions=True)
+            if self.connections.awaiting_first_state() and message_data.get('type') == 'game_state':
+                self._record_first_states(current_player_ids, results)
             failed_count = sum(1 for r in results if r is False or isinstance(r, Exception))
             if failed_count > 0:
-                 log_net.debug(f"Broadcast for {game_id}: {failed_count}/{len(tasks)} sends failed (possible disconnects).")
+                 log_sampled(log_net, logging.DEBUG, 'broadcast.failed', "Broadcast for %s: %d/%d sends failed (possible disconnects).", game_id, failed_count, len(tasks))
 
 
+    def _record_first_states(self, player_ids, results):
+        now = time.monotonic()
+        for p_id, result in zip(player_ids, results):
+            if result is not True: continue
+            info = self.connections.first_state_sent(p_id)
+            if info is not None:
+                latency = now - info.connected_at
+                self.metrics.record_first_state(latency)
+                log_net.debug("[%s] Connect -> first game_state: %.1f ms (handshake: %s)", p_id[:6], latency * 1000, HANDSHAKE_MODE)
+
     async def close_client_connection(self, player_id, code=1000, reason="Server request"):
-        ws = self.clients.pop(player_id, None) # Remove from clients dict first
+        ws = self.connections.ws_for_player(player_id)
         if ws and not ws.closed:
             try:
                 log_net.info(f"Closing WS for {player_id}. Code: {code}, Reason: {reason}")
                 await ws.close(code=code, message=reason.encode('utf-8'))
             except Exception as e: log_net.error(f"Error closing WS for {player_id}: {e}")
-        # Player association is removed in handle_disconnect
+        # Player association is removed in handle_disconnect (runs when the handler sees the close)
 
     async def create_single_player_game(self, ws):
         """
@@ -1548,7 +3490,7 @@ class KellyGangGameServer:
         sends confirmation, and only starts the game loop if confirmation succeeds.
         """
         player_id = generate_id()
-        game_id = f"SP_{generate_id()[:5].upper()}"
+        game_id = self.new_game_id('SP')
         log_net.info(f"Attempting SP Create: GID={game_id}, PID={player_id}")
 
         game = None
@@ -1557,7 +3499,7 @@ class KellyGangGameServer:
 
         try:
             # 1. Create Game Instance and Add Player
-            game = Game(
+            game = self.game_pool.acquire(
                 game_id=game_id,
                 host_id=player_id,
                 broadcast_state_callback=self.broadcast_state_callback,
@@ -1569,21 +3511,12 @@ class KellyGangGameServer:
                 raise RuntimeError("Unexpected error: Failed to add player to new SP game.")
 
             # 2. Immediately Set Game to Active (SP specific)
-            game.status = 'active'
-            game.level = 1
-            player = game.players[player_id]
-            player.update({
-                'health': player.get('max_health', PLAYER_DEFAULTS['max_health']),
-                'kills': 0, 'score': 0, 'gun': 1, 'armor': 0,
-                'speed': player.get('base_speed', PLAYER_DEFAULTS['base_speed']),
-                'effects': {}, 'input_vector': {'dx': 0, 'dy': 0}, 'cooldowns': {}
-            })
+            game.start_single_player(player_id)
             log_game.info(f"[{game.game_id}] SP Game instance immediately set to active.")
 
             # 3. Register Game and Client Associations *Before* Sending Confirmation
-            self.games[game_id] = game
-            self.clients[player_id] = ws
-            self.player_to_game[player_id] = game_id
+            self._add_game(game)
+            self.connections.associate(ws, player_id, game_id)
             registration_done = True
             log_net.debug(f"SP Game {game_id} registered internally for {player_id}.")
 
@@ -1596,7 +3529,7 @@ class KellyGangGameServer:
             }
             try:
                 # --- NEW CODE: Send directly ---
-                await ws.send_str(json.dumps(payload))
+                await self._send_association_response(ws, payload)
                 confirmation_sent_successfully = True
                 # --- END NEW CODE ---
             except Exception as send_err:
@@ -1616,7 +3549,7 @@ class KellyGangGameServer:
                 log_net.warning(f"FAILED to send sp_game_started confirmation to {player_id}. Aborting loop start and cleaning up registration.")
                 # The failed send likely triggered handle_disconnect already, but clean up game object explicitly.
                 self.games.pop(game_id, None)
-                # player_to_game and clients should have been cleaned by handle_disconnect
+                # Connection associations should have been cleaned by handle_disconnect
                 return None # Indicate failure to the websocket handler
 
         except Exception as e:
@@ -1632,8 +3565,7 @@ class KellyGangGameServer:
             # Clean up server-side associations if registration occurred
             if registration_done:
                 self.games.pop(game_id, None)
-                self.clients.pop(player_id, None)
-                self.player_to_game.pop(player_id, None)
+                self.connections.detach_player(player_id)
 
             # Attempt to close the WebSocket connection if it's still open
             if ws and not ws.closed:
@@ -1646,13 +3578,14 @@ class KellyGangGameServer:
 
 #--------------------------------------------------------------------------
 
-    async def create_game(self, ws, requested_max_players):
+    async def create_game(self, ws, requested_max_players, public=False):
         """
         Creates a multiplayer game instance, validates max players, registers host,
         sends confirmation, and only starts the game loop if confirmation succeeds.
+        Public games are listed for quick_join.
         """
         player_id = generate_id()
-        game_id = f"MP_{generate_id()[:5].upper()}"
+        game_id = self.new_game_id('MP')
         log_net.info(f"Attempting MP Create: GID={game_id}, PID={player_id}, Requested MaxP={requested_max_players}")
 
         # 1. Validate requested_max_players
@@ -1696,9 +3629,8 @@ class KellyGangGameServer:
                 raise RuntimeError(f"Unexpected error: Failed to add host player {player_id} to new MP game {game_id}.")
 
             # 3. Register Game and Client Associations *Before* Sending Confirmation
-            self.games[game_id] = game
-            self.clients[player_id] = ws
-            self.player_to_game[player_id] = game_id
+            self._add_game(game)
+            self.connections.associate(ws, player_id, game_id)
             registration_done = True
             log_net.debug(f"MP Game {game_id} registered internally for host {player_id}.")
 
@@ -1712,7 +3644,7 @@ class KellyGangGameServer:
             }
             try:
                 # --- NEW CODE: Send directly ---
-                await ws.send_str(json.dumps(payload))
+                await self._send_association_response(ws, payload)
                 confirmation_sent_successfully = True
                 # --- END NEW CODE ---
             except Exception as send_err:
@@ -1725,6 +3657,8 @@ class KellyGangGameServer:
                 # MP game starts in 'waiting', loop runs to handle state changes/joins
                 game.loop_task = asyncio.create_task(game.run_game_loop())
                 log_net.info(f"MP Game {game_id} loop task created for host {player_id}.")
+                if public:
+                    self.matchmaking.add_public(game)
                 # Return success info
                 return {'game_id': game_id, 'player_id': player_id}
             else:
@@ -1732,7 +3666,7 @@ class KellyGangGameServer:
                 log_net.warning(f"FAILED to send game_created confirmation to {player_id}. Aborting loop start and cleaning up registration.")
                 # Cleanup handled similarly to SP game failure
                 self.games.pop(game_id, None)
-                # handle_disconnect should clean clients/player_to_game map
+                # handle_disconnect should clean the connection associations
                 return None # Indicate failure
 
         except Exception as e:
@@ -1745,8 +3679,7 @@ class KellyGangGameServer:
 
             if registration_done:
                 self.games.pop(game_id, None)
-                self.clients.pop(player_id, None)
-                self.player_to_game.pop(player_id, None)
+                self.connections.detach_player(player_id)
 
             if ws and not ws.closed:
                 try:
@@ -1760,6 +3693,8 @@ class KellyGangGameServer:
         player_id = generate_id(); game_id = game_id_to_join.strip().upper()
         log_net.info(f"Attempting Join: GID={game_id}, PID={player_id}")
         game = self.games.get(game_id); error_msg = None
+        if not game and await self.redirect_to_owner(ws, game_id, {'type': 'join_game', 'game_id': game_id}):
+            return None
 
         # --- Pre-join Checks ---
         if not game: error_msg = 'Game not found.'
@@ -1786,7 +3721,7 @@ class KellyGangGameServer:
             # --- Send Confirmation to Joining Player ---
             payload = {'type': 'game_joined', 'game_id': game_id, 'player_id': player_id, 'initial_state': game.get_state()}
             try:
-                await ws.send_str(json.dumps(payload))
+                await self._send_association_response(ws, payload)
                 log_net.info(f"Sent game_joined confirmation to {player_id}")
             except Exception as send_err:
                 # If confirmation fails, remove the player that was just added
@@ -1795,7 +3730,8 @@ class KellyGangGameServer:
                 raise ConnectionError(f"Failed to send game_joined to {player_id}: {send_err}") from send_err
 
             # --- Finalize Registration ---
-            self.clients[player_id] = ws; self.player_to_game[player_id] = game_id
+            self.connections.associate(ws, player_id, game_id)
+            self.matchmaking.update(game)
             log_net.info(f"Player {player_id} joined game {game_id} successfully.")
 
             # --- Inform Others & Trigger Countdown (logic moved to game.add_player) ---
@@ -1809,8 +3745,7 @@ class KellyGangGameServer:
             # Clean up potential partial registration
             if game and player_id in game.players:
                  game.remove_player(player_id)
-            if player_id in self.clients: del self.clients[player_id]
-            if player_id in self.player_to_game: del self.player_to_game[player_id]
+            self.connections.detach_player(player_id)
 
             # Close connection if join failed critically
             if not ws.closed:
@@ -1818,22 +3753,55 @@ class KellyGangGameServer:
                  except Exception: pass
             return None
 
+    async def quick_join(self, ws, requested_max_players=None):
+        """Puts the player in the fullest open public lobby, or hosts a new public one if none is open."""
+        max_players = None
+        if requested_max_players is not None:
+            try:
+                max_players = int(requested_max_players)
+            except (ValueError, TypeError):
+                max_players = None
+            if max_players is not None and not 2 <= max_players <= MAX_PLAYERS:
+                max_players = None
+        game = self.matchmaking.find(self.games, max_players)
+        if game is not None:
+            log_net.info(f"Quick join: placing player in open lobby {game.game_id} ({len(game.players)}/{game.max_players}).")
+            return await self.join_game(ws, game.game_id)
+        log_net.info(f"Quick join: no open lobby for max_players={max_players}. Hosting a new one.")
+        return await self.create_game(ws, max_players or QUICK_JOIN_DEFAULT_MAX_PLAYERS, public=True)
+
+    async def spectate_game(self, ws, game_id_to_watch):
+        """Attaches a read-only viewer to any running game. Viewers are not players: no slot, no countdown."""
+        game_id = str(game_id_to_watch).strip().upper()
+        game = self.games.get(game_id); error_msg = None
+        if not game and await self.redirect_to_owner(ws, game_id, {'type': 'spectate', 'game_id': game_id}):
+            return None
+        if not game: error_msg = 'Game not found.'
+        elif game.status == 'finished': error_msg = 'Game has already finished.'
+        elif self.spectators.count(game_id) >= MAX_SPECTATORS_PER_GAME: error_msg = 'Too many spectators.'
+
+        if error_msg:
+            log_net.warning(f"Spectate Rejected for {game_id}: {error_msg}")
+            try: await ws.send_str(json.dumps({'type': 'error', 'message': error_msg}))
+            except Exception: pass
+            return None # Socket stays open so the client can pick something else
+
+        payload = {'type': 'spectate_started', 'game_id': game_id, 'max_players': game.max_players,
+                   'spectators': self.spectators.count(game_id) + 1,
+                   'initial_state': {**(game.last_snapshot or game.get_state()), 'events': game.bullet_spawn_events()}}
+        if HANDSHAKE_MODE != 'legacy':
+            payload['server_hello'] = server_hello()
+        # Queued, not awaited: no tick can be broadcast between the catch-up state and the viewer's registration
+        self.spectators.add(ws, game_id, first_frame=json.dumps(payload))
+        log_net.info(f"Spectator attached to game {game_id} ({self.spectators.count(game_id)} watching).")
+        return {'game_id': game_id, 'player_id': None, 'spectator': True}
+
     def add_highscore_entry(self, name, score, max_players):
-        """Adds a new highscore entry, sorts, trims, and saves."""
+        """Adds a new highscore entry to its party-size leaderboards and saves."""
         log_net.info(f"Attempting to add highscore: Name={name}, Score={score}, MaxP={max_players}")
 
         # Re-validate score qualification (defense against client manipulation)
-        # Ensure list is sorted before checking qualification again
-        self.high_scores.sort(key=operator.itemgetter('score'), reverse=True)
-
-        qualifies = False
-        if len(self.high_scores) < MAX_HIGHSCORES:
-             qualifies = True
-        # Check only if list is full
-        elif len(self.high_scores) >= MAX_HIGHSCORES and score > self.high_scores[-1]['score']:
-             qualifies = True
-
-        if not qualifies:
+        if not self.leaderboard.qualifies(score, max_players):
              log_net.warning(f"Highscore submission rejected for {name}/{score}: Score no longer qualifies.")
              return # Score doesn't qualify anymore (maybe list updated?)
 
@@ -1850,34 +3818,110 @@ class KellyGangGameServer:
             'timestamp': time.time()
         }
 
-        # Add the new entry
-        self.high_scores.append(new_entry)
-        log_net.info(f"Added highscore entry: {new_entry}")
+        # Add the new entry to every partition it qualifies for
+        ranks = self.leaderboard.add(new_entry)
+        log_net.info(f"Added highscore entry: {new_entry} (Ranks: {ranks})")
+
+        save_high_scores(self.leaderboard.all_entries())
 
-        # Save the updated list (save function handles sorting/trimming)
-        save_high_scores(self.high_scores)
+    def get_high_scores_page(self, players, period='all', offset=0, limit=HIGHSCORE_PAGE_SIZE):
+        """Builds a high_scores_list payload for one leaderboard slice."""
+        entries, total = self.leaderboard.page(players, period, offset, limit)
+        return {'type': 'high_scores_list', 'players': players, 'period': period,
+                'offset': offset, 'total': total, 'scores': entries}
 
-    async def handle_disconnect(self, player_id):
+    def render_high_scores_page(self, players, period='all', offset=0, limit=HIGHSCORE_PAGE_SIZE):
+        """
+        Returns (body_bytes, etag) for the HTTP leaderboard. Bodies are rendered once per board version
+        and bucket, so repeat reads cost a dict lookup and the ETag only changes when the slice does.
+        """
+        key = (players, period, leaderboard_bucket(period, time.time()), offset, limit)
+        cached = self._high_scores_http_cache.get(key)
+        if cached and cached[0] == self.leaderboard.version:
+            return cached[1], cached[2]
+        if len(self._high_scores_http_cache) > 256: # Bounded: query params come straight from clients
+            self._high_scores_http_cache.clear()
+        body = json.dumps(self.get_high_scores_page(players, period, offset, limit), separators=(',', ':')).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        self._high_scores_http_cache[key] = (self.leaderboard.version, body, etag)
+        return body, etag
+
+    async def handle_disconnect(self, player_id, ws=None, allow_resume=True):
+        current_ws = self.connections.ws_for_player(player_id)
+        if ws is not None and current_ws is not None and current_ws is not ws:
+            log_net.info(f"Ignoring disconnect of superseded socket for PID: {player_id} (session resumed elsewhere).")
+            return
         log_net.info(f"Handling disconnect for PID: {player_id}")
-        self.clients.pop(player_id, None) # Ensure client reference is removed
-        game_id = self.player_to_game.pop(player_id, None) # Remove player->game mapping
+        game_id = self.connections.detach_player(player_id) # Drops ws and player->game mappings in one go
 
         if game_id:
-            log_net.info(f"Player {player_id} was in game {game_id}. Notifying game instance.")
             game = self.games.get(game_id)
+            if (allow_resume and game and game.status != 'finished' and player_id in game.players
+                    and self.sessions.hold(player_id, lambda: asyncio.create_task(self._expire_held_player(player_id, game_id)))):
+                # Keep the slot (and the game's status) for a quick reconnect; just stop the player moving
+                game.set_player_input(player_id, {'dx': 0, 'dy': 0})
+                game.release_trigger(player_id)
+                log_net.info(f"Player {player_id} dropped from game {game_id}. Holding slot {self.sessions.grace_period:.0f}s for resume.")
+                return
+            log_net.info(f"Player {player_id} was in game {game_id}. Notifying game instance.")
+            self.sessions.revoke(player_id)
             if game:
                 game.remove_player(player_id) # Let the game instance handle player removal logic
                 # The game.remove_player method handles checking if the game should end or return to waiting.
+                self.matchmaking.update(game)
             else:
                 log_net.warning(f"Game {game_id} not found for disconnected player {player_id}, but mapping existed.")
         else:
+            self.sessions.revoke(player_id)
             log_net.debug(f"Disconnected player {player_id} was not associated with any active game.")
 
+    async def _expire_held_player(self, player_id, game_id):
+        """Grace window ran out without a resume: remove the player for real."""
+        if not self.sessions.is_held(player_id):
+            return # Resumed (or revoked) in the meantime
+        self.sessions.revoke(player_id)
+        game = self.games.get(game_id)
+        log_net.info(f"Resume window expired for {player_id} in game {game_id}. Removing player.")
+        if game and player_id in game.players:
+            game.remove_player(player_id)
+            self.matchmaking.update(game)
+
+    async def resume_session(self, ws, token):
+        """Re-attaches a player to their game after a dropped socket. Sends a catch-up snapshot, not a new game."""
+        session = self.sessions.claim(token)
+        if session is None and self.adopt_handoffs(): # A predecessor may have just handed this game over
+            session = self.sessions.claim(token)
+        game = self.games.get(session.game_id) if session else None
+        if not session or not game or game.status == 'finished' or session.player_id not in game.players:
+            log_net.warning("Resume rejected: token unknown, expired, or game no longer running.")
+            try: await ws.send_str(json.dumps({'type': 'resume_failed', 'message': 'Session expired.'}))
+            except Exception: pass
+            return None # Socket stays open so the client can start or join something else
+
+        player_id, game_id = session.player_id, session.game_id
+        old_ws = self.connections.ws_for_player(player_id)
+        self.connections.associate(ws, player_id, game_id)
+        if old_ws is not None and old_ws is not ws and not old_ws.closed:
+            # The server hadn't noticed the old socket was dead yet; its handler will see it's superseded
+            asyncio.create_task(old_ws.close(code=4000, message=b'Session resumed elsewhere'))
+
+        # Catch-up from the last broadcast snapshot instead of building a fresh one
+        payload = {'type': 'session_resumed', 'game_id': game_id, 'player_id': player_id,
+                   'max_players': game.max_players,
+                   'initial_state': {**(game.last_snapshot or game.get_state()), 'events': game.bullet_spawn_events()}}
+        try:
+            await self._send_association_response(ws, payload)
+        except Exception as send_err:
+            log_net.error(f"Send failed during session_resumed for {player_id}: {send_err}")
+            await self.handle_disconnect(player_id, ws) # Back into the grace window
+            return None
+        log_net.info(f"Player {player_id} resumed session in game {game_id}.")
+        return {'game_id': game_id, 'player_id': player_id}
 
     async def route_to_game(self, player_id, data):
-        game_id = self.player_to_game.get(player_id)
+        game_id = self.connections.game_for_player(player_id)
         if not game_id:
-            log_net.warning(f"Routing failed: No game found for player {player_id}. Data: {str(data)[:100]}")
+            log_sampled(log_net, logging.WARNING, 'route.no_game', "Routing failed: No game found for player %s. Data: %.100s", player_id, data)
             # Optionally send an error back to client if they send data without being in a game?
             # await self._send_dict_to_player(player_id, {'type':'error', 'message':'Not in a game.'})
             return
@@ -1885,7 +3929,7 @@ class KellyGangGameServer:
         game = self.games.get(game_id)
         if not game:
             log_net.warning(f"Routing failed: Game {game_id} not found for player {player_id}, but mapping exists. Cleaning up.")
-            self.player_to_game.pop(player_id, None) # Clean up stale mapping
+            self.connections.set_game(player_id, None) # Clean up stale mapping
             return
         if game.status == 'finished':
              # Don't route inputs to finished games, maybe allow chat?
@@ -1894,12 +3938,16 @@ class KellyGangGameServer:
              pass # Let chat route below if needed
 
         msg_type = data.get('type')
+        if msg_type == 'leave_game':
+            # Deliberate leave: the socket close that follows should free the slot, not hold it for resume
+            self.sessions.revoke(player_id)
+            return
         is_chat = msg_type == 'player_chat'
 
         # Only allow chat messages if game is not active (waiting, countdown, finished)
         # Allow all message types if game is active
         if game.status != 'active' and not is_chat:
-            log_net.debug(f"Input '{msg_type}' ignored from {player_id} in game {game_id} (Status: {game.status})")
+            log_sampled(log_net, logging.DEBUG, 'route.ignored', "Input '%s' ignored from %s in game %s (Status: %s)", msg_type, player_id, game_id, game.status)
             return
 
         # --- Start of the main message processing block ---
@@ -1910,15 +3958,24 @@ class KellyGangGameServer:
                  if game.status == 'active' and isinstance(data['direction'], dict):
                      game.set_player_input(player_id, data['direction'])
                  elif game.status == 'active':
-                      log_net.warning(f"Invalid move direction format from {player_id}: {data['direction']}")
+                      log_sampled(log_net, logging.WARNING, 'route.bad_move', "Invalid move direction format from %s: %s", player_id, data['direction'])
 
             # Handle Player Shooting
             elif msg_type == 'player_shoot' and 'target' in data:
                  # Only process shooting if game is active
                  if game.status == 'active' and isinstance(data['target'], dict):
-                     game.player_shoot(player_id, data['target']) # Pass the target dict
+                     game.player_shoot(player_id, data['target'], data.get('view_time')) # Pass the target dict
                  elif game.status == 'active':
-                     log_net.warning(f"Invalid shoot target format from {player_id}: {data['target']}")
+                     log_sampled(log_net, logging.WARNING, 'route.bad_shoot', "Invalid shoot target format from %s: %s", player_id, data['target'])
+
+            # Held trigger: the server fires at the ammo's cadence until trigger_up
+            elif msg_type in ('trigger_down', 'aim_update'):
+                 if game.status == 'active':
+                     handler = game.trigger_down if msg_type == 'trigger_down' else game.aim_update
+                     handler(player_id, data.get('target'), data.get('view_time'))
+
+            elif msg_type == 'trigger_up':
+                 game.release_trigger(player_id)
 
             # Handle Player Pushback Ability
             elif msg_type == 'player_pushback':
@@ -1950,107 +4007,194 @@ class KellyGangGameServer:
 
 # --- End of route_to_game method ---
 
-        msg_type = data.get('type')
-        is_chat = msg_type == 'player_chat'
-
-        # Only allow chat messages if game is not active (waiting, countdown, finished)
-        # Allow all message types if game is active
-        if game.status != 'active' and not is_chat:
-            log_net.debug(f"Input '{msg_type}' ignored from {player_id} in game {game_id} (Status: {game.status})")
-            return
-
-        try:
-            if msg_type == 'player_move' and 'direction' in data:
-                 # Only process movement if game is active
-                 if game.status == 'active' and isinstance(data['direction'], dict):
-                     game.set_player_input(player_id, data['direction'])
-                 elif game.status == 'active':
-                      log_net.warning(f"Invalid move direction format from {player_id}: {data['direction']}")
-
-            # <<< MODIFIED BLOCK FOR SHOOTING >>>
-            elif msg_type == 'player_shoot' and 'target' in data: # Check for 'target'
-                 # Only process shooting if game is active
-                 if game.status == 'active' and isinstance(data['target'], dict): # Check 'target' is a dict
-                     game.player_shoot(player_id, data['target']) # Pass the target dict
-                 elif game.status == 'active':
-                     log_net.warning(f"Invalid shoot target format from {player_id}: {data['target']}")
-            # <<< END OF MODIFIED BLOCK >>>
-
-        except Exception as e:
-            log_net.error(f"Error processing message type '{msg_type}' for player {player_id} in game {game_id}: {e}", exc_info=True)
-
     async def cleanup_finished_games(self):
-        # log_net.debug("--- Entering cleanup_finished_games ---") # Can be noisy
-        finished_ids = []
-        try:
-            # Iterate safely over a copy of the items
-            game_items = list(self.games.items())
-            finished_ids = [gid for gid, game in game_items if game.status == 'finished']
-            # log_net.debug(f"Found {len(finished_ids)} finished games: {finished_ids}") # Can be noisy
-        except Exception as e:
-             log_net.error(f"Error finding finished games: {e}", exc_info=True)
-             # log_net.debug("--- Exiting cleanup_finished_games (error finding games) ---") # Can be noisy
-             return
-
-        if not finished_ids:
-            # log_net.debug("No finished games to clean up.") # Can be noisy
-            # log_net.debug("--- Exiting cleanup_finished_games (no games) ---") # Can be noisy
+        """Safety-net sweep for finished games whose finish callback never released them."""
+        finished = [game for game in self.games.values() if game.status == 'finished']
+        if not finished:
             return
 
-        log_net.info(f"Running periodic cleanup. Cleaning finished games: {finished_ids}")
-        cleaned_count = 0
-        for gid in finished_ids:
-            # log_net.debug(f"Cleaning game ID: {gid}") # Can be noisy
-            game = None
+        log_net.warning(f"Periodic sweep found {len(finished)} finished games that were not released: {[g.game_id for g in finished]}")
+        for game in finished:
             try:
-                game = self.games.pop(gid, None)
-                if game:
-                    # log_net.debug(f"Popped game {gid} from games dict.") # Can be noisy
-                    # Ensure loop task is cancelled if it wasn't already
-                    if game.loop_task and not game.loop_task.done():
-                        log_net.warning(f"Game {gid} was finished but loop task was not done. Cancelling now in cleanup.")
-                        game.loop_task.cancel()
-                        # Optional: await cancellation? Usually not necessary here.
-
-                    # Find and remove any players still mapped to this game ID
-                    stale_pids = [pid for pid, mapped_gid in list(self.player_to_game.items()) if mapped_gid == gid]
-                    if stale_pids:
-                         # log_net.debug(f"Found {len(stale_pids)} stale player associations for game {gid}: {stale_pids}") # Can be noisy
-                         for pid in stale_pids:
-                             # log_net.debug(f"Removing stale player association: {pid} -> {gid}") # Can be noisy
-                             self.player_to_game.pop(pid, None)
-                             # Optionally close their connection if still present in clients? Risky if they reconnected.
-                             # self.clients.pop(pid, None) # Don't necessarily remove client ref, they might be back in menu
-
-                    cleaned_count += 1
-                else:
-                    # Game was already removed between finding it and trying to pop it (race condition? unlikely but possible)
-                    log_net.warning(f"Attempted to clean game {gid}, but it was already removed from dict.")
+                # Ensure loop task is cancelled if it wasn't already
+                if game.loop_task and not game.loop_task.done():
+                    log_net.warning(f"Game {game.game_id} was finished but loop task was not done. Cancelling now in cleanup.")
+                    game.loop_task.cancel()
+                self._drop_game(game)
             except Exception as e:
-                log_net.error(f"Error during cleanup for game {gid}: {e}", exc_info=True)
-
-        log_net.info(f"Cleanup processed {len(finished_ids)} IDs. Successfully cleaned: {cleaned_count}. Active games remaining: {len(self.games)}")
-        # log_net.debug("--- Exiting cleanup_finished_games (finished processing) ---") # Can be noisy
+                log_net.error(f"Error during cleanup for game {game.game_id}: {e}", exc_info=True)
+
+        log_net.info(f"Sweep cleaned {len(finished)} games. Active games remaining: {len(self.games)}")
+
+# --- Static Asset Serving ---
+class StaticAsset:
+    """One file held in memory with its precomputed encodings and ETags."""
+    def __init__(self, rel_path, body):
+        self.rel_path = rel_path
+        self.body = body
+        content_type, _ = mimetypes.guess_type(rel_path)
+        if rel_path.endswith('.js'): content_type = 'application/javascript' # mimetypes varies by platform
+        self.content_type = content_type or 'application/octet-stream'
+        self.cache_control = STATIC_HTML_CACHE_CONTROL if self.content_type == 'text/html' else STATIC_CACHE_CONTROL
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.variants = {} # encoding -> (body, etag)
+        if self.content_type in STATIC_COMPRESSIBLE_TYPES and len(body) >= STATIC_MIN_COMPRESS_SIZE:
+            if brotli is not None:
+                self._add_variant('br', brotli.compress(body, quality=11))
+            self._add_variant('gzip', gzip.compress(body, compresslevel=9, mtime=0))
+        self.all_etags = [self.etag] + [etag for _, etag in self.variants.values()]
+
+    def _add_variant(self, encoding, compressed):
+        if len(compressed) < len(self.body): # Keep only if it actually helps
+            self.variants[encoding] = (compressed, f'"{self.etag[1:-1]}-{encoding}"')
+
+    def pick_encoding(self, accept_encoding):
+        """Chooses the best precomputed encoding the client accepts (br > gzip > identity)."""
+        if not self.variants or not accept_encoding:
+            return None
+        accepted = set()
+        for token in accept_encoding.split(','):
+            name, _, params = token.strip().partition(';')
+            params = params.strip().replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    if float(params[2:]) <= 0: continue # Explicitly refused
+                except ValueError:
+                    continue
+            accepted.add(name.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return None
+
+def parse_byte_range(range_header, size):
+    """
+    Parses a single 'bytes=' range. Returns (start, end) inclusive, None to serve the full body
+    (missing/multi-range/malformed header), or 'unsatisfiable'.
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start_s, sep, end_s = range_header[6:].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start_s == '': # Suffix range: last N bytes
+            length = int(end_s)
+            if length <= 0: return 'unsatisfiable'
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, min(end, size - 1)
+
+class StaticAssetCache:
+    """
+    Loads the client files once at startup and serves them from memory: precompressed gzip/brotli
+    variants, content-hash ETags with 304s, and Range support for the larger sound files.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.assets = {} # URL path -> StaticAsset
+
+    def load(self):
+        rel_paths = list(STATIC_FILES)
+        for pattern in STATIC_GLOBS:
+            rel_paths.extend(sorted(os.path.relpath(p, self.root).replace(os.sep, '/') for p in glob.glob(os.path.join(self.root, pattern))))
+        self.assets.clear()
+        total_bytes = 0
+        for rel_path in rel_paths:
+            file_path = os.path.join(self.root, rel_path)
+            try:
+                with open(file_path, 'rb') as f:
+                    asset = StaticAsset(rel_path, f.read())
+            except OSError as e:
+                log_main.warning(f"Static asset '{rel_path}' not loaded: {e}")
+                continue
+            self.assets['/' + rel_path] = asset
+            total_bytes += len(asset.body)
+        if '/index.html' in self.assets:
+            self.assets['/'] = self.assets['/index.html']
+        log_main.info(f"Loaded {len(set(self.assets.values()))} static assets ({total_bytes / 1024:.0f} KiB, brotli={'on' if brotli else 'off'}).")
+
+    def add_routes(self, router):
+        for url_path in self.assets:
+            router.add_get(url_path, self.handle)
+        if '/' not in self.assets: # Keep '/' answering even if index.html is missing on disk
+            router.add_get('/', self.handle)
+
+    async def handle(self, request):
+        asset = self.assets.get(request.path)
+        if asset is None:
+            log_main.error(f"Static asset not found for path: {request.path}")
+            return web.Response(status=404, text=f"Error: {request.path} not found on server")
+
+        encoding = asset.pick_encoding(request.headers.get('Accept-Encoding'))
+        body, etag = asset.variants[encoding] if encoding else (asset.body, asset.etag)
+        headers = {'ETag': etag, 'Cache-Control': asset.cache_control, 'Vary': 'Accept-Encoding'}
+        if not asset.variants:
+            headers['Accept-Ranges'] = 'bytes'
+            del headers['Vary']
+
+        # Any representation's ETag is good for a 304 (the client re-sends whichever it holds)
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and any(etag_matches(if_none_match, candidate) for candidate in asset.all_etags):
+            return web.Response(status=304, headers=headers)
+
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        elif 'Range' in request.headers:
+            if_range = request.headers.get('If-Range')
+            byte_range = parse_byte_range(request.headers['Range'], len(body)) if not if_range or if_range == etag else None
+            if byte_range == 'unsatisfiable':
+                headers['Content-Range'] = f"bytes */{len(body)}"
+                return web.Response(status=416, headers=headers)
+            if byte_range:
+                start, end = byte_range
+                headers['Content-Range'] = f"bytes {start}-{end}/{len(body)}"
+                return web.Response(status=206, body=body[start:end + 1], content_type=asset.content_type, headers=headers)
+        return web.Response(body=body, content_type=asset.content_type, headers=headers)
 
 # --- Global Instance ---
 network_server = KellyGangGameServer()
+static_assets = StaticAssetCache(STATIC_ROOT)
 
 # --- aiohttp Handlers & Setup ---
-async def handle_index(request):
+async def handle_high_scores(request):
+    """GET /highscores?players=&period=&offset=&limit= - cacheable leaderboard slice (ETag / 304)."""
     try:
-        script_dir = os.path.dirname(__file__)
-        # --- IMPORTANT: Ensure your HTML file is named index.html ---
-        file_path = os.path.join(script_dir, 'index.html')
-        if os.path.exists(file_path):
-            log_main.debug(f"Serving index.html from: {file_path}")
-            return web.FileResponse(file_path)
-        else:
-            log_main.error(f"index.html not found at expected path: {file_path}")
-            # Provide a more informative error if file is missing
-            return web.Response(status=404, text=f"Error: index.html not found on server at {file_path}")
-    except Exception as e:
-        log_main.error(f"Error serving index.html: {e}", exc_info=True)
-        return web.Response(status=500, text="Internal Server Error serving index.html")
+        players, period, offset, limit = parse_leaderboard_query(request.query)
+    except (ValueError, TypeError) as query_err:
+        return web.json_response({'type': 'error', 'message': f'Invalid high score query: {query_err}'}, status=400)
+
+    body, etag = network_server.render_high_scores_page(players, period, offset, limit)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={HIGHSCORES_HTTP_MAX_AGE}',
+        'Access-Control-Allow-Origin': '*', # Client is hosted separately (GitHub Pages)
+        'Access-Control-Expose-Headers': 'ETag',
+    }
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type='application/json', headers=headers)
+
+async def handle_metrics(request):
+    """JSON snapshot of connection/session metrics (connect -> first game_state latency)."""
+    body = {'handshake': HANDSHAKE_MODE,
+            'connections': len(network_server.connections),
+            'games': len(network_server.games),
+            'game_pool': network_server.game_pool.stats(),
+            'open_lobbies': len(network_server.matchmaking),
+            'resumable_sessions': len(network_server.sessions),
+            'draining': network_server.draining,
+            'spectators': network_server.spectators.stats(),
+            'cluster': {'shard': network_server.shard, **network_server.registry.stats()} if network_server.registry else None,
+            'tick_load': tick_load.stats(),
+            'connect_to_first_state': network_server.metrics.latency_summary()}
+    return web.json_response(body, headers={'Cache-Control': 'no-store'})
 
 async def websocket_handler(request):
     # --- Enable Heartbeat Here ---
@@ -2066,39 +4210,35 @@ async def websocket_handler(request):
 
     try:
         await ws.prepare(request)
+        network_server.connections.register(ws, client_ip)
         log_net.info(f"[{temp_log_id}] WS connection prepared for: {client_ip}")
 
-        # --- KEEP the hello test and delay for now ---
-        initial_delay = 0.3
-        log_net.debug(f"[{temp_log_id}] Applying {initial_delay}s initial delay...")
-        await asyncio.sleep(initial_delay)
-
-        if ws.closed:
-            log_net.warning(f"[{temp_log_id}] WS for {client_ip} closed during initial delay. Aborting handler.")
-            return ws
+        if HANDSHAKE_MODE == 'legacy':
+            # Old clients/tools that wait for a standalone hello before associating
+            log_net.debug(f"[{temp_log_id}] Applying {HANDSHAKE_LEGACY_DELAY}s initial delay...")
+            await asyncio.sleep(HANDSHAKE_LEGACY_DELAY)
 
-        log_net.debug(f"[{temp_log_id}] WS for {client_ip} still open after delay.")
+            if ws.closed:
+                log_net.warning(f"[{temp_log_id}] WS for {client_ip} closed during initial delay. Aborting handler.")
+                network_server.connections.unregister(ws)
+                return ws
 
-        hello_sent_ok = False
-        try:
-            hello_payload = json.dumps({'type': 'hello_from_server', 'message': 'Connection test successful.'})
-            await ws.send_str(hello_payload)
-            hello_sent_ok = True
-            log_net.info(f"[{temp_log_id}] Initial 'hello' send to {client_ip} SUCCEEDED.")
-        except Exception as e_hello:
-            log_net.error(f"[{temp_log_id}] Initial 'hello' send failed (Exception: {e_hello}) for {client_ip}. Closing WS.", exc_info=False)
-            if not ws.closed: await ws.close()
-            return ws
-        # --- END hello test ---
-
-        if not hello_sent_ok: # Safeguard
-            if not ws.closed: await ws.close()
-            return ws
+            try:
+                await network_server._send_direct(ws, {'type': 'hello_from_server', **server_hello()})
+                log_net.info(f"[{temp_log_id}] Initial 'hello' send to {client_ip} SUCCEEDED.")
+            except Exception as e_hello:
+                log_net.error(f"[{temp_log_id}] Initial 'hello' send failed (Exception: {e_hello}) for {client_ip}. Closing WS.", exc_info=False)
+                if not ws.closed: await ws.close()
+                network_server.connections.unregister(ws)
+                return ws
+        # In 'fast' mode the first association message is processed immediately and the hello
+        # is folded into its response (see _send_association_response).
 
         log_net.debug(f"[{temp_log_id}] Proceeding to main message loop for {client_ip}...")
 
     except Exception as e_prepare:
         log_net.error(f"[{temp_log_id}] WebSocket prepare failed for {client_ip}: {e_prepare}", exc_info=True)
+        network_server.connections.unregister(ws) # These early exits never reach the main loop's finally
         return ws
 
     # --- Initialize variables for the message loop ---
@@ -2126,47 +4266,69 @@ async def websocket_handler(request):
 
                      data = json.loads(msg.data)
                      msg_type = data.get('type')
+                     if 'protocol_version' in data:
+                         conn = network_server.connections.info_for_ws(ws)
+                         if conn and isinstance(data['protocol_version'], int): conn.protocol_version = data['protocol_version']
 
                      # --- Message Handling Logic ---
                      # 1. Highscore Submit
                      if msg_type == 'submit_highscore_name':
                          p_name = data.get('name'); p_score = data.get('score'); p_max_players = data.get('max_players')
                          log_net.debug(f"[{handler_log_id}] Rcvd highscore submit: {p_name}/{p_score}/{p_max_players}")
-                         if p_name and isinstance(p_score, int) and p_score >= 0 and isinstance(p_max_players, int) and p_max_players > 0:
+                         if p_name and isinstance(p_score, int) and p_score >= 0 and isinstance(p_max_players, int) and 0 < p_max_players <= MAX_PLAYERS:
                              network_server.add_highscore_entry(p_name, p_score, p_max_players)
                          else: log_net.warning(f"[{handler_log_id}] Invalid highscore submit format: {data}")
 
                      # 2. Highscore Request (Client shouldn't send auto)
                      elif msg_type == 'request_high_scores':
                          log_net.debug(f"[{handler_log_id}] Rcvd request_high_scores from {client_ip}")
+                         try:
+                             players, period, offset, limit = parse_leaderboard_query(data)
+                         except (ValueError, TypeError) as query_err:
+                             log_net.warning(f"[{handler_log_id}] Invalid request_high_scores params: {query_err}")
+                             await ws.send_str(json.dumps({'type': 'error', 'message': f'Invalid high score query: {query_err}'}))
+                             continue
                          if ws and not ws.closed:
-                             success = await network_server._send_dict_to_player(
-                                 ws, {'type': 'high_scores_list', 'scores': network_server.high_scores}
-                             )
+                             payload = network_server.get_high_scores_page(players, period, offset, limit)
+                             if isinstance(data.get('score'), (int, float)):
+                                 payload['rank'] = network_server.leaderboard.rank_of(data['score'], players, period)
+                             success = await network_server._send_dict_to_player(ws, payload)
                              if not success: log_net.warning(f"[{handler_log_id}] Failed sending high_scores_list back via WS object.")
                          else: log_net.warning(f"[{handler_log_id}] Cannot send high scores: WS invalid/closed.")
 
                      # 3. Association Logic
-                     elif not connection_info and msg_type in ['create_game', 'join_game', 'start_single_player']:
+                     elif not connection_info and msg_type in ['create_game', 'join_game', 'quick_join', 'start_single_player', 'resume_session', 'spectate']:
+                         if network_server.draining and msg_type in ('create_game', 'quick_join', 'start_single_player'):
+                             log_net.info(f"[{handler_log_id}] Refusing '{msg_type}' while draining.")
+                             await ws.send_str(json.dumps({'type': 'error', 'message': 'Server is restarting. Please try again shortly.'}))
+                             continue
                          is_associating = True
                          temp_conn_info = None
                          log_net.info(f"[{handler_log_id}] Starting association: '{msg_type}'...")
                          try:
                              if msg_type == 'create_game':
-                                 temp_conn_info = await network_server.create_game(ws, data.get('max_players'))
+                                 temp_conn_info = await network_server.create_game(ws, data.get('max_players'), public=bool(data.get('public', False)))
+                             elif msg_type == 'quick_join':
+                                 temp_conn_info = await network_server.quick_join(ws, data.get('max_players'))
                              elif msg_type == 'join_game':
                                  req_game_id = data.get('game_id')
                                  if req_game_id: temp_conn_info = await network_server.join_game(ws, req_game_id)
                                  else: log_net.warning(f"[{handler_log_id}] Join attempt missing game_id.")
                              elif msg_type == 'start_single_player':
                                  temp_conn_info = await network_server.create_single_player_game(ws)
+                             elif msg_type == 'resume_session':
+                                 temp_conn_info = await network_server.resume_session(ws, data.get('token'))
+                             elif msg_type == 'spectate':
+                                 req_game_id = data.get('game_id')
+                                 if req_game_id: temp_conn_info = await network_server.spectate_game(ws, req_game_id)
+                                 else: log_net.warning(f"[{handler_log_id}] Spectate attempt missing game_id.")
 
                              if temp_conn_info:
                                  connection_info = temp_conn_info
                                  player_id = connection_info.get('player_id')
                                  game_id = connection_info.get('game_id')
                                  handler_log_id = player_id[:6] if player_id else handler_log_id
-                                 log_net.info(f"[{handler_log_id}] Association SUCCEEDED for '{msg_type}'. PID:{player_id[:6]} GID:{game_id}")
+                                 log_net.info(f"[{handler_log_id}] Association SUCCEEDED for '{msg_type}'. PID:{player_id[:6] if player_id else 'spectator'} GID:{game_id}")
                              else:
                                  log_net.warning(f"[{handler_log_id}] Association FAILED for '{msg_type}' (server returned None).")
 
@@ -2181,6 +4343,8 @@ async def websocket_handler(request):
                      # 4. Routing Logic
                      elif connection_info:
                          if player_id: await network_server.route_to_game(player_id, data)
+                         elif connection_info.get('spectator'):
+                             log_sampled(log_net, logging.DEBUG, 'spectate.input', "Ignoring '%s' from spectator of %s.", msg_type, game_id)
                          else:
                              log_net.error(f"[{handler_log_id}] State inconsistency: Conn info but no player_id. Closing.")
                              if not ws.closed: await ws.close(code=1011, message=b"Internal state error")
@@ -2223,8 +4387,12 @@ async def websocket_handler(request):
     finally:
         final_log_id = player_id[:6] if player_id else temp_log_id
         log_net.info(f"[{final_log_id}] WS Cleanup initiated (Associated PID: {player_id}, Game: {game_id})")
-        if player_id: await network_server.handle_disconnect(player_id)
+        # A clean 1000 close from the client is a deliberate exit; anything else may be a network drop worth holding
+        if player_id: await network_server.handle_disconnect(player_id, ws, allow_resume=ws.close_code != 1000)
         else: log_net.debug(f"[{final_log_id}] Cleanup: No player ID was associated.")
+        network_server.spectators.remove(ws)
+        conn = network_server.connections.unregister(ws)
+        if conn: log_net.debug(f"[{final_log_id}] Connection stats: {conn.messages_sent} msgs / {conn.bytes_sent} bytes sent in {time.monotonic() - conn.connected_at:.1f}s (protocol v{conn.protocol_version}).")
         if ws and not ws.closed:
             log_net.debug(f"[{final_log_id}] Ensuring WS is closed.")
             close_code = ws.close_code if ws.close_code else 1001
@@ -2236,21 +4404,37 @@ async def websocket_handler(request):
 
 async def periodic_cleanup(server_instance):
     while True:
-        await asyncio.sleep(60) # Run every 60 seconds
+        await asyncio.sleep(GAME_SWEEP_INTERVAL) # Safety net only; finished games are released by their callback
         log_main.debug("Running periodic cleanup task...")
         try:
             await server_instance.cleanup_finished_games()
+            server_instance.adopt_handoffs() # Hand-offs nobody resumed into yet
         except Exception as e:
             log_main.error(f"Error during periodic cleanup task: {e}", exc_info=True)
 
+async def cluster_heartbeat(server_instance):
+    while True:
+        await asyncio.sleep(CLUSTER_HEARTBEAT_INTERVAL)
+        try:
+            server_instance.registry.heartbeat(server_instance.shard)
+        except Exception as e:
+            log_main.error(f"Cluster heartbeat failed: {e}")
+
 async def main():
     log_main.info("Setting up aiohttp app...")
     app = web.Application()
-    app.router.add_get('/', handle_index)
     app.router.add_get('/ws', websocket_handler)
-    async def handle_health(request): return web.Response(status=200, text="OK")
+    app.router.add_get('/highscores', handle_high_scores)
+    async def handle_health(request):
+        if network_server.draining: # Load balancers stop sending new players here
+            return web.Response(status=503, text="Draining")
+        return web.Response(status=200, text="OK")
     app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', handle_metrics)
     app['network_server'] = network_server # Make server instance accessible if needed
+    static_assets.load() # Read client files once; served from memory afterwards
+    network_server.game_pool.prewarm()
+    static_assets.add_routes(app.router)
 
     # --- Server Startup ---
     HOST = '0.0.0.0' # Listen on all available interfaces
@@ -2258,8 +4442,10 @@ async def main():
 
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, HOST, PORT)
+    # Hand-off deploys start the successor on the same port before draining this process
+    site = web.TCPSite(runner, HOST, PORT, reuse_port=DRAIN_MODE == 'handoff' and hasattr(socket, 'SO_REUSEPORT'))
     cleanup_task = None
+    heartbeat_task = None
 
     try:
         await site.start()
@@ -2269,6 +4455,28 @@ async def main():
         cleanup_task = asyncio.create_task(periodic_cleanup(network_server))
         log_main.info("Periodic cleanup task started.")
 
+        adopted = network_server.adopt_handoffs() # Games a draining predecessor already left for us
+        if adopted:
+            log_main.info(f"Adopted {adopted} handed-off games on startup.")
+
+        async def drain_then_stop():
+            await network_server.drain(stop_listening=site.stop)
+            cleanup_task.cancel() # Ends the wait below; shutdown proceeds as usual
+        def on_sigterm():
+            if network_server.draining is None:
+                log_main.warning(f"SIGTERM received. Draining ({DRAIN_MODE}).")
+                asyncio.create_task(drain_then_stop())
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, on_sigterm)
+        except (NotImplementedError, RuntimeError):
+            log_main.warning("SIGTERM drain unavailable on this platform.")
+
+        if network_server.registry:
+            node_url = NODE_URL or f"ws://localhost:{PORT}/ws"
+            network_server.registry.register_node(network_server.shard, node_url)
+            heartbeat_task = asyncio.create_task(cluster_heartbeat(network_server))
+            log_main.info(f"Cluster node '{network_server.shard}' registered at {node_url}.")
+
         # Keep the server running indefinitely (or until interrupted)
         log_main.info("Entering main server loop (awaiting termination)...")
         # Instead of sleeping, await the cleanup task completion,
@@ -2297,6 +4505,14 @@ async def main():
                  log_main.error(f"Error during cleanup task cancellation: {ct_err}")
              log_main.info("Cleanup task cancelled.")
 
+        if heartbeat_task:
+            heartbeat_task.cancel()
+        if network_server.registry and network_server.draining != 'handoff': # The successor keeps our shard
+            try:
+                network_server.registry.unregister_node(network_server.shard) # Stop other nodes redirecting here
+            except Exception as reg_err:
+                log_main.error(f"Error leaving cluster registry: {reg_err}")
+
         # --- Shutdown Active Game Loops ---
         log_main.info("Stopping active game loops...")
         active_games = list(network_server.games.values()) # Get games before iterating
@@ -2318,7 +4534,7 @@ async def main():
 
         # --- Close Remaining Client Connections ---
         log_main.info("Closing remaining client connections...")
-        client_ids = list(network_server.clients.keys()) # Get IDs before iterating
+        client_ids = network_server.connections.player_ids() # Get IDs before iterating
         if client_ids:
             close_tasks = [network_server.close_client_connection(pid, 1001, "Server Shutdown") for pid in client_ids]
             await asyncio.gather(*close_tasks, return_exceptions=True)
@@ -2328,14 +4544,361 @@ async def main():
 
         # --- Stop Web Server ---
         log_main.info("Stopping web server site...")
-        await site.stop() # Stop listening for new connections
+        if site in runner.sites: # A hand-off drain already stopped it
+            await site.stop() # Stop listening for new connections
         log_main.info("Cleaning up application runner...")
         await runner.cleanup() # Clean up resources
         log_main.info("Application runner cleaned up.")
 
         log_main.info("Shutdown complete.")
 
+# --- Replay Inspector ---
+def verify_replays(paths):
+    """Round-trip check: re-simulates each finished replay and compares it with its end record. Files from
+    another REPLAY_SIM_VERSION are skipped, so a gameplay change that didn't bump it shows up as mismatches."""
+    counts = collections.Counter()
+    for path in paths:
+        try:
+            input_log, end = read_replay(path)
+        except (OSError, ValueError) as e:
+            counts['skipped'] += 1
+            print(f"SKIP      {path}: {e}")
+            continue
+        if not end:
+            counts['skipped'] += 1
+            print(f"SKIP      {path}: no end record")
+            continue
+        mismatches = replay_mismatches(replay_game(input_log), end)
+        counts['mismatch' if mismatches else 'ok'] += 1
+        print(f"{'MISMATCH' if mismatches else 'ok':<9} {path}{': ' + '; '.join(mismatches) if mismatches else ''}")
+    print(f"{counts['ok']} reproduced, {counts['mismatch']} diverged, {counts['skipped']} skipped (simulation version {REPLAY_SIM_VERSION})")
+    return 1 if counts['mismatch'] else 0
+
+def inspect_replay(argv):
+    """`python run.py replay FILE [...]`: summary, timeline, per-tick counts/costs and snapshots of a replay file."""
+    parser = argparse.ArgumentParser(prog='run.py replay', description='Inspect a recorded game replay.')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--verify', action='store_true', help='Re-simulate every FILE and check it reproduces its recorded end (exit 1 if any diverge)')
+    parser.add_argument('--timeline', action='store_true', help='List every recorded input and override by tick')
+    parser.add_argument('--counts', type=int, metavar='N', help='Re-simulate and print entity counts and tick costs every N ticks')
+    parser.add_argument('--slowest', type=int, metavar='K', help='List the K ticks with the highest recorded cost')
+    parser.add_argument('--snapshot', type=int, metavar='TICK', action='append', help='Re-simulate and print the game state after TICK (repeatable)')
+    args = parser.parse_args(argv) # LOG_LEVEL defaults to WARNING here, so re-simulation doesn't log like a live game
+    if args.verify:
+        return verify_replays(args.files)
+    if len(args.files) > 1:
+        parser.error('inspect one FILE at a time (or use --verify)')
+
+    try:
+        input_log, end = read_replay(args.files[0])
+    except (OSError, ValueError) as e:
+        print(f"Cannot inspect: {e}", file=sys.stderr)
+        return 2
+    ticks = len(input_log.deltas)
+    duration = sum(input_log.deltas) / REPLAY_DELTA_SCALE
+    costs = input_log.costs
+    active_costs = [c for c in costs if c]
+    print(f"Game {input_log.game_id}  host={input_log.host_id}  seed={input_log.seed}  max_players={input_log.max_players}")
+    print(f"Started {datetime.fromtimestamp(input_log.clock_start, timezone.utc).isoformat()}  "
+          f"{ticks} ticks / {duration:.1f}s  {len(input_log.inputs)} inputs  {len(input_log.overrides)} overrides")
+    print(f"End: {end if end else 'not recorded (game still running or server stopped)'}")
+    if active_costs:
+        ordered = sorted(active_costs)
+        print(f"Tick cost (us): mean {sum(ordered) / len(ordered):.0f}  p50 {ordered[len(ordered) // 2]}  "
+              f"p99 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]}  max {ordered[-1]}  "
+              f"over budget {sum(1 for c in ordered if c > TICK_RATE * 1e6)}")
+
+    if args.timeline:
+        entries = sorted([(e[0], 'input', e[1:]) for e in input_log.inputs] + [(e[0], 'override', e[1:]) for e in input_log.overrides],
+                         key=operator.itemgetter(0))
+        for tick, source, entry in entries:
+            print(f"  tick {tick:>6}  {source:<8}  {' '.join(str(v) for v in entry)}")
+
+    if args.slowest:
+        slowest = sorted(range(len(costs)), key=costs.__getitem__, reverse=True)[:args.slowest]
+        for i in slowest:
+            print(f"  tick {i + 1:>6}  {costs[i]:>7} us")
+
+    if args.counts or args.snapshot:
+        wanted = set(args.snapshot or ())
+        print(f"{'tick':>6} {'t':>7} {'status':<9} {'players':>7} {'enemies':>7} {'bullets':>7} {'powerups':>8} {'cost_us':>8} {'replay_us':>9}")
+        game = None
+        for game, spent in replay_ticks(input_log):
+            if args.counts and game.tick % args.counts == 0:
+                print(f"{game.tick:>6} {game.clock - input_log.clock_start:>7.2f} {game.status:<9} {len(game.players):>7} "
+                      f"{len(game.enemies):>7} {len(game.bullets):>7} {len(game.powerups):>8} {costs[game.tick - 1] if game.tick <= len(costs) else '':>8} {round(spent * 1e6):>9}")
+            if game.tick in wanted:
+                print(f"--- snapshot after tick {game.tick} ---")
+                print(json.dumps(game.get_state(), indent=1, default=str))
+        mismatches = replay_mismatches(game, end) if end else []
+        if mismatches:
+            print(f"WARNING: re-simulation diverged from the recorded end ({'; '.join(mismatches)}); "
+                  f"the counts and snapshots above are not the game that was played", file=sys.stderr)
+            return 1
+    return 0
+
+# --- Load Generator ---
+class BotStats:
+    """What one load bot measured over all of its sessions."""
+    __slots__ = ('connect', 'associate', 'gaps', 'bytes_in', 'bytes_out', 'states', 'sessions', 'errors', 'active_time')
+
+    def __init__(self):
+        self.connect = []   # Seconds from dial to open socket
+        self.associate = [] # Seconds from association request to its response
+        self.gaps = []      # Seconds between consecutive game_state messages
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.states = 0
+        self.sessions = 0
+        self.errors = 0
+        self.active_time = 0.0 # Seconds spent associated with a game
+
+class LoadBot:
+    """
+    One simulated player: joins a game, then plays like the browser client does while active:
+    player_move at the input rate with a wandering direction, plus trigger_down/aim_update/trigger_up
+    bursts aimed at the nearest enemy it has seen.
+    """
+    ASSOCIATED = ('game_created', 'game_joined', 'sp_game_started')
+
+    def __init__(self, session, url, rng, input_hz):
+        self.session = session
+        self.url = url
+        self.rng = rng
+        self.input_interval = 1.0 / input_hz
+        self.stats = BotStats()
+        self.state = None
+        self.player_id = None
+
+    async def _send(self, ws, payload):
+        message = json.dumps(payload)
+        await ws.send_str(message)
+        self.stats.bytes_out += len(message)
+
+    async def play(self, association, deadline, game_id_future=None):
+        """One session: connect, associate, play until the game finishes or the deadline.
+        Returns False if the bot never got into a game (connect or association failed), once the socket is closed."""
+        stats = self.stats
+        dialled = time.perf_counter()
+        try:
+            ws = await self.session.ws_connect(self.url, heartbeat=10.0)
+        except (aiohttp.ClientError, OSError) as e:
+            stats.errors += 1
+            log_main.warning(f"Load bot could not connect: {e}")
+            if game_id_future is not None and not game_id_future.done(): game_id_future.cancel()
+            return False
+        stats.connect.append(time.perf_counter() - dialled)
+        stats.sessions += 1
+        self.state = None
+        sender = None
+        associated = False
+        try:
+            asked = time.perf_counter()
+            await self._send(ws, association)
+            while True:
+                msg = await asyncio.wait_for(ws.receive(), timeout=10.0)
+                if msg.type != WSMsgType.TEXT:
+                    raise ConnectionError(f"closed during association ({ws.close_code})")
+                data = json.loads(msg.data)
+                stats.bytes_in += len(msg.data)
+                if data.get('type') in self.ASSOCIATED:
+                    break
+                if data.get('type') == 'error':
+                    raise ConnectionError(data.get('message'))
+            stats.associate.append(time.perf_counter() - asked)
+            associated = True
+            if game_id_future is not None and not game_id_future.done():
+                game_id_future.set_result(data['game_id'])
+            self.player_id = data.get('player_id')
+            self.state = data.get('initial_state')
+
+            associated_at = time.monotonic()
+            sender = asyncio.create_task(self._send_inputs(ws))
+            last_state_at = None
+            while time.monotonic() < deadline:
+                try:
+                    msg = await asyncio.wait_for(ws.receive(), timeout=max(0.01, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                if msg.type != WSMsgType.TEXT:
+                    break
+                stats.bytes_in += len(msg.data)
+                data = json.loads(msg.data)
+                if data.get('type') != 'game_state':
+                    continue
+                now = time.monotonic()
+                if last_state_at is not None:
+                    stats.gaps.append(now - last_state_at)
+                last_state_at = now
+                stats.states += 1
+                self.state = data['state']
+                if self.state.get('status') == 'finished':
+                    break
+            stats.active_time += time.monotonic() - associated_at
+        except (ConnectionError, asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            stats.errors += 1
+            log_main.warning(f"Load bot session failed: {e}")
+            if game_id_future is not None and not game_id_future.done(): game_id_future.cancel()
+        finally:
+            if sender is not None:
+                sender.cancel()
+                await asyncio.gather(sender, return_exceptions=True)
+            if not ws.closed:
+                try:
+                    await self._send(ws, {'type': 'leave_game'})
+                except Exception:
+                    pass
+                await ws.close()
+        return associated
+
+    def _aim(self):
+        """Nearest enemy in the last state, else somewhere random on the map."""
+        state, rng = self.state or {}, self.rng
+        me = state.get('players', {}).get(self.player_id)
+        enemies = state.get('enemies') or {}
+        if me and enemies:
+            target = min(enemies.values(), key=lambda e: distance_sq(e['x'], e['y'], me['x'], me['y']))
+            return {'x': target['x'] + rng.uniform(-10, 10), 'y': target['y'] + rng.uniform(-10, 10)}
+        return {'x': rng.uniform(0, CANVAS_WIDTH), 'y': rng.uniform(0, CANVAS_HEIGHT)}
+
+    async def _send_inputs(self, ws):
+        rng = self.rng
+        angle = rng.uniform(0, 2 * math.pi)
+        next_burst = time.monotonic() + rng.uniform(0.5, 2.0)
+        burst_until = None
+        last_aim = 0.0
+        while not ws.closed:
+            await asyncio.sleep(self.input_interval)
+            state = self.state or {}
+            if state.get('status') != 'active':
+                continue
+            now = time.monotonic()
+            angle += rng.uniform(-0.4, 0.4) # Wander rather than jitter
+            await self._send(ws, {'type': 'player_move', 'direction': {'dx': math.cos(angle), 'dy': math.sin(angle)}})
+            view_time = state.get('timestamp')
+            if burst_until is None and now >= next_burst:
+                burst_until = now + rng.uniform(0.2, 1.0)
+                await self._send(ws, {'type': 'trigger_down', 'target': self._aim(), 'view_time': view_time})
+                last_aim = now
+            elif burst_until is not None and now >= burst_until:
+                await self._send(ws, {'type': 'trigger_up'})
+                burst_until = None
+                next_burst = now + rng.uniform(0.5, 2.0)
+            elif burst_until is not None and now - last_aim >= 0.1:
+                await self._send(ws, {'type': 'aim_update', 'target': self._aim(), 'view_time': view_time})
+                last_aim = now
+
+async def run_bot_group(bots, deadline):
+    """Plays back-to-back games until the deadline: one bot alone in single player, or the first bot
+    hosting a game sized for the group and the rest joining it."""
+    backoff = LOAD_BACKOFF_MIN
+    while time.monotonic() < deadline:
+        if len(bots) == 1:
+            played = await bots[0].play({'type': 'start_single_player'}, deadline)
+        else:
+            played = await _play_group_game(bots, deadline)
+        # Always pause between sessions; back off further while the server keeps refusing us
+        backoff = LOAD_BACKOFF_MIN if played else min(backoff * 2, LOAD_BACKOFF_MAX)
+        await asyncio.sleep(min(backoff, max(0.0, deadline - time.monotonic())))
+
+async def _play_group_game(bots, deadline):
+    """The first bot hosts a game sized for the group and the rest join it. True if the host got into a game."""
+    game_id = asyncio.get_running_loop().create_future()
+
+    async def join(bot):
+        try:
+            gid = await asyncio.wait_for(asyncio.shield(game_id), timeout=10.0)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            bot.stats.errors += 1
+            return
+        await bot.play({'type': 'join_game', 'game_id': gid}, deadline)
+
+    hosted, *_ = await asyncio.gather(bots[0].play({'type': 'create_game', 'max_players': len(bots)}, deadline, game_id),
+                                      *(join(bot) for bot in bots[1:]))
+    return hosted
+
+def summarize(samples, scale=1000.0):
+    """p50/p90/p99/max of samples (seconds -> ms by default)."""
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    def pct(q): return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale, 2)
+    return {'n': len(ordered), 'mean': round(sum(ordered) / len(ordered) * scale, 2),
+            'p50': pct(0.50), 'p90': pct(0.90), 'p99': pct(0.99), 'max': round(ordered[-1] * scale, 2)}
+
+def load_report(all_stats, elapsed):
+    jitter = [] # Per-client standard deviation of snapshot gaps
+    rate_in, rate_out = [], [] # Per-client bytes/second
+    for stats in all_stats:
+        if len(stats.gaps) > 1:
+            mean = sum(stats.gaps) / len(stats.gaps)
+            jitter.append(math.sqrt(sum((g - mean) ** 2 for g in stats.gaps) / len(stats.gaps)))
+        rate_in.append(stats.bytes_in / elapsed)
+        rate_out.append(stats.bytes_out / elapsed)
+    return {'clients': len(all_stats), 'elapsed_s': round(elapsed, 1),
+            'sessions': sum(s.sessions for s in all_stats), 'errors': sum(s.errors for s in all_stats),
+            'states_per_s': round(sum(s.states for s in all_stats) / elapsed, 1),
+            'bytes_in_per_s': round(sum(rate_in)), 'bytes_out_per_s': round(sum(rate_out)),
+            'connect_ms': summarize([t for s in all_stats for t in s.connect]),
+            'associate_ms': summarize([t for s in all_stats for t in s.associate]),
+            'snapshot_gap_ms': summarize([g for s in all_stats for g in s.gaps]),
+            'jitter_ms': summarize(jitter),
+            'client_bytes_in_per_s': summarize(rate_in, scale=1.0),
+            'client_bytes_out_per_s': summarize(rate_out, scale=1.0)}
+
+async def run_load(args):
+    rng = random.Random(args.seed)
+    connector = aiohttp.TCPConnector(limit=0) # One socket per bot; the default pool would queue them
+    async with aiohttp.ClientSession(connector=connector) as session:
+        bots = [LoadBot(session, args.url, random.Random(rng.random()), args.input_hz) for _ in range(args.clients)]
+        group_size = 1 if args.mode == 'sp' else args.group
+        groups = [bots[i:i + group_size] for i in range(0, len(bots), group_size)]
+        started = time.monotonic()
+        deadline = started + args.ramp + args.duration
+        tasks = []
+        for i, group in enumerate(groups):
+            if args.ramp and len(groups) > 1:
+                await asyncio.sleep(max(0.0, started + args.ramp * i / len(groups) - time.monotonic()))
+            tasks.append(asyncio.create_task(run_bot_group(group, deadline)))
+        await asyncio.gather(*tasks)
+        return load_report([bot.stats for bot in bots], time.monotonic() - started)
+
+def load_test(argv):
+    """`python run.py loadtest [...]`: a swarm of bots against a running server, reporting latency, jitter and bandwidth."""
+    parser = argparse.ArgumentParser(prog='run.py loadtest', description='Drive a running server with simulated players.')
+    parser.add_argument('--url', default=f"ws://127.0.0.1:{os.environ.get('PORT', 8765)}/ws")
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--mode', choices=('sp', 'mp'), default='sp', help="'sp': one single-player game per bot; 'mp': bots share games of --group players")
+    parser.add_argument('--group', type=int, default=2, help='Players per multiplayer game (2-%d)' % MAX_PLAYERS)
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load after the ramp')
+    parser.add_argument('--ramp', type=float, default=5.0, help='Seconds over which bots connect')
+    parser.add_argument('--input-hz', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args(argv)
+    if args.mode == 'mp' and not 2 <= args.group <= MAX_PLAYERS:
+        parser.error(f"--group must be between 2 and {MAX_PLAYERS}")
+
+    report = asyncio.run(run_load(args))
+    if args.json:
+        print(json.dumps(report, indent=1))
+        return 0
+    print(f"{report['clients']} clients ({args.mode}) for {report['elapsed_s']}s against {args.url}: "
+          f"{report['sessions']} sessions, {report['errors']} errors")
+    print(f"Swarm: {report['states_per_s']} snapshots/s, {report['bytes_in_per_s'] / 1024:.1f} KiB/s in, {report['bytes_out_per_s'] / 1024:.1f} KiB/s out")
+    print(f"{'':<24}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for key, label in (('connect_ms', 'connect (ms)'), ('associate_ms', 'associate (ms)'), ('snapshot_gap_ms', 'snapshot gap (ms)'),
+                       ('jitter_ms', 'jitter, client sd (ms)'), ('client_bytes_in_per_s', 'client in (B/s)'), ('client_bytes_out_per_s', 'client out (B/s)')):
+        row = report[key]
+        if row:
+            print(f"{label:<24}{row['p50']:>9}{row['p90']:>9}{row['p99']:>9}{row['max']:>9}")
+    return 0 if not report['errors'] else 1
+
 # --- Entry Point ---
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == 'replay':
+    sys.exit(inspect_replay(sys.argv[2:]))
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == 'loadtest':
+    sys.exit(load_test(sys.argv[2:]))
 if __name__ == "__main__":
     log_main.info("Running run.py directly...")
     try: